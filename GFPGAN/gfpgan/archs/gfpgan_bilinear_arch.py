@@ -261,7 +261,7 @@ class GFPGANBilinear(nn.Module):
                     ScaledLeakyReLU(0.2),
                     EqualConv2d(out_channels, sft_out_channels, 3, stride=1, padding=1, bias=True, bias_init_val=0)))
 
-    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True):
+    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True, noise=None):
         """Forward function for GFPGANBilinear.
 
         Args:
@@ -269,6 +269,7 @@ class GFPGANBilinear(nn.Module):
             return_latents (bool): Whether to return style latents. Default: False.
             return_rgb (bool): Whether return intermediate rgb images. Default: True.
             randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+            noise (list[Tensor] | None): Noise of each StyleConv layer of the decoder. Default: None.
         """
         conditions = []
         unet_skips = []
@@ -307,6 +308,7 @@ class GFPGANBilinear(nn.Module):
                                          conditions,
                                          return_latents=return_latents,
                                          input_is_latent=self.input_is_latent,
+                                         noise=noise,
                                          randomize_noise=randomize_noise)
 
         return image, out_rgbs
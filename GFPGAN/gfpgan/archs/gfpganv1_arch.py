@@ -176,8 +176,15 @@ class ConvUpLayer(nn.Module):
                 self.activation = ScaledLeakyReLU(0.2)
         else:
             self.activation = None
+        # run the conv before the upsampling, for 1x1 convs (see gfpgan.graph_optimizer)
+        self.conv_first = False
 
     def forward(self, x):
+        if self.conv_first:
+            # the 1x1 conv and the bilinear upsampling are both linear, and commute (the bias is kept by the upsampling)
+            out = F.conv2d(x, self.weight * self.scale, bias=self.bias)
+            out = F.interpolate(out, scale_factor=2, mode='bilinear', align_corners=False)
+            return out if self.activation is None else self.activation(out)
         # bilinear upsample
         out = F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False)
         # conv
@@ -350,7 +357,7 @@ class GFPGANv1(nn.Module):
                     ScaledLeakyReLU(0.2),
                     EqualConv2d(out_channels, sft_out_channels, 3, stride=1, padding=1, bias=True, bias_init_val=0)))
 
-    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True):
+    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True, noise=None):
         """Forward function for GFPGANv1.
 
         Args:
@@ -358,6 +365,7 @@ class GFPGANv1(nn.Module):
             return_latents (bool): Whether to return style latents. Default: False.
             return_rgb (bool): Whether return intermediate rgb images. Default: True.
             randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+            noise (list[Tensor] | None): Noise of each StyleConv layer of the decoder. Default: None.
         """
         conditions = []
         unet_skips = []
@@ -396,6 +404,7 @@ class GFPGANv1(nn.Module):
                                          conditions,
                                          return_latents=return_latents,
                                          input_is_latent=self.input_is_latent,
+                                         noise=noise,
                                          randomize_noise=randomize_noise)
 
         return image, out_rgbs
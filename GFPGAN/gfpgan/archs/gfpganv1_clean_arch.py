@@ -86,14 +86,15 @@ class StyleGAN2GeneratorCSFT(StyleGAN2GeneratorClean):
             latent = torch.cat([latent1, latent2], 1)
 
         # main generation
+        styles = iter(self.get_styles(latent))
         out = self.constant_input(latent.shape[0])
-        out = self.style_conv1(out, latent[:, 0], noise=noise[0])
-        skip = self.to_rgb1(out, latent[:, 1])
+        out = self.style_conv1(out, next(styles), noise=noise[0])
+        skip = self.to_rgb1(out, next(styles))
 
         i = 1
         for conv1, conv2, noise1, noise2, to_rgb in zip(self.style_convs[::2], self.style_convs[1::2], noise[1::2],
                                                         noise[2::2], self.to_rgbs):
-            out = conv1(out, latent[:, i], noise=noise1)
+            out = conv1(out, next(styles), noise=noise1)
 
             # the conditions may have fewer levels
             if i < len(conditions):
@@ -105,8 +106,8 @@ class StyleGAN2GeneratorCSFT(StyleGAN2GeneratorClean):
                 else:  # apply SFT to all the channels
                     out = out * conditions[i - 1] + conditions[i]
 
-            out = conv2(out, latent[:, i + 1], noise=noise2)
-            skip = to_rgb(out, latent[:, i + 2], skip)  # feature back to the rgb space
+            out = conv2(out, next(styles), noise=noise2)
+            skip = to_rgb(out, next(styles), skip)  # feature back to the rgb space
             i += 2
 
         image = skip
@@ -124,18 +125,21 @@ class ResBlock(nn.Module):
         in_channels (int): Channel number of the input.
         out_channels (int): Channel number of the output.
         mode (str): Upsampling/downsampling mode. Options: down | up. Default: down.
+        mid_channels (int | None): Channel number between the two convs. Default: None (in_channels).
     """
 
-    def __init__(self, in_channels, out_channels, mode='down'):
+    def __init__(self, in_channels, out_channels, mode='down', mid_channels=None):
         super(ResBlock, self).__init__()
+        mid_channels = in_channels if mid_channels is None else mid_channels
 
-        self.conv1 = nn.Conv2d(in_channels, in_channels, 3, 1, 1)
-        self.conv2 = nn.Conv2d(in_channels, out_channels, 3, 1, 1)
+        self.conv1 = nn.Conv2d(in_channels, mid_channels, 3, 1, 1)
+        self.conv2 = nn.Conv2d(mid_channels, out_channels, 3, 1, 1)
         self.skip = nn.Conv2d(in_channels, out_channels, 1, bias=False)
         if mode == 'down':
             self.scale_factor = 0.5
         elif mode == 'up':
             self.scale_factor = 2
+        self.skip_conv_first = False  # run the skip conv before the upsampling, see gfpgan.graph_optimizer
 
     def forward(self, x):
         out = F.leaky_relu_(self.conv1(x), negative_slope=0.2)
@@ -143,12 +147,46 @@ class ResBlock(nn.Module):
         out = F.interpolate(out, scale_factor=self.scale_factor, mode='bilinear', align_corners=False)
         out = F.leaky_relu_(self.conv2(out), negative_slope=0.2)
         # skip
+        if self.skip_conv_first:
+            # the 1x1 conv and the bilinear resampling are both linear, and commute
+            skip = F.interpolate(self.skip(x), scale_factor=self.scale_factor, mode='bilinear', align_corners=False)
+            return out.add_(skip)
         x = F.interpolate(x, scale_factor=self.scale_factor, mode='bilinear', align_corners=False)
         skip = self.skip(x)
         out = out + skip
         return out
 
 
+class _LazyConditions():
+    """The SFT conditions of GFPGANv1Clean, computed when the decoder uses them.
+
+    It is the list of conditions (the scale and shift of each level) for :class:`StyleGAN2GeneratorCSFT`. The scale
+    and shift of a level are computed the first time one of them is used, from the U-Net decoder features of the
+    previous level. Then the features, the skip and the conditions of the previous level are freed.
+    """
+
+    def __init__(self, gfpgan, feat, unet_skips):
+        self.gfpgan = gfpgan
+        self.feat = feat
+        self.unet_skips = unet_skips
+        self.level = -1
+        self.conditions = None
+
+    def __len__(self):
+        return 2 * len(self.unet_skips)
+
+    def __getitem__(self, idx):
+        level = idx // 2
+        if level != self.level:
+            if level != self.level + 1:
+                raise IndexError(f'The conditions are computed level by level, level {level} is requested '
+                                 f'after level {self.level}.')
+            self.conditions = None  # free the conditions of the previous level first
+            self.feat, self.conditions = self.gfpgan.decode_level(level, self.feat, self.unet_skips)
+            self.level = level
+        return self.conditions[idx % 2]
+
+
 @ARCH_REGISTRY.register()
 class GFPGANv1Clean(nn.Module):
     """The GFPGAN architecture: Unet + StyleGAN2 decoder with SFT.
@@ -169,6 +207,11 @@ class GFPGANv1Clean(nn.Module):
         different_w (bool): Whether to use different latent w for different layers. Default: False.
         narrow (float): The narrow ratio for channels. Default: 1.
         sft_half (bool): Whether to apply SFT on half of the input channels. Default: False.
+        channel_map (dict | None): Explicit channels, e.g. of a pruned model (see :mod:`gfpgan.pruning`), with the
+            optional keys: ``unet`` (dict of the U-Net channels of each level, e.g. ``{'512': 32}``), ``down`` /
+            ``up`` (list of the mid channels of each ResBlock), ``condition_scale`` / ``condition_shift`` (list of
+            the hidden channels of the SFT branches of each level). The missing ones are given by ``narrow``. The
+            channels of the decoder and of the SFT conditions are not changed. Default: None.
     """
 
     def __init__(
@@ -183,7 +226,8 @@ class GFPGANv1Clean(nn.Module):
             input_is_latent=False,
             different_w=False,
             narrow=1,
-            sft_half=False):
+            sft_half=False,
+            channel_map=None):
 
         super(GFPGANv1Clean, self).__init__()
         self.input_is_latent = input_is_latent
@@ -202,6 +246,10 @@ class GFPGANv1Clean(nn.Module):
             '512': int(32 * channel_multiplier * unet_narrow),
             '1024': int(16 * channel_multiplier * unet_narrow)
         }
+        # the SFT conditions match the decoder, so they keep the channels given by narrow
+        condition_channels = dict(channels)
+        channel_map = channel_map or {}
+        channels.update(channel_map.get('unet', {}))
 
         self.log_size = int(math.log(out_size, 2))
         first_out_size = 2**(int(math.log(out_size, 2)))
@@ -213,7 +261,8 @@ class GFPGANv1Clean(nn.Module):
         self.conv_body_down = nn.ModuleList()
         for i in range(self.log_size, 2, -1):
             out_channels = channels[f'{2**(i - 1)}']
-            self.conv_body_down.append(ResBlock(in_channels, out_channels, mode='down'))
+            mid_channels = channel_map['down'][self.log_size - i] if 'down' in channel_map else None
+            self.conv_body_down.append(ResBlock(in_channels, out_channels, mode='down', mid_channels=mid_channels))
             in_channels = out_channels
 
         self.final_conv = nn.Conv2d(in_channels, channels['4'], 3, 1, 1)
@@ -223,7 +272,8 @@ class GFPGANv1Clean(nn.Module):
         self.conv_body_up = nn.ModuleList()
         for i in range(3, self.log_size + 1):
             out_channels = channels[f'{2**i}']
-            self.conv_body_up.append(ResBlock(in_channels, out_channels, mode='up'))
+            mid_channels = channel_map['up'][i - 3] if 'up' in channel_map else None
+            self.conv_body_up.append(ResBlock(in_channels, out_channels, mode='up', mid_channels=mid_channels))
             in_channels = out_channels
 
         # to RGB
@@ -262,19 +312,21 @@ class GFPGANv1Clean(nn.Module):
         for i in range(3, self.log_size + 1):
             out_channels = channels[f'{2**i}']
             if sft_half:
-                sft_out_channels = out_channels
+                sft_out_channels = condition_channels[f'{2**i}']
             else:
-                sft_out_channels = out_channels * 2
+                sft_out_channels = condition_channels[f'{2**i}'] * 2
+            scale_channels = channel_map['condition_scale'][i - 3] if 'condition_scale' in channel_map else out_channels
+            shift_channels = channel_map['condition_shift'][i - 3] if 'condition_shift' in channel_map else out_channels
             self.condition_scale.append(
                 nn.Sequential(
-                    nn.Conv2d(out_channels, out_channels, 3, 1, 1), nn.LeakyReLU(0.2, True),
-                    nn.Conv2d(out_channels, sft_out_channels, 3, 1, 1)))
+                    nn.Conv2d(out_channels, scale_channels, 3, 1, 1), nn.LeakyReLU(0.2, True),
+                    nn.Conv2d(scale_channels, sft_out_channels, 3, 1, 1)))
             self.condition_shift.append(
                 nn.Sequential(
-                    nn.Conv2d(out_channels, out_channels, 3, 1, 1), nn.LeakyReLU(0.2, True),
-                    nn.Conv2d(out_channels, sft_out_channels, 3, 1, 1)))
+                    nn.Conv2d(out_channels, shift_channels, 3, 1, 1), nn.LeakyReLU(0.2, True),
+                    nn.Conv2d(shift_channels, sft_out_channels, 3, 1, 1)))
 
-    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True):
+    def forward(self, x, return_latents=False, return_rgb=True, randomize_noise=True, noise=None):
         """Forward function for GFPGANv1Clean.
 
         Args:
@@ -282,6 +334,7 @@ class GFPGANv1Clean(nn.Module):
             return_latents (bool): Whether to return style latents. Default: False.
             return_rgb (bool): Whether return intermediate rgb images. Default: True.
             randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+            noise (list[Tensor] | None): Noise of each StyleConv layer of the decoder. Default: None.
         """
         conditions = []
         unet_skips = []
@@ -295,7 +348,7 @@ class GFPGANv1Clean(nn.Module):
         feat = F.leaky_relu_(self.final_conv(feat), negative_slope=0.2)
 
         # style code
-        style_code = self.final_linear(feat.view(feat.size(0), -1))
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
         if self.different_w:
             style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
 
@@ -319,6 +372,64 @@ class GFPGANv1Clean(nn.Module):
                                          conditions,
                                          return_latents=return_latents,
                                          input_is_latent=self.input_is_latent,
+                                         noise=noise,
                                          randomize_noise=randomize_noise)
 
         return image, out_rgbs
+
+    def decode_level(self, i, feat, unet_skips):
+        """Run a level of the U-Net decoder, and get its SFT conditions, for inference.
+
+        The skip is added to ``feat`` in place, and freed.
+
+        Returns:
+            Tensor: The features of the level.
+            tuple[Tensor]: The scale and shift conditions.
+        """
+        feat = feat.add_(unet_skips[i])
+        unet_skips[i] = None
+        feat = self.conv_body_up[i](feat)
+        return feat, (self.condition_scale[i](feat), self.condition_shift[i](feat))
+
+    @torch.no_grad()
+    def inference(self, x, randomize_noise=True, noise=None, lazy_conditions=True):
+        """Inference forward with a lower peak memory. The outputs are the same as ``forward(x, return_rgb=False)``.
+
+        The U-Net skips are freed once consumed, the conditions are not cloned and the intermediate RGB images are not
+        computed. With ``lazy_conditions``, the conditions of each level are computed right before the decoder layers
+        that use them, so only one level of conditions is alive at a time.
+
+        Args:
+            x (Tensor): Input images.
+            randomize_noise (bool): Randomize noise, used when 'noise' is False. Default: True.
+            noise (list[Tensor] | None): Noise of each StyleConv layer of the decoder. Default: None.
+            lazy_conditions (bool): Compute the conditions when the decoder uses them. Default: True.
+
+        Returns:
+            Tensor: The restored images.
+        """
+        # encoder
+        unet_skips = []
+        feat = F.leaky_relu_(self.conv_body_first(x), negative_slope=0.2)
+        for i in range(self.log_size - 2):
+            feat = self.conv_body_down[i](feat)
+            unet_skips.insert(0, feat)
+        feat = F.leaky_relu_(self.final_conv(feat), negative_slope=0.2)
+
+        # style code
+        style_code = self.final_linear(feat.reshape(feat.size(0), -1))
+        if self.different_w:
+            style_code = style_code.view(style_code.size(0), -1, self.num_style_feat)
+
+        conditions = _LazyConditions(self, feat, unet_skips)
+        del feat, unet_skips  # only referenced by the lazy conditions, which free them
+        if not lazy_conditions:
+            conditions = [conditions[idx] for idx in range(len(conditions))]
+
+        # decoder
+        image, _ = self.stylegan_decoder([style_code],
+                                         conditions,
+                                         input_is_latent=self.input_is_latent,
+                                         noise=noise,
+                                         randomize_noise=randomize_noise)
+        return image
@@ -6,6 +6,8 @@ from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn
 from torch.nn import functional as F
 
+from .stylegan2_clean_arch import select_modulated_conv_strategy
+
 
 class NormStyleCode(nn.Module):
 
@@ -85,6 +87,8 @@ class ModulatedConv2d(nn.Module):
             Default: None.
         eps (float): A value added to the denominator for numerical stability.
             Default: 1e-8.
+        strategy (str): Execution strategy: 'grouped', 'activation' or 'auto'.
+            See the clean ModulatedConv2d. Default: 'auto'.
     """
 
     def __init__(self,
@@ -95,7 +99,8 @@ class ModulatedConv2d(nn.Module):
                  demodulate=True,
                  sample_mode=None,
                  eps=1e-8,
-                 interpolation_mode='bilinear'):
+                 interpolation_mode='bilinear',
+                 strategy='auto'):
         super(ModulatedConv2d, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -104,6 +109,7 @@ class ModulatedConv2d(nn.Module):
         self.sample_mode = sample_mode
         self.eps = eps
         self.interpolation_mode = interpolation_mode
+        self.strategy = strategy
         if self.interpolation_mode == 'nearest':
             self.align_corners = None
         else:
@@ -127,9 +133,27 @@ class ModulatedConv2d(nn.Module):
         Returns:
             Tensor: Modulated tensor after convolution.
         """
+        b, c, h, w = x.shape  # c = c_in
+        style = self.modulation(style)  # (b, c_in)
+        strategy = self.strategy
+        if strategy == 'auto':
+            out_hw = h * w * {'upsample': 4, 'downsample': 0.25}.get(self.sample_mode, 1)
+            strategy = select_modulated_conv_strategy(b, c, self.out_channels, self.kernel_size, h * w, out_hw)
+        if strategy == 'activation':
+            return self._forward_activation(x, style)
+        return self._forward_grouped(x, style)
+
+    def _sample(self, x):
+        if self.sample_mode == 'upsample':
+            x = F.interpolate(x, scale_factor=2, mode=self.interpolation_mode, align_corners=self.align_corners)
+        elif self.sample_mode == 'downsample':
+            x = F.interpolate(x, scale_factor=0.5, mode=self.interpolation_mode, align_corners=self.align_corners)
+        return x
+
+    def _forward_grouped(self, x, style):
         b, c, h, w = x.shape  # c = c_in
         # weight modulation
-        style = self.modulation(style).view(b, 1, c, 1, 1)
+        style = style.view(b, 1, c, 1, 1)
         # self.weight: (1, c_out, c_in, k, k); style: (b, 1, c, 1, 1)
         weight = self.scale * self.weight * style  # (b, c_out, c_in, k, k)
 
@@ -139,10 +163,7 @@ class ModulatedConv2d(nn.Module):
 
         weight = weight.view(b * self.out_channels, c, self.kernel_size, self.kernel_size)
 
-        if self.sample_mode == 'upsample':
-            x = F.interpolate(x, scale_factor=2, mode=self.interpolation_mode, align_corners=self.align_corners)
-        elif self.sample_mode == 'downsample':
-            x = F.interpolate(x, scale_factor=0.5, mode=self.interpolation_mode, align_corners=self.align_corners)
+        x = self._sample(x)
 
         b, c, h, w = x.shape
         x = x.view(1, b * c, h, w)
@@ -152,6 +173,18 @@ class ModulatedConv2d(nn.Module):
 
         return out
 
+    def _forward_activation(self, x, style):
+        # scale the inputs by the styles instead of the weights, and the outputs by the demodulation coefficients
+        weight = self.scale * self.weight[0]  # (c_out, c_in, k, k)
+        x = self._sample(x * style[:, :, None, None])
+        out = F.conv2d(x, weight, padding=self.padding)
+
+        if self.demodulate:
+            demod = torch.rsqrt(style.pow(2) @ weight.pow(2).sum([2, 3]).t() + self.eps)  # (b, c_out)
+            out = out * demod[:, :, None, None]
+
+        return out
+
     def __repr__(self):
         return (f'{self.__class__.__name__}(in_channels={self.in_channels}, '
                 f'out_channels={self.out_channels}, '
@@ -190,16 +223,18 @@ class StyleConv(nn.Module):
             sample_mode=sample_mode,
             interpolation_mode=interpolation_mode)
         self.weight = nn.Parameter(torch.zeros(1))  # for noise injection
+        self.fold_noise = False  # skip the noise injection, see gfpgan.noise.fold_noise
         self.activate = FusedLeakyReLU(out_channels)
 
     def forward(self, x, style, noise=None):
         # modulate
         out = self.modulated_conv(x, style)
         # noise injection
-        if noise is None:
-            b, _, h, w = out.shape
-            noise = out.new_empty(b, 1, h, w).normal_()
-        out = out + self.weight * noise
+        if not self.fold_noise:
+            if noise is None:
+                b, _, h, w = out.shape
+                noise = out.new_empty(b, 1, h, w).normal_()
+            out = out + self.weight * noise
         # activation (with bias)
         out = self.activate(out)
         return out
@@ -231,6 +266,8 @@ class ToRGB(nn.Module):
             sample_mode=None,
             interpolation_mode=interpolation_mode)
         self.bias = nn.Parameter(torch.zeros(1, 3, 1, 1))
+        # add in place, and the bias can be merged into the last ToRGB (None), see gfpgan.graph_optimizer
+        self.inplace = False
 
     def forward(self, x, style, skip=None):
         """Forward function.
@@ -244,6 +281,14 @@ class ToRGB(nn.Module):
             Tensor: RGB images.
         """
         out = self.modulated_conv(x, style)
+        if self.inplace:
+            # the modulated conv outputs a new tensor
+            if skip is not None:
+                if self.upsample:
+                    skip = F.interpolate(
+                        skip, scale_factor=2, mode=self.interpolation_mode, align_corners=self.align_corners)
+                out.add_(skip)
+            return out if self.bias is None else out.add_(self.bias)
         out = out + self.bias
         if skip is not None:
             if self.upsample:
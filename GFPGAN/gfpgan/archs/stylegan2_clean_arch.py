@@ -6,6 +6,49 @@ from basicsr.utils.registry import ARCH_REGISTRY
 from torch import nn
 from torch.nn import functional as F
 
+MODULATED_CONV_STRATEGIES = ('auto', 'grouped', 'activation')
+# activation scaling is used when the modulated weights have more than 1/4 of the elements of the scaled activations,
+# measured with scripts/benchmark_modulated_conv.py
+ACTIVATION_SCALING_RATIO = 4
+
+
+def select_modulated_conv_strategy(b, in_channels, out_channels, kernel_size, in_hw, out_hw):
+    """Select the execution strategy of a modulated conv, from the number of elements each one has to scale.
+
+    ``grouped`` modulates a weight tensor per sample (b * c_out * c_in * k * k elements) and runs a grouped conv.
+    ``activation`` scales the inputs by the styles and the outputs by the demodulation coefficients
+    (b * (c_in * h_in * w_in + c_out * h_out * w_out) elements) and runs a conv with shared weights.
+
+    Args:
+        b (int): Batch size.
+        in_channels (int): Channel number of the input.
+        out_channels (int): Channel number of the output.
+        kernel_size (int): Size of the convolving kernel.
+        in_hw (int): Number of pixels of the input.
+        out_hw (int): Number of pixels of the output.
+
+    Returns:
+        str: grouped | activation.
+    """
+    weight_numel = b * out_channels * in_channels * kernel_size**2
+    activation_numel = b * (in_channels * in_hw + out_channels * out_hw)
+    return 'activation' if weight_numel * ACTIVATION_SCALING_RATIO >= activation_numel else 'grouped'
+
+
+def set_modulated_conv_strategy(model, strategy):
+    """Set the execution strategy of all the ModulatedConv2d layers (clean or bilinear) of a model, in place.
+
+    Args:
+        model (nn.Module): The model.
+        strategy (str): auto | grouped | activation.
+    """
+    if strategy not in MODULATED_CONV_STRATEGIES:
+        raise ValueError(f'Wrong strategy: {strategy}. Supported ones are: {" | ".join(MODULATED_CONV_STRATEGIES)}.')
+    for module in model.modules():
+        if type(module).__name__ == 'ModulatedConv2d':
+            module.strategy = strategy
+    return model
+
 
 class NormStyleCode(nn.Module):
 
@@ -34,6 +77,12 @@ class ModulatedConv2d(nn.Module):
         demodulate (bool): Whether to demodulate in the conv layer. Default: True.
         sample_mode (str | None): Indicating 'upsample', 'downsample' or None. Default: None.
         eps (float): A value added to the denominator for numerical stability. Default: 1e-8.
+        strategy (str): Execution strategy: 'grouped' (per-sample weights and a grouped conv), 'activation'
+            (activation scaling and a conv with shared weights) or 'auto' (selected per call with
+            :func:`select_modulated_conv_strategy`). Default: 'auto'.
+
+    If ``premodulated`` is set, the styles given to forward are already projected by ``modulation``, with shape
+    (b, in_channels). See :meth:`StyleGAN2GeneratorClean.fuse_modulations`.
     """
 
     def __init__(self,
@@ -43,7 +92,8 @@ class ModulatedConv2d(nn.Module):
                  num_style_feat,
                  demodulate=True,
                  sample_mode=None,
-                 eps=1e-8):
+                 eps=1e-8,
+                 strategy='auto'):
         super(ModulatedConv2d, self).__init__()
         self.in_channels = in_channels
         self.out_channels = out_channels
@@ -51,6 +101,9 @@ class ModulatedConv2d(nn.Module):
         self.demodulate = demodulate
         self.sample_mode = sample_mode
         self.eps = eps
+        self.strategy = strategy
+        self.premodulated = False
+        self.gain = 1  # output gain, applied with the demodulation (see gfpgan.graph_optimizer)
 
         # modulation inside each modulated conv
         self.modulation = nn.Linear(num_style_feat, in_channels, bias=True)
@@ -67,28 +120,44 @@ class ModulatedConv2d(nn.Module):
 
         Args:
             x (Tensor): Tensor with shape (b, c, h, w).
-            style (Tensor): Tensor with shape (b, num_style_feat).
+            style (Tensor): Tensor with shape (b, num_style_feat), or (b, c) if premodulated.
 
         Returns:
             Tensor: Modulated tensor after convolution.
         """
+        b, c, h, w = x.shape  # c = c_in
+        if not self.premodulated:
+            style = self.modulation(style)  # (b, c_in)
+        strategy = self.strategy
+        if strategy == 'auto':
+            out_hw = h * w * {'upsample': 4, 'downsample': 0.25}.get(self.sample_mode, 1)
+            strategy = select_modulated_conv_strategy(b, c, self.out_channels, self.kernel_size, h * w, out_hw)
+        if strategy == 'activation':
+            return self._forward_activation(x, style)
+        return self._forward_grouped(x, style)
+
+    def _sample(self, x):
+        # upsample or downsample if necessary
+        if self.sample_mode == 'upsample':
+            x = F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False)
+        elif self.sample_mode == 'downsample':
+            x = F.interpolate(x, scale_factor=0.5, mode='bilinear', align_corners=False)
+        return x
+
+    def _forward_grouped(self, x, style):
         b, c, h, w = x.shape  # c = c_in
         # weight modulation
-        style = self.modulation(style).view(b, 1, c, 1, 1)
+        style = style.view(b, 1, c, 1, 1)
         # self.weight: (1, c_out, c_in, k, k); style: (b, 1, c, 1, 1)
         weight = self.weight * style  # (b, c_out, c_in, k, k)
 
         if self.demodulate:
-            demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + self.eps)
+            demod = torch.rsqrt(weight.pow(2).sum([2, 3, 4]) + self.eps) * self.gain
             weight = weight * demod.view(b, self.out_channels, 1, 1, 1)
 
         weight = weight.view(b * self.out_channels, c, self.kernel_size, self.kernel_size)
 
-        # upsample or downsample if necessary
-        if self.sample_mode == 'upsample':
-            x = F.interpolate(x, scale_factor=2, mode='bilinear', align_corners=False)
-        elif self.sample_mode == 'downsample':
-            x = F.interpolate(x, scale_factor=0.5, mode='bilinear', align_corners=False)
+        x = self._sample(x)
 
         b, c, h, w = x.shape
         x = x.view(1, b * c, h, w)
@@ -98,6 +167,20 @@ class ModulatedConv2d(nn.Module):
 
         return out
 
+    def _forward_activation(self, x, style):
+        # conv(x, weight * style) = conv(x * style, weight), since the style scales the input channels. The scaling
+        # also commutes with the resampling, which is per channel
+        weight = self.weight[0]  # (c_out, c_in, k, k)
+        x = self._sample(x * style[:, :, None, None])
+        out = F.conv2d(x, weight, padding=self.padding)
+
+        if self.demodulate:
+            # sum((weight * style)^2) over (c_in, k, k)
+            demod = torch.rsqrt(style.pow(2) @ weight.pow(2).sum([2, 3]).t() + self.eps) * self.gain  # (b, c_out)
+            out = out * demod[:, :, None, None]
+
+        return out
+
     def __repr__(self):
         return (f'{self.__class__.__name__}(in_channels={self.in_channels}, out_channels={self.out_channels}, '
                 f'kernel_size={self.kernel_size}, demodulate={self.demodulate}, sample_mode={self.sample_mode})')
@@ -120,23 +203,40 @@ class StyleConv(nn.Module):
         self.modulated_conv = ModulatedConv2d(
             in_channels, out_channels, kernel_size, num_style_feat, demodulate=demodulate, sample_mode=sample_mode)
         self.weight = nn.Parameter(torch.zeros(1))  # for noise injection
+        self.fold_noise = False  # skip the noise injection, see gfpgan.noise.fold_noise
         self.bias = nn.Parameter(torch.zeros(1, out_channels, 1, 1))
         self.activate = nn.LeakyReLU(negative_slope=0.2, inplace=True)
+        # the output gain is applied by the demodulation and the additions are in place, see gfpgan.graph_optimizer
+        self.fold_gain = False
 
     def forward(self, x, style, noise=None):
+        if self.fold_gain:
+            return self._forward_folded(x, style, noise)
         # modulate
         out = self.modulated_conv(x, style) * 2**0.5  # for conversion
         # noise injection
-        if noise is None:
-            b, _, h, w = out.shape
-            noise = out.new_empty(b, 1, h, w).normal_()
-        out = out + self.weight * noise
+        if not self.fold_noise:
+            if noise is None:
+                b, _, h, w = out.shape
+                noise = out.new_empty(b, 1, h, w).normal_()
+            out = out + self.weight * noise
         # add bias
         out = out + self.bias
         # activation
         out = self.activate(out)
         return out
 
+    def _forward_folded(self, x, style, noise):
+        # the modulated conv outputs a new tensor, which is updated in place
+        out = self.modulated_conv(x, style)
+        if not self.fold_noise:
+            if noise is None:
+                b, _, h, w = out.shape
+                noise = out.new_empty(b, 1, h, w).normal_()
+            out.add_(self.weight * noise)
+        out.add_(self.bias)
+        return F.leaky_relu_(out, negative_slope=0.2)
+
 
 class ToRGB(nn.Module):
     """To RGB (image space) from features.
@@ -153,6 +253,8 @@ class ToRGB(nn.Module):
         self.modulated_conv = ModulatedConv2d(
             in_channels, 3, kernel_size=1, num_style_feat=num_style_feat, demodulate=False, sample_mode=None)
         self.bias = nn.Parameter(torch.zeros(1, 3, 1, 1))
+        # add in place, and the bias can be merged into the last ToRGB (None), see gfpgan.graph_optimizer
+        self.inplace = False
 
     def forward(self, x, style, skip=None):
         """Forward function.
@@ -166,6 +268,13 @@ class ToRGB(nn.Module):
             Tensor: RGB images.
         """
         out = self.modulated_conv(x, style)
+        if self.inplace:
+            # the modulated conv outputs a new tensor
+            if skip is not None:
+                if self.upsample:
+                    skip = F.interpolate(skip, scale_factor=2, mode='bilinear', align_corners=False)
+                out.add_(skip)
+            return out if self.bias is None else out.add_(self.bias)
         out = out + self.bias
         if skip is not None:
             if self.upsample:
@@ -275,6 +384,71 @@ class StyleGAN2GeneratorClean(nn.Module):
                     sample_mode=None))
             self.to_rgbs.append(ToRGB(out_channels, num_style_feat, upsample=True))
             in_channels = out_channels
+        self.latent_indices = [latent_idx for _, latent_idx in self.get_modulated_convs()]
+        self.modulations_fused = False
+
+    def get_modulated_convs(self):
+        """The modulated convs in the forward order, with the indices of their latents.
+
+        Returns:
+            list[tuple[ModulatedConv2d, int]]: The modulated convs and the indices of their latents.
+        """
+        modulated_convs = [(self.style_conv1.modulated_conv, 0), (self.to_rgb1.modulated_conv, 1)]
+        i = 1
+        for conv1, conv2, to_rgb in zip(self.style_convs[::2], self.style_convs[1::2], self.to_rgbs):
+            modulated_convs.extend([(conv1.modulated_conv, i), (conv2.modulated_conv, i + 1),
+                                    (to_rgb.modulated_conv, i + 2)])
+            i += 2
+        return modulated_convs
+
+    @torch.no_grad()
+    def fuse_modulations(self):
+        """Fuse the modulation Linear layers of all the modulated convs, for inference.
+
+        The weights of the layers with the same channel number are stacked, so that their styles are computed with one
+        batched matmul: 4 matmuls instead of about 25 small ones at 512px. Stacking all of them in one tensor would
+        need zero padding to the largest channel number, and the extra weights to read make it slower on cpu. Call it
+        after loading the weights: the fused weights are copies, which are not in the state dict.
+        """
+        modulated_convs = self.get_modulated_convs()
+        groups = {}  # channel number -> indices of the modulated convs
+        for idx, (conv, _) in enumerate(modulated_convs):
+            groups.setdefault(conv.in_channels, []).append(idx)
+            conv.premodulated = True
+        self.fused_modulations = nn.Module()
+        self.fused_groups = []
+        for group_idx, indices in enumerate(groups.values()):
+            modulations = [modulated_convs[idx][0].modulation for idx in indices]
+            # (n, c, num_style_feat) and (n, 1, c)
+            weight = torch.stack([modulation.weight for modulation in modulations])
+            bias = torch.stack([modulation.bias for modulation in modulations]).unsqueeze(1)
+            self.fused_modulations.register_buffer(f'weight{group_idx}', weight, persistent=False)
+            self.fused_modulations.register_buffer(f'bias{group_idx}', bias, persistent=False)
+            self.fused_groups.append((indices, [self.latent_indices[idx] for idx in indices]))
+        self.modulations_fused = True
+        return self
+
+    def get_styles(self, latent):
+        """Get the styles of the modulated convs, in the forward order.
+
+        Args:
+            latent (Tensor): Latents with shape (b, num_latent, num_style_feat).
+
+        Returns:
+            list[Tensor]: Latents with shape (b, num_style_feat), or the projected styles with shape (b, c) if the
+                modulations are fused.
+        """
+        if not self.modulations_fused:
+            return [latent[:, latent_idx] for latent_idx in self.latent_indices]
+        styles = [None] * len(self.latent_indices)
+        for group_idx, (indices, latent_indices) in enumerate(self.fused_groups):
+            weight = getattr(self.fused_modulations, f'weight{group_idx}')
+            bias = getattr(self.fused_modulations, f'bias{group_idx}')
+            # (n, b, num_style_feat) x (n, num_style_feat, c) -> (n, b, c)
+            group_styles = torch.baddbmm(bias, latent[:, latent_indices].transpose(0, 1), weight.transpose(1, 2))
+            for idx, style in zip(indices, group_styles):
+                styles[idx] = style
+        return styles
 
     def make_noise(self):
         """Make noise for noise injection."""
@@ -348,17 +522,16 @@ class StyleGAN2GeneratorClean(nn.Module):
             latent = torch.cat([latent1, latent2], 1)
 
         # main generation
+        styles = iter(self.get_styles(latent))
         out = self.constant_input(latent.shape[0])
-        out = self.style_conv1(out, latent[:, 0], noise=noise[0])
-        skip = self.to_rgb1(out, latent[:, 1])
+        out = self.style_conv1(out, next(styles), noise=noise[0])
+        skip = self.to_rgb1(out, next(styles))
 
-        i = 1
         for conv1, conv2, noise1, noise2, to_rgb in zip(self.style_convs[::2], self.style_convs[1::2], noise[1::2],
                                                         noise[2::2], self.to_rgbs):
-            out = conv1(out, latent[:, i], noise=noise1)
-            out = conv2(out, latent[:, i + 1], noise=noise2)
-            skip = to_rgb(out, latent[:, i + 2], skip)  # feature back to the rgb space
-            i += 2
+            out = conv1(out, next(styles), noise=noise1)
+            out = conv2(out, next(styles), noise=noise2)
+            skip = to_rgb(out, next(styles), skip)  # feature back to the rgb space
 
         image = skip
 
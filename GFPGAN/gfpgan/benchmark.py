@@ -0,0 +1,218 @@
+import itertools
+import multiprocessing
+import platform
+import statistics
+import sys
+import time
+import torch
+
+from gfpgan.memory import measure_peak_memory
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+ARCHS = ('GFPGANv1', 'GFPGANv1Clean', 'GFPGANBilinear', 'StyleGAN2GeneratorClean', 'FacialComponentDiscriminator')
+# the settings that identify a case, in the baselines
+CASE_KEYS = ('arch', 'out_size', 'batch_size', 'channel_multiplier', 'narrow')
+
+
+def build_arch(arch, out_size, channel_multiplier=2, narrow=1):
+    """Build a randomly initialized architecture in eval mode, and its forward for a batch size.
+
+    The GFPGAN archs have the options of the released models. FacialComponentDiscriminator gets the eye crops of the
+    training (80x80 at out_size 512), and ignores channel_multiplier and narrow.
+
+    Returns:
+        nn.Module: The model.
+        callable: ``forward(batch_size)``, that runs the model on new random inputs.
+    """
+    if arch in ('GFPGANv1', 'GFPGANv1Clean', 'GFPGANBilinear'):
+        from gfpgan.archs import gfpgan_bilinear_arch, gfpganv1_arch, gfpganv1_clean_arch
+        arch_cls = {
+            'GFPGANv1': gfpganv1_arch.GFPGANv1,
+            'GFPGANv1Clean': gfpganv1_clean_arch.GFPGANv1Clean,
+            'GFPGANBilinear': gfpgan_bilinear_arch.GFPGANBilinear
+        }[arch]
+        model = arch_cls(
+            out_size=out_size,
+            num_style_feat=512,
+            channel_multiplier=channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=narrow,
+            sft_half=True)
+
+        def forward(batch_size):
+            x = torch.rand(batch_size, 3, out_size, out_size) * 2 - 1
+            return model(x, return_rgb=False, randomize_noise=False)[0]
+    elif arch == 'StyleGAN2GeneratorClean':
+        from gfpgan.archs.stylegan2_clean_arch import StyleGAN2GeneratorClean
+        model = StyleGAN2GeneratorClean(
+            out_size, num_style_feat=512, num_mlp=8, channel_multiplier=channel_multiplier, narrow=narrow)
+
+        def forward(batch_size):
+            return model([torch.randn(batch_size, 512)], randomize_noise=False)[0]
+    elif arch == 'FacialComponentDiscriminator':
+        from gfpgan.archs.gfpganv1_arch import FacialComponentDiscriminator
+        model = FacialComponentDiscriminator()
+        crop_size = 80 * out_size // 512
+
+        def forward(batch_size):
+            return model(torch.rand(batch_size, 3, crop_size, crop_size) * 2 - 1)[0]
+    else:
+        raise ValueError(f'Wrong arch: {arch}. Supported ones are: {" | ".join(ARCHS)}.')
+    return model.eval(), forward
+
+
+def get_cases(archs=ARCHS, out_sizes=(256, 512, 1024), batch_sizes=(1, 4), channel_multipliers=(1, 2), narrows=(1, )):
+    """The sweep of the benchmark cases (dicts of CASE_KEYS).
+
+    The settings that an arch ignores (channel_multiplier and narrow of FacialComponentDiscriminator) are not swept.
+    """
+    cases = []
+    settings = itertools.product(archs, out_sizes, batch_sizes, channel_multipliers, narrows)
+    for arch, out_size, batch_size, channel_multiplier, narrow in settings:
+        if arch == 'FacialComponentDiscriminator':
+            channel_multiplier, narrow = None, None
+        case = dict(
+            arch=arch, out_size=out_size, batch_size=batch_size, channel_multiplier=channel_multiplier, narrow=narrow)
+        if case not in cases:
+            cases.append(case)
+    return cases
+
+
+def _max_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS, in KB on Linux
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == 'darwin' else max_rss / 2**10
+
+
+@torch.no_grad()
+def benchmark_case(case, num_iters=5, num_warmup=1, num_threads=None):
+    """Measure the forward of one case on cpu.
+
+    Args:
+        case (dict): The settings (CASE_KEYS).
+        num_iters (int): Number of timed forwards. Default: 5.
+        num_warmup (int): Number of forwards before the timing. Default: 1.
+        num_threads (int | None): The number of torch threads. Default: None (torch default).
+
+    Returns:
+        dict: The case, with the number of params (M), the median and min latency per forward (ms), the throughput
+            (images/s), the peak memory allocated by a forward (MB) and the peak RSS of the process (MB), or the error.
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    result = dict(case)
+    try:
+        torch.manual_seed(0)
+        channel_options = {} if case['channel_multiplier'] is None else dict(
+            channel_multiplier=case['channel_multiplier'], narrow=case['narrow'])
+        model, forward = build_arch(case['arch'], case['out_size'], **channel_options)
+        batch_size = case['batch_size']
+        result['params_m'] = sum(param.numel() for param in model.parameters()) / 1e6
+        result['model_rss_mb'] = _max_rss_mb()
+
+        for _ in range(num_warmup):
+            forward(batch_size)
+        latencies = []
+        for _ in range(num_iters):
+            start = time.perf_counter()
+            forward(batch_size)
+            latencies.append(time.perf_counter() - start)
+        _, peak_alloc = measure_peak_memory(lambda: forward(batch_size))
+    except Exception as error:  # e.g. the compiled ops of basicsr are missing
+        result['error'] = f'{error.__class__.__name__}: {error}'
+        return result
+
+    result['latency_ms'] = statistics.median(latencies) * 1000
+    result['latency_min_ms'] = min(latencies) * 1000
+    result['throughput'] = batch_size / statistics.median(latencies)
+    result['peak_alloc_mb'] = peak_alloc / 2**20
+    result['peak_rss_mb'] = _max_rss_mb()
+    return result
+
+
+def run_benchmark(cases, num_iters=5, num_warmup=1, num_threads=None, isolate=True, callback=None):
+    """Run the benchmark cases.
+
+    Args:
+        cases (list[dict]): The cases, see :func:`get_cases`.
+        num_iters (int): Number of timed forwards per case. Default: 5.
+        num_warmup (int): Number of forwards before the timing. Default: 1.
+        num_threads (int | None): The number of torch threads. Default: None (torch default).
+        isolate (bool): Run each case in a new process, so that the peak RSS and the allocator state of a case do not
+            depend on the previous ones. Otherwise, peak_rss_mb is not reported. Default: True.
+        callback (callable | None): Called with each result, e.g. to print it. Default: None.
+
+    Returns:
+        dict: ``meta`` (torch version, platform, threads, settings) and ``results`` (list[dict]).
+    """
+    results = []
+    for case in cases:
+        if isolate:
+            with multiprocessing.get_context('spawn').Pool(1) as pool:
+                result = pool.apply(benchmark_case, (case, num_iters, num_warmup, num_threads))
+        else:
+            result = benchmark_case(case, num_iters, num_warmup, num_threads)
+            result.pop('peak_rss_mb', None)
+            result.pop('model_rss_mb', None)
+        results.append(result)
+        if callback is not None:
+            callback(result)
+    meta = dict(
+        torch=torch.__version__,
+        python=platform.python_version(),
+        platform=platform.platform(),
+        processor=platform.processor(),
+        num_threads=num_threads or torch.get_num_threads(),
+        num_iters=num_iters,
+        isolate=isolate)
+    return dict(meta=meta, results=results)
+
+
+def compare_results(results, baseline, thresholds):
+    """Compare benchmark results with a baseline.
+
+    Args:
+        results (dict): The output of :func:`run_benchmark`.
+        baseline (dict): A previous output of :func:`run_benchmark`.
+        thresholds (dict): The maximum relative increase of each metric, e.g. ``{'latency_ms': 0.1}``. The metrics
+            without threshold are not compared.
+
+    Returns:
+        list[dict]: One entry per compared metric of the cases in both: the case, ``metric``, ``baseline``,
+            ``current``, ``ratio`` and ``regression`` (bool). Cases that fail now but not in the baseline are
+            regressions, with the error as ``current``.
+    """
+    baseline_results = {tuple(result[key] for key in CASE_KEYS): result for result in baseline['results']}
+    comparisons = []
+    for result in results['results']:
+        case = {key: result[key] for key in CASE_KEYS}
+        reference = baseline_results.get(tuple(case.values()))
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in result:
+            comparisons.append(
+                dict(case, metric='error', baseline=None, current=result['error'], ratio=None, regression=True))
+            continue
+        for metric, threshold in thresholds.items():
+            if result.get(metric) is None or reference.get(metric) is None:
+                continue
+            ratio = result[metric] / max(reference[metric], 1e-12)
+            comparisons.append(
+                dict(
+                    case,
+                    metric=metric,
+                    baseline=reference[metric],
+                    current=result[metric],
+                    ratio=ratio,
+                    regression=ratio > 1 + threshold))
+    return comparisons
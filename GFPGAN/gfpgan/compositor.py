@@ -0,0 +1,176 @@
+import cv2
+import math
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+
+class FaceCompositor():
+    """Paste restored faces back to the (upsampled) input image, only working in the region of each face.
+
+    It gives the same results as ``FaceRestoreHelper.paste_faces_to_input_image`` (with square masks, i.e.,
+    ``use_parse=False``), up to interpolation rounding. But instead of warping each face and its mask over the whole
+    upsampled image, it warps them only into the bounding region of the face. The background is converted to float
+    once and all the faces are blended into it in order, in one pass, so the cost scales with the face areas instead
+    of ``num_faces x image size``.
+
+    Args:
+        upscale (float): The upscale of the output.
+        backend (str): ``numpy`` (OpenCV) or ``torch``. Default: numpy.
+        device (torch.device | None): The device for the torch backend. Default: None (cpu).
+    """
+
+    def __init__(self, upscale, backend='numpy', device=None):
+        if backend not in ('numpy', 'torch'):
+            raise ValueError(f'Wrong compositor backend: {backend}. Supported ones are: numpy | torch.')
+        self.upscale = upscale
+        self.backend = backend
+        self.device = torch.device('cpu') if device is None else device
+        self._masks = {}  # face size -> face mask of ones
+
+    def get_inverse_affine(self, affine_matrix):
+        """Get the matrix mapping a restored face to the upsampled image."""
+        inverse_affine = cv2.invertAffineTransform(affine_matrix) * self.upscale
+        # Add an offset to inverse affine matrix, for more precise back alignment
+        if self.upscale > 1:
+            inverse_affine[:, 2] += 0.5 * self.upscale
+        return inverse_affine
+
+    def _get_mask(self, face_size):
+        if face_size not in self._masks:
+            self._masks[face_size] = np.ones(face_size, dtype=np.float32)
+        return self._masks[face_size]
+
+    def _get_roi(self, inverse_affine, face_size, h_up, w_up):
+        """Get the region (x0, y0, x1, y1) of a warped face, with a margin for interpolation and erosion."""
+        h, w = face_size
+        corners = np.array([[0, 0, 1], [w, 0, 1], [0, h, 1], [w, h, 1]], dtype=np.float64) @ inverse_affine.T
+        margin = int(2 * self.upscale) + 2
+        x0 = max(int(math.floor(corners[:, 0].min())) - margin, 0)
+        y0 = max(int(math.floor(corners[:, 1].min())) - margin, 0)
+        x1 = min(int(math.ceil(corners[:, 0].max())) + margin, w_up)
+        y1 = min(int(math.ceil(corners[:, 1].max())) + margin, h_up)
+        return x0, y0, x1, y1
+
+    def paste(self, img, restored_faces, affine_matrices, upsample_img=None):
+        """Paste the restored faces.
+
+        Args:
+            img (ndarray): The input image with shape (h, w, c), as read by ``FaceRestoreHelper.read_image``.
+            restored_faces (list[ndarray]): Restored faces with shape (h_face, w_face, 3).
+            affine_matrices (list[ndarray]): Affine matrices from the input image to the cropped faces.
+            upsample_img (ndarray | None): The upsampled background. If None, the input image is resized.
+                Default: None.
+
+        Returns:
+            ndarray: The restored image, uint8 (or uint16 for 16-bit images).
+        """
+        assert len(restored_faces) == len(affine_matrices), 'restored_faces and affine_matrices have different lengths.'
+        h, w = img.shape[0:2]
+        h_up, w_up = int(h * self.upscale), int(w * self.upscale)
+        if upsample_img is None:
+            upsample_img = img
+        upsample_img = cv2.resize(upsample_img, (w_up, h_up), interpolation=cv2.INTER_LANCZOS4)
+        if upsample_img.ndim == 2:  # gray image
+            upsample_img = np.repeat(upsample_img[:, :, None], 3, axis=2)
+
+        if self.backend == 'numpy':
+            canvas = upsample_img.astype(np.float32)
+            paste_fn = self._paste_face_numpy
+        else:
+            canvas = torch.from_numpy(upsample_img.astype(np.float32)).to(self.device)
+            paste_fn = self._paste_face_torch
+
+        for restored_face, affine_matrix in zip(restored_faces, affine_matrices):
+            inverse_affine = self.get_inverse_affine(affine_matrix)
+            face_size = restored_face.shape[0:2]
+            x0, y0, x1, y1 = self._get_roi(inverse_affine, face_size, h_up, w_up)
+            if x1 <= x0 or y1 <= y0:  # the face is out of the image
+                continue
+            # move the origin to the region
+            inverse_affine[:, 2] -= (x0, y0)
+            # only the color channels are blended, the alpha channel (if any) is kept
+            paste_fn(canvas[y0:y1, x0:x1, 0:3], restored_face, inverse_affine)
+
+        if self.backend == 'torch':
+            canvas = canvas.cpu().numpy()
+        if np.max(canvas) > 256:  # 16-bit image
+            return canvas.astype(np.uint16)
+        return canvas.astype(np.uint8)
+
+    def _paste_face_numpy(self, roi, restored_face, inverse_affine):
+        roi_size = (roi.shape[1], roi.shape[0])
+        inv_restored = cv2.warpAffine(restored_face, inverse_affine, roi_size).astype(np.float32)
+        inv_mask = cv2.warpAffine(self._get_mask(restored_face.shape[0:2]), inverse_affine, roi_size)
+        # remove the black borders
+        inv_mask_erosion = cv2.erode(inv_mask, np.ones((int(2 * self.upscale), int(2 * self.upscale)), np.uint8))
+        # compute the fusion edge based on the area of face
+        w_edge = int(np.sum(inv_mask_erosion)**0.5) // 20
+        erosion_radius = w_edge * 2
+        inv_mask_center = cv2.erode(inv_mask_erosion, np.ones((erosion_radius, erosion_radius), np.uint8))
+        blur_size = w_edge * 2
+        inv_soft_mask = cv2.GaussianBlur(inv_mask_center, (blur_size + 1, blur_size + 1), 0)[:, :, None]
+        # roi = soft_mask * eroded_mask * face + (1 - soft_mask) * roi
+        roi += inv_soft_mask * (inv_mask_erosion[:, :, None] * inv_restored - roi)
+
+    def _paste_face_torch(self, roi, restored_face, inverse_affine):
+        roi_h, roi_w = roi.shape[0:2]
+        face_h, face_w = restored_face.shape[0:2]
+        face = torch.from_numpy(np.ascontiguousarray(restored_face)).to(self.device)
+        face = face.permute(2, 0, 1).unsqueeze(0).float()
+        mask = face.new_ones((1, 1, face_h, face_w))
+        # warp the face and its mask together, the same as cv2.warpAffine with bilinear interpolation
+        warped = _warp_affine(torch.cat([face, mask], dim=1), inverse_affine, roi_h, roi_w)
+        inv_restored, inv_mask = warped[:, 0:3], warped[:, 3:4]
+        # remove the black borders
+        inv_mask_erosion = _erode(inv_mask, int(2 * self.upscale))
+        # compute the fusion edge based on the area of face
+        w_edge = int(inv_mask_erosion.sum().item()**0.5) // 20
+        erosion_radius = w_edge * 2
+        inv_mask_center = _erode(inv_mask_erosion, erosion_radius)
+        blur_size = w_edge * 2
+        inv_soft_mask = _gaussian_blur(inv_mask_center, blur_size + 1)
+        pasted_face = (inv_mask_erosion * inv_restored)[0].permute(1, 2, 0)
+        inv_soft_mask = inv_soft_mask[0].permute(1, 2, 0)
+        roi += inv_soft_mask * (pasted_face - roi)
+
+
+def _warp_affine(img, matrix, out_h, out_w):
+    """cv2.warpAffine (bilinear, zero border) for a tensor with shape (1, c, h, w)."""
+    h, w = img.shape[2:4]
+    # the matrix maps output pixels to input pixels
+    inverse = torch.from_numpy(cv2.invertAffineTransform(matrix)).to(img)
+    ys, xs = torch.meshgrid(
+        torch.arange(out_h, dtype=img.dtype, device=img.device),
+        torch.arange(out_w, dtype=img.dtype, device=img.device),
+        indexing='ij')
+    src_x = inverse[0, 0] * xs + inverse[0, 1] * ys + inverse[0, 2]
+    src_y = inverse[1, 0] * xs + inverse[1, 1] * ys + inverse[1, 2]
+    # normalize to [-1, 1], with -1 and 1 at the centers of the corner pixels
+    grid = torch.stack([src_x * 2 / max(w - 1, 1) - 1, src_y * 2 / max(h - 1, 1) - 1], dim=-1).unsqueeze(0)
+    return F.grid_sample(img, grid, mode='bilinear', padding_mode='zeros', align_corners=True)
+
+
+def _erode(mask, kernel_size):
+    """cv2.erode with a square kernel of ones, for a tensor with shape (1, 1, h, w)."""
+    if kernel_size <= 0:  # OpenCV uses a 3x3 kernel for an empty kernel
+        kernel_size = 3
+    if kernel_size == 1:
+        return mask
+    # the anchor is at kernel_size // 2, and the border does not erode (OpenCV default)
+    pad_before = kernel_size // 2
+    pad_after = kernel_size - 1 - pad_before
+    mask = F.pad(-mask, (pad_before, pad_after, pad_before, pad_after), value=-float('inf'))
+    return -F.max_pool2d(mask, kernel_size, stride=1)
+
+
+def _gaussian_blur(mask, kernel_size):
+    """cv2.GaussianBlur with sigma=0, for a tensor with shape (1, 1, h, w)."""
+    if kernel_size == 1:
+        return mask
+    kernel = torch.from_numpy(cv2.getGaussianKernel(kernel_size, 0).astype(np.float32)).to(mask)
+    pad = kernel_size // 2
+    # OpenCV default border: BORDER_REFLECT_101, the same as 'reflect' in torch
+    mask = F.pad(mask, (pad, pad, pad, pad), mode='reflect')
+    mask = F.conv2d(mask, kernel.view(1, 1, kernel_size, 1))
+    return F.conv2d(mask, kernel.view(1, 1, 1, kernel_size))
@@ -0,0 +1,189 @@
+import cv2
+import math
+import numpy as np
+import torch
+from basicsr.data import degradations as degradations
+from concurrent.futures import ThreadPoolExecutor
+from torch.nn import functional as F
+
+from .ffhq_degradation_dataset import FFHQDegradationDataset
+from .kernel_bank import KernelBank, fft_blur
+
+# the kernels from this size are applied in the frequency domain, faster than the spatial conv on cpu
+FFT_KERNEL_SIZE = 25
+
+
+def _jpeg_round_trip(img, quality):
+    """Encode and decode a uint8 BGR image with the JPEG codec of OpenCV, which releases the GIL."""
+    _, encimg = cv2.imencode('.jpg', img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    return cv2.imdecode(encimg, cv2.IMREAD_COLOR)
+
+
+class BatchDegradation():
+    """Synthesize the low-quality (LQ) faces of FFHQDegradationDataset on whole batches, in torch.
+
+    It is the degradation of ``FFHQDegradationDataset.__getitem__`` run after the collation, on cpu or on the device
+    of the batch, so that the data workers only decode and flip the ground-truth (GT) faces (``batch_degradation`` in
+    the dataset options). The random parameters of each sample follow the same distributions as the per-sample path:
+
+    - blur: the random mixed kernels of basicsr (or of the ``kernel_bank``), applied by one grouped conv, or with the
+      FFT for the large kernels, with the reflect border of ``cv2.filter2D``.
+    - downsample and resize back: bilinear, without antialiasing, as ``cv2.resize`` with INTER_LINEAR.
+    - Gaussian noise.
+    - JPEG: the codec of OpenCV, in a thread pool.
+    - color jitter, gray and the color jitter of torchvision.
+
+    Args:
+        opt (dict): The options of FFHQDegradationDataset.
+        num_threads (int): The number of threads of the JPEG codec. Default: 4.
+    """
+
+    def __init__(self, opt, num_threads=4):
+        self.opt = opt
+        self.mean = opt['mean']
+        self.std = opt['std']
+        self.blur_kernel_size = opt['blur_kernel_size']
+        self.kernel_list = opt['kernel_list']
+        self.kernel_prob = opt['kernel_prob']
+        self.blur_sigma = opt['blur_sigma']
+        self.downsample_range = opt['downsample_range']
+        self.noise_range = opt['noise_range']
+        self.jpeg_range = opt['jpeg_range']
+        self.color_jitter_prob = opt.get('color_jitter_prob')
+        self.color_jitter_pt_prob = opt.get('color_jitter_pt_prob')
+        self.color_jitter_shift = opt.get('color_jitter_shift', 20) / 255.
+        self.gray_prob = opt.get('gray_prob')
+        self.num_threads = num_threads
+        self._executor = None
+        self.kernel_bank = None
+        if opt.get('kernel_bank') is not None:
+            self.kernel_bank = KernelBank(opt['kernel_bank'], self.kernel_list, self.kernel_prob, self.blur_kernel_size,
+                                          self.blur_sigma, opt.get('kernel_bank_size', 4096))
+
+    def sample_params(self, batch_size):
+        """Sample the random degradation parameters of a batch.
+
+        Returns:
+            dict: ``kernels`` (b, k, k), ``scales`` (b, ), ``noise_sigmas`` (b, ) in [0, 255] or None,
+                ``jpeg_qualities`` (b, ) or None, ``jitter_shifts`` (b, 3) in RGB order, zero for the samples without
+                jitter, ``gray`` (b, ) bool and ``jitter_pt`` (b, ) bool.
+        """
+        if self.kernel_bank is not None:
+            kernels = self.kernel_bank.get(self.kernel_bank.sample_indices(batch_size))
+        else:
+            kernels = np.stack([
+                degradations.random_mixed_kernels(
+                    self.kernel_list,
+                    self.kernel_prob,
+                    self.blur_kernel_size,
+                    self.blur_sigma,
+                    self.blur_sigma, [-math.pi, math.pi],
+                    noise_range=None) for _ in range(batch_size)
+            ])
+        params = dict(kernels=kernels.astype(np.float32))
+        params['scales'] = np.random.uniform(self.downsample_range[0], self.downsample_range[1], batch_size)
+        params['noise_sigmas'] = None if self.noise_range is None else np.random.uniform(
+            self.noise_range[0], self.noise_range[1], batch_size)
+        params['jpeg_qualities'] = None if self.jpeg_range is None else np.random.uniform(
+            self.jpeg_range[0], self.jpeg_range[1], batch_size)
+        jitter_shifts = np.random.uniform(-self.color_jitter_shift, self.color_jitter_shift, (batch_size, 3))
+        if self.color_jitter_prob is None:
+            jitter_shifts[:] = 0
+        else:
+            jitter_shifts[np.random.uniform(size=batch_size) >= self.color_jitter_prob] = 0
+        params['jitter_shifts'] = jitter_shifts.astype(np.float32)
+        params['gray'] = np.random.uniform(size=batch_size) < (self.gray_prob or 0)
+        params['jitter_pt'] = np.random.uniform(size=batch_size) < (self.color_jitter_pt_prob or 0)
+        return params
+
+    @staticmethod
+    def blur(imgs, kernels):
+        """Filter each image with its own kernel, as cv2.filter2D (correlation, reflect 101 border).
+
+        Args:
+            imgs (Tensor): Images with shape (b, c, h, w).
+            kernels (Tensor): Kernels with shape (b, k, k), k odd.
+
+        Returns:
+            Tensor: The blurred images.
+        """
+        b, c, h, w = imgs.shape
+        pad = kernels.size(-1) // 2
+        imgs = F.pad(imgs.reshape(1, b * c, h, w), (pad, pad, pad, pad), mode='reflect')
+        weight = kernels.repeat_interleave(c, dim=0).unsqueeze(1)  # (b * c, 1, k, k)
+        return F.conv2d(imgs, weight, groups=b * c).view(b, c, h, w)
+
+    def jpeg(self, imgs, qualities):
+        """JPEG round trips of RGB images with shape (1, 3, h, w) in [0, 1], in the thread pool."""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.num_threads)
+        arrays = []
+        for img in imgs:  # (1, 3, h, w) RGB float to (h, w, 3) BGR uint8
+            img = (img[0].clamp(0, 1) * 255.).round().byte()
+            arrays.append(img.flip(0).permute(1, 2, 0).contiguous().cpu().numpy())
+        decoded = self._executor.map(_jpeg_round_trip, arrays, qualities)
+        return [
+            torch.from_numpy(np.ascontiguousarray(array[:, :, ::-1])).to(img.device).permute(2, 0, 1).unsqueeze(0) /
+            255. for array, img in zip(decoded, imgs)
+        ]
+
+    @torch.no_grad()
+    def __call__(self, gt, params=None):
+        """Synthesize the LQ faces of a batch.
+
+        Args:
+            gt (Tensor): The normalized RGB GT faces from the dataset, with shape (b, 3, h, w).
+            params (dict | None): The degradation parameters, see :meth:`sample_params`. Default: None (sampled).
+
+        Returns:
+            Tensor: The normalized LQ faces.
+            Tensor: The normalized GT faces, converted to gray for the gray LQ faces if ``gt_gray``.
+        """
+        b, _, h, w = gt.shape
+        if params is None:
+            params = self.sample_params(b)
+        mean = gt.new_tensor(self.mean).view(1, 3, 1, 1)
+        std = gt.new_tensor(self.std).view(1, 3, 1, 1)
+        img_gt = gt * std + mean
+
+        # blur
+        kernels = torch.from_numpy(params['kernels']).to(gt)
+        img_lq = fft_blur(img_gt, kernels) if kernels.size(-1) >= FFT_KERNEL_SIZE else self.blur(img_gt, kernels)
+        # downsample and noise, at the size of each sample
+        img_lqs = []
+        for idx, scale in enumerate(params['scales']):
+            img = F.interpolate(
+                img_lq[idx:idx + 1], size=(int(h // scale), int(w // scale)), mode='bilinear', align_corners=False)
+            if params['noise_sigmas'] is not None:
+                img = (img + torch.randn_like(img) * (params['noise_sigmas'][idx] / 255.)).clamp_(0, 1)
+            img_lqs.append(img)
+        # jpeg compression
+        if params['jpeg_qualities'] is not None:
+            img_lqs = self.jpeg(img_lqs, params['jpeg_qualities'])
+        # resize to original size
+        img_lqs = [F.interpolate(img, size=(h, w), mode='bilinear', align_corners=False) for img in img_lqs]
+        img_lq = torch.cat(img_lqs).to(gt)
+
+        # random color jitter
+        jitter_shifts = torch.from_numpy(params['jitter_shifts']).to(gt).view(b, 3, 1, 1)
+        jittered = (jitter_shifts != 0).any(dim=1, keepdim=True)
+        img_lq = torch.where(jittered, (img_lq + jitter_shifts).clamp(0, 1), img_lq)
+        # random to gray, with the weights of cv2.COLOR_BGR2GRAY
+        gray = torch.from_numpy(params['gray']).to(gt.device).view(b, 1, 1, 1)
+        if gray.any():
+            gray_weight = gt.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+            img_lq = torch.where(gray, (img_lq * gray_weight).sum(1, keepdim=True).expand(-1, 3, -1, -1), img_lq)
+            if self.opt.get('gt_gray'):
+                gray_gt = (img_gt * gray_weight).sum(1, keepdim=True).expand(-1, 3, -1, -1)
+                gt = torch.where(gray, (gray_gt - mean) / std, gt)
+        # random color jitter (pytorch version)
+        brightness = self.opt.get('brightness', (0.5, 1.5))
+        contrast = self.opt.get('contrast', (0.5, 1.5))
+        saturation = self.opt.get('saturation', (0, 1.5))
+        hue = self.opt.get('hue', (-0.1, 0.1))
+        for idx in np.flatnonzero(params['jitter_pt']):
+            img_lq[idx] = FFHQDegradationDataset.color_jitter_pt(img_lq[idx], brightness, contrast, saturation, hue)
+
+        # round and clip
+        img_lq = torch.clamp((img_lq * 255.0).round(), 0, 255) / 255.
+        return (img_lq - mean) / std, gt
@@ -0,0 +1,162 @@
+import json
+import numpy as np
+import torch
+
+# the rows of a component array, with (x, y, half_len) columns
+COMPONENTS = ('left_eye', 'right_eye', 'mouth')
+# the indices of the components in the 68 landmarks
+COMPONENT_LANDMARKS = (slice(36, 42), slice(42, 48), slice(48, 68))
+# the minimum half length of the components
+MIN_HALF_LEN = 16
+
+
+def iter_json_items(path, chunk_size=2**20):
+    """Iterate the (key, value) items of a JSON file with a top-level object, without loading the whole file.
+
+    Args:
+        path (str): The JSON file.
+        chunk_size (int): The number of characters read at a time. Default: 2**20.
+
+    Yields:
+        tuple: The key and the decoded value of each item, in the file order.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer, pos, eof = '', 0, False
+
+        def skip(chars):
+            nonlocal pos
+            while pos < len(buffer) and buffer[pos] in chars:
+                pos += 1
+
+        def decode():
+            # decode the next value, reading more of the file while it is incomplete
+            nonlocal buffer, pos, eof
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, pos)
+                    if end < len(buffer) or eof:
+                        pos = end
+                        return value
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+
+        def next_char():
+            nonlocal buffer, pos, eof
+            skip(' \t\r\n')
+            while pos == len(buffer) and not eof:
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = chunk, 0
+                skip(' \t\r\n')
+            return buffer[pos] if pos < len(buffer) else ''
+
+        if next_char() != '{':
+            raise ValueError(f'{path} is not a JSON object.')
+        pos += 1
+        while True:
+            char = next_char()
+            if char == '}':
+                return
+            if char == ',':
+                pos += 1
+                continue
+            key = decode()
+            if next_char() != ':':
+                raise ValueError(f'Wrong JSON item {key} in {path}.')
+            pos += 1
+            next_char()
+            yield key, decode()
+
+
+def load_ffhq_landmarks(json_path, chunk_size=2**20):
+    """Stream the 68 face landmarks of the FFHQ metadata (ffhq-dataset-v2.json) in a (N, 68, 2) float32 array."""
+    # converted item by item, so that only the arrays of the landmarks are kept
+    landmarks = [
+        np.asarray(item['image']['face_landmarks'], dtype=np.float32)
+        for _, item in iter_json_items(json_path, chunk_size)
+    ]
+    return np.stack(landmarks).reshape(-1, 68, 2) if landmarks else np.empty((0, 68, 2), dtype=np.float32)
+
+
+def components_from_landmarks(landmarks, scale=1):
+    """Compute the components of faces from their 68 landmarks, for all the faces at once.
+
+    The center of a component is the mean of its landmarks, and its half length is half of the largest side of their
+    bounding box, at least 16.
+
+    Args:
+        landmarks (ndarray): Landmarks with shape (N, 68, 2).
+        scale (float): The scale from the landmarks to the images, e.g. 0.5 for the 512x512 FFHQ. Default: 1.
+
+    Returns:
+        ndarray: The (N, 3, 3) float32 components.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64) * scale
+    components = np.empty((len(landmarks), len(COMPONENTS), 3), dtype=np.float32)
+    for idx, indices in enumerate(COMPONENT_LANDMARKS):
+        points = landmarks[:, indices]
+        components[:, idx, :2] = points.mean(axis=1)
+        components[:, idx, 2] = np.maximum(np.ptp(points, axis=1).max(axis=-1) / 2, MIN_HALF_LEN)
+    return components
+
+
+def components_from_dict(components_dict):
+    """Convert the dict of a component pth file (keys f'{index:08d}') to a (N, 3, 3) float32 array."""
+    components = np.empty((len(components_dict), len(COMPONENTS), 3), dtype=np.float32)
+    for index in range(len(components_dict)):
+        item = components_dict[f'{index:08d}']
+        components[index] = [np.asarray(item[part], dtype=np.float32) for part in COMPONENTS]
+    return components
+
+
+def load_components(path):
+    """Load the facial components of a dataset.
+
+    Args:
+        path (str): A npy file of a (N, 3, 3) float32 array, memory-mapped so that the dataloader workers share it,
+            or a legacy pth file of a dict, converted in memory.
+
+    Returns:
+        ndarray: The (N, 3, 3) components: left eye, right eye and mouth; x, y and half length.
+    """
+    if path.endswith('.npy'):
+        return np.load(path, mmap_mode='r')
+    # a trusted dict of numpy scalars, that the weights_only default of recent torch versions rejects
+    return components_from_dict(torch.load(path, weights_only=False))
+
+
+def flip_components(components, width):
+    """The components of the horizontally flipped images: the eyes are exchanged and x is mirrored.
+
+    Args:
+        components (ndarray): Components with shape (..., 3, 3).
+        width (int): The image width.
+
+    Returns:
+        ndarray: New flipped components.
+    """
+    flipped = components[..., [1, 0, 2], :].astype(np.float32)
+    flipped[..., 0] = width - flipped[..., 0]
+    return flipped
+
+
+def component_locations(components, eye_enlarge_ratio=1):
+    """The (x1, y1, x2, y2) boxes of the components.
+
+    Args:
+        components (ndarray): Components with shape (..., 3, 3).
+        eye_enlarge_ratio (float): The enlarge ratio of the eye boxes. Default: 1.
+
+    Returns:
+        ndarray: The float32 boxes with shape (..., 3, 4).
+    """
+    center = np.asarray(components[..., :2], dtype=np.float32)
+    enlarge_ratio = np.array([eye_enlarge_ratio, eye_enlarge_ratio, 1], dtype=np.float32)[:, None]
+    half_len = np.asarray(components[..., 2:], dtype=np.float32) * enlarge_ratio
+    return np.concatenate((center - half_len + 1, center + half_len), axis=-1)
@@ -12,6 +12,10 @@ from basicsr.utils.registry import DATASET_REGISTRY
 from torchvision.transforms.functional import (adjust_brightness, adjust_contrast, adjust_hue, adjust_saturation,
                                                normalize)
 
+from .facial_components import component_locations, flip_components, load_components
+from .gt_cache import SharedImageCache
+from .kernel_bank import KernelBank
+
 
 @DATASET_REGISTRY.register()
 class FFHQDegradationDataset(data.Dataset):
@@ -26,6 +30,14 @@ class FFHQDegradationDataset(data.Dataset):
             mean (list | tuple): Image mean.
             std (list | tuple): Image std.
             use_hflip (bool): Whether to horizontally flip.
+            batch_degradation (bool): Only load the gt, the lq images are synthesized on whole batches by
+                :class:`gfpgan.data.batch_degradation.BatchDegradation` in the model. Default: False.
+            kernel_bank (str): Sample the blur kernels from a bank precomputed in this npy file, see
+                :class:`gfpgan.data.kernel_bank.KernelBank`. Default: None.
+            kernel_bank_size (int): The number of kernels of the bank. Default: 4096.
+            gt_cache_bytes (int): Keep up to this many bytes of decoded uint8 gt images in a cache shared by the
+                workers, see :class:`gfpgan.data.gt_cache.SharedImageCache`. Default: None (no cache).
+            gt_cache_path (str): The cache file. Default: None (temporary file).
             Please see more options in the codes.
     """
 
@@ -43,10 +55,11 @@ class FFHQDegradationDataset(data.Dataset):
 
         self.crop_components = opt.get('crop_components', False)  # facial components
         self.eye_enlarge_ratio = opt.get('eye_enlarge_ratio', 1)  # whether enlarge eye regions
+        self.batch_degradation = opt.get('batch_degradation', False)
 
         if self.crop_components:
-            # load component list from a pre-process pth files
-            self.components_list = torch.load(opt.get('component_path'))
+            # load component list from a pre-process npy (or legacy pth) file, (N, 3, 3)
+            self.components_list = load_components(opt.get('component_path'))
 
         # file client (lmdb io backend)
         if self.io_backend_opt['type'] == 'lmdb':
@@ -59,12 +72,25 @@ class FFHQDegradationDataset(data.Dataset):
             # disk backend: scan file list from a folder
             self.paths = paths_from_folder(self.gt_folder)
 
+        # decoded gt cache, shared by the workers
+        self.gt_cache = None
+        if opt.get('gt_cache_bytes'):
+            self.gt_cache = SharedImageCache(
+                len(self.paths), (self.out_size, self.out_size, 3),
+                int(opt['gt_cache_bytes']),
+                path=opt.get('gt_cache_path'))
+            get_root_logger().info(f'Cache {len(self.gt_cache)} / {len(self.paths)} decoded gt images.')
+
         # degradation configurations
         self.blur_kernel_size = opt['blur_kernel_size']
         self.kernel_list = opt['kernel_list']
         self.kernel_prob = opt['kernel_prob']
         self.blur_sigma = opt['blur_sigma']
         self.downsample_range = opt['downsample_range']
+        self.kernel_bank = None
+        if opt.get('kernel_bank') is not None and not self.batch_degradation:
+            self.kernel_bank = KernelBank(opt['kernel_bank'], self.kernel_list, self.kernel_prob, self.blur_kernel_size,
+                                          self.blur_sigma, opt.get('kernel_bank_size', 4096))
         self.noise_range = opt['noise_range']
         self.jpeg_range = opt['jpeg_range']
 
@@ -118,59 +144,57 @@ class FFHQDegradationDataset(data.Dataset):
         return img
 
     def get_component_coordinates(self, index, status):
-        """Get facial component (left_eye, right_eye, mouth) coordinates from a pre-loaded pth file"""
-        components_bbox = self.components_list[f'{index:08d}']
+        """Get facial component (left_eye, right_eye, mouth) coordinates, (3, 4), from the pre-loaded components"""
+        components = self.components_list[index]
         if status[0]:  # hflip
-            # exchange right and left eye
-            tmp = components_bbox['left_eye']
-            components_bbox['left_eye'] = components_bbox['right_eye']
-            components_bbox['right_eye'] = tmp
-            # modify the width coordinate
-            components_bbox['left_eye'][0] = self.out_size - components_bbox['left_eye'][0]
-            components_bbox['right_eye'][0] = self.out_size - components_bbox['right_eye'][0]
-            components_bbox['mouth'][0] = self.out_size - components_bbox['mouth'][0]
-
-        # get coordinates
-        locations = []
-        for part in ['left_eye', 'right_eye', 'mouth']:
-            mean = components_bbox[part][0:2]
-            half_len = components_bbox[part][2]
-            if 'eye' in part:
-                half_len *= self.eye_enlarge_ratio
-            loc = np.hstack((mean - half_len + 1, mean + half_len))
-            loc = torch.from_numpy(loc).float()
-            locations.append(loc)
-        return locations
+            components = flip_components(components, self.out_size)
+        return torch.from_numpy(component_locations(components, self.eye_enlarge_ratio))
 
     def __getitem__(self, index):
         if self.file_client is None:
             self.file_client = FileClient(self.io_backend_opt.pop('type'), **self.io_backend_opt)
 
         # load gt image
-        # Shape: (h, w, c); channel order: BGR; image range: [0, 1], float32.
+        # Shape: (h, w, c); channel order: BGR; uint8, converted to float32 in [0, 1] after the flip.
         gt_path = self.paths[index]
-        img_bytes = self.file_client.get(gt_path)
-        img_gt = imfrombytes(img_bytes, float32=True)
+        img_gt = None if self.gt_cache is None else self.gt_cache.get(index)
+        if img_gt is None:
+            img_bytes = self.file_client.get(gt_path)
+            img_gt = imfrombytes(img_bytes, float32=False)
+            if self.gt_cache is not None:
+                self.gt_cache.put(index, img_gt)
 
         # random horizontal flip
         img_gt, status = augment(img_gt, hflip=self.opt['use_hflip'], rotation=False, return_status=True)
+        img_gt = img_gt.astype(np.float32) / 255.
         h, w, _ = img_gt.shape
 
         # get facial component coordinates
         if self.crop_components:
             locations = self.get_component_coordinates(index, status)
-            loc_left_eye, loc_right_eye, loc_mouth = locations
+
+        if self.batch_degradation:
+            # the lq images are generated on the collated batches
+            img_gt = img2tensor(img_gt, bgr2rgb=True, float32=True)
+            normalize(img_gt, self.mean, self.std, inplace=True)
+            return_dict = {'gt': img_gt, 'gt_path': gt_path}
+            if self.crop_components:
+                return_dict['locations'] = locations
+            return return_dict
 
         # ------------------------ generate lq image ------------------------ #
         # blur
-        kernel = degradations.random_mixed_kernels(
-            self.kernel_list,
-            self.kernel_prob,
-            self.blur_kernel_size,
-            self.blur_sigma,
-            self.blur_sigma, [-math.pi, math.pi],
-            noise_range=None)
-        img_lq = cv2.filter2D(img_gt, -1, kernel)
+        if self.kernel_bank is not None:
+            img_lq = self.kernel_bank.filter2d(img_gt, self.kernel_bank.sample_indices())
+        else:
+            kernel = degradations.random_mixed_kernels(
+                self.kernel_list,
+                self.kernel_prob,
+                self.blur_kernel_size,
+                self.blur_sigma,
+                self.blur_sigma, [-math.pi, math.pi],
+                noise_range=None)
+            img_lq = cv2.filter2D(img_gt, -1, kernel)
         # downsample
         scale = np.random.uniform(self.downsample_range[0], self.downsample_range[1])
         img_lq = cv2.resize(img_lq, (int(w // scale), int(h // scale)), interpolation=cv2.INTER_LINEAR)
@@ -214,14 +238,7 @@ class FFHQDegradationDataset(data.Dataset):
         normalize(img_lq, self.mean, self.std, inplace=True)
 
         if self.crop_components:
-            return_dict = {
-                'lq': img_lq,
-                'gt': img_gt,
-                'gt_path': gt_path,
-                'loc_left_eye': loc_left_eye,
-                'loc_right_eye': loc_right_eye,
-                'loc_mouth': loc_mouth
-            }
+            return_dict = {'lq': img_lq, 'gt': img_gt, 'gt_path': gt_path, 'locations': locations}
             return return_dict
         else:
             return {'lq': img_lq, 'gt': img_gt, 'gt_path': gt_path}
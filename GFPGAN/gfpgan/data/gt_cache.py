@@ -0,0 +1,98 @@
+import atexit
+import numpy as np
+import os
+import tempfile
+
+
+class SharedImageCache():
+    """A cache of decoded uint8 images in a memory-mapped file, shared by all the dataloader workers.
+
+    The file holds one flag byte per slot, then the slots of ``img_shape``. The cache keeps a hot subset: the images
+    with an index below the number of slots that fit in ``max_bytes``. There is no eviction, so that the workers
+    need no lock: a worker writes a slot and then sets its flag, and two workers that decode the same image write
+    the same bytes. The other images and the ones of another shape are decoded at each access.
+
+    By default, the file is a temporary file in /dev/shm (or the temporary folder), removed at the exit of the
+    process that created it.
+
+    Args:
+        num_images (int): The number of images of the dataset.
+        img_shape (tuple[int]): The shape of the cached images, e.g. (512, 512, 3).
+        max_bytes (int): The byte budget of the cache.
+        path (str | None): The cache file. It is overwritten. Default: None (temporary file).
+    """
+
+    def __init__(self, num_images, img_shape, max_bytes, path=None):
+        self.img_shape = tuple(img_shape)
+        self.slot_bytes = int(np.prod(self.img_shape))
+        self.num_slots = int(max(min(num_images, max_bytes // (self.slot_bytes + 1)), 0))
+        self.num_hits = 0
+        self.num_misses = 0
+        self._flags = None
+        self._slots = None
+
+        self.is_temp = path is None
+        if self.is_temp:
+            tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            fd, path = tempfile.mkstemp(prefix='gfpgan_gt_cache_', suffix='.bin', dir=tmp_dir)
+            os.close(fd)
+        self.path = path
+        # a sparse file of zeros: all the slots are empty
+        with open(path, 'wb') as f:
+            f.truncate(self.num_slots * (self.slot_bytes + 1))
+        self._owner_pid = os.getpid()
+        if self.is_temp:
+            atexit.register(self.close)
+
+    def _map(self):
+        if self._flags is None and self.num_slots > 0:
+            self._flags = np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(self.num_slots, ))
+            self._slots = np.memmap(
+                self.path, dtype=np.uint8, mode='r+', offset=self.num_slots, shape=(self.num_slots, ) + self.img_shape)
+
+    def __getstate__(self):
+        # each worker maps the file instead of receiving a pickled copy
+        state = self.__dict__.copy()
+        state['_flags'] = None
+        state['_slots'] = None
+        return state
+
+    def __len__(self):
+        return self.num_slots
+
+    def get(self, index):
+        """Get a copy of a cached image, None if it is not cached.
+
+        It is a copy, since the augmentations of basicsr flip the images in place.
+        """
+        if index < self.num_slots:
+            self._map()
+            if self._flags[index]:
+                self.num_hits += 1
+                return np.array(self._slots[index])
+        self.num_misses += 1
+        return None
+
+    def put(self, index, img):
+        """Cache an image if it is in the hot subset and has the cached shape.
+
+        Returns:
+            bool: Whether the image is cached.
+        """
+        if index >= self.num_slots or img.shape != self.img_shape or img.dtype != np.uint8:
+            return False
+        self._map()
+        self._slots[index] = img
+        self._flags[index] = 1
+        return True
+
+    def close(self):
+        """Unmap the file, and remove it if it is temporary and this process created it."""
+        self._flags = None
+        self._slots = None
+        if self.is_temp and os.getpid() == self._owner_pid and os.path.isfile(self.path):
+            os.remove(self.path)
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}({self.path}): {self.num_slots} slots of {self.img_shape}, '
+                f'{self.num_hits} hits, {self.num_misses} misses')
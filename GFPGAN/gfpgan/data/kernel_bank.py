@@ -0,0 +1,158 @@
+import cv2
+import json
+import math
+import numpy as np
+import os
+import tempfile
+import torch
+from basicsr.data import degradations as degradations
+from basicsr.utils import get_root_logger
+from torch.nn import functional as F
+
+# kernels with a second singular value below this ratio of the first one are applied as two 1D filters
+SEPARABLE_TOL = 1e-6
+
+
+def fft_blur(imgs, kernels):
+    """Filter each image with its own kernel in the frequency domain, as cv2.filter2D (reflect 101 border).
+
+    It is faster than the spatial conv for the large kernels (41x41) of the degradations.
+
+    Args:
+        imgs (Tensor): Images with shape (b, c, h, w).
+        kernels (Tensor): Kernels with shape (b, k, k), k odd.
+
+    Returns:
+        Tensor: The blurred images.
+    """
+    b, c, h, w = imgs.shape
+    pad = kernels.size(-1) // 2
+    imgs = F.pad(imgs, (pad, pad, pad, pad), mode='reflect')
+    size = imgs.shape[-2:]
+    # cv2.filter2D is a correlation: convolve with the flipped kernels
+    spectrum = torch.fft.rfft2(imgs, s=size) * torch.fft.rfft2(kernels.flip(-2, -1), s=size).unsqueeze(1)
+    # the circular convolution is exact away from the wrapped border, that the crop drops
+    return torch.fft.irfft2(spectrum, s=size)[..., 2 * pad:2 * pad + h, 2 * pad:2 * pad + w]
+
+
+class KernelBank():
+    """A bank of blur kernels, precomputed once and memory-mapped by all the dataloader workers.
+
+    The kernels are drawn by ``degradations.random_mixed_kernels`` of basicsr, with the options of
+    FFHQDegradationDataset, so that sampling uniform indices of the bank follows the configured distribution. The bank
+    is a float32 npy file of shape (num_kernels, k + 2, k): the k x k kernel, then its column and row factors if it is
+    separable (e.g. the isotropic Gaussian kernels), zeros otherwise. The options are stored in a json file next to it;
+    the bank is built again if they change.
+
+    Args:
+        path (str): The npy file of the bank. It is built if it does not exist.
+        kernel_list (list[str]): The kernel types.
+        kernel_prob (list[float]): The probabilities of the kernel types.
+        kernel_size (int): The kernel size.
+        blur_sigma (list[float]): The sigma range.
+        num_kernels (int): The number of kernels. Default: 4096.
+        seed (int): The seed of the kernels. Default: 0.
+    """
+
+    def __init__(self, path, kernel_list, kernel_prob, kernel_size, blur_sigma, num_kernels=4096, seed=0):
+        self.path = path
+        self.kernel_size = kernel_size
+        self.meta = dict(
+            kernel_list=list(kernel_list),
+            kernel_prob=[float(prob) for prob in kernel_prob],
+            kernel_size=kernel_size,
+            blur_sigma=[float(sigma) for sigma in blur_sigma],
+            num_kernels=num_kernels,
+            seed=seed)
+        self._bank = None
+
+        meta_path = f'{os.path.splitext(path)[0]}.json'
+        if os.path.isfile(path) and os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                if json.load(f) == self.meta:
+                    return
+            get_root_logger().info(f'The options of the kernel bank {path} changed, build it again.')
+        self.build()
+        with open(meta_path, 'w') as f:
+            json.dump(self.meta, f)
+
+    def build(self):
+        """Draw the kernels and write the bank file atomically."""
+        logger = get_root_logger()
+        logger.info(f'Build the kernel bank {self.path} with {self.meta["num_kernels"]} kernels.')
+        state = np.random.get_state()
+        np.random.seed(self.meta['seed'])
+        try:
+            kernels = np.stack([
+                degradations.random_mixed_kernels(
+                    self.meta['kernel_list'],
+                    self.meta['kernel_prob'],
+                    self.kernel_size,
+                    self.meta['blur_sigma'],
+                    self.meta['blur_sigma'], [-math.pi, math.pi],
+                    noise_range=None) for _ in range(self.meta['num_kernels'])
+            ]).astype(np.float32)
+        finally:
+            np.random.set_state(state)
+
+        # rank-1 kernels are the outer products of their first singular vectors
+        u, s, vt = np.linalg.svd(kernels)
+        separable = s[:, 1] <= SEPARABLE_TOL * s[:, 0]
+        factors = np.zeros((len(kernels), 2, self.kernel_size), dtype=np.float32)
+        factors[:, 0] = u[:, :, 0] * np.sqrt(s[:, :1])
+        factors[:, 1] = vt[:, 0] * np.sqrt(s[:, :1])
+        factors[~separable] = 0
+        logger.info(f'{separable.sum()} / {len(kernels)} kernels are separable.')
+
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dirname, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.concatenate([kernels, factors], axis=1))
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @property
+    def bank(self):
+        # opened lazily, so that each worker maps the file instead of receiving a pickled copy
+        if self._bank is None:
+            self._bank = np.load(self.path, mmap_mode='r')
+        return self._bank
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_bank'] = None
+        return state
+
+    def __len__(self):
+        return self.meta['num_kernels']
+
+    def sample_indices(self, num=None):
+        """Uniform random indices of the bank, an int if num is None."""
+        return np.random.randint(len(self), size=num)
+
+    def get(self, indices):
+        """The kernels of an index or an array of indices, as float32 arrays."""
+        return np.array(self.bank[indices, :self.kernel_size])
+
+    def filter2d(self, img, index):
+        """Filter an image with a kernel of the bank, as ``cv2.filter2D``.
+
+        The separable kernels are applied as two 1D filters. cv2.filter2D already switches to the DFT for large
+        kernels, so the other ones are applied by it.
+
+        Args:
+            img (ndarray): The image.
+            index (int): The kernel index.
+
+        Returns:
+            ndarray: The blurred image.
+        """
+        entry = self.bank[index]
+        column, row = entry[self.kernel_size], entry[self.kernel_size + 1]
+        if row.any():
+            return cv2.sepFilter2D(img, -1, row, column)
+        return cv2.filter2D(img, -1, np.array(entry[:self.kernel_size]))
@@ -0,0 +1,231 @@
+import contextlib
+import hashlib
+import numpy as np
+import os
+import torch
+from torch import nn
+
+from gfpgan.noise import NOISE_MODES, NoiseBuffers, fold_noise
+
+TORCH_ENGINES = ('eager', 'script', 'compile')
+ENGINES = TORCH_ENGINES + ('onnx', )
+
+
+def bf16_supported(device):
+    """Whether bf16 is fast on the device: bf16 units (AVX512-BF16 / AMX) on CPU, or Ampere and newer GPUs."""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def to_channels_last(model):
+    """Convert the weights of all the Conv2d layers to channels_last.
+
+    ``model.to(memory_format=torch.channels_last)`` cannot be used, since the weights of modulated convolutions are
+    5-D. They are left unchanged.
+    """
+    for module in model.modules():
+        if isinstance(module, nn.Conv2d):
+            module.to(memory_format=torch.channels_last)
+    return model
+
+
+class _RestoreForward(nn.Module):
+    """Only return the restored faces, so that the model can be traced and compiled."""
+
+    def __init__(self, gfpgan, randomize_noise, noise_buffers=None):
+        super(_RestoreForward, self).__init__()
+        self.gfpgan = gfpgan
+        self.randomize_noise = randomize_noise
+        self.noise_buffers = noise_buffers
+
+    def forward(self, x):
+        noise = None if self.noise_buffers is None else self.noise_buffers(x.size(0))
+        if hasattr(self.gfpgan, 'inference'):  # the forward with a lower peak memory of GFPGANv1Clean
+            return self.gfpgan.inference(x, randomize_noise=self.randomize_noise, noise=noise)
+        return self.gfpgan(x, return_rgb=False, randomize_noise=self.randomize_noise, noise=noise)[0]
+
+
+class InferenceEngine():
+    """Run a GFPGAN model for inference, eager, TorchScript-traced or with torch.compile.
+
+    The traced and compiled engines use the stored noise of the StyleGAN2 decoder (``randomize_noise=False``), so that
+    their outputs are deterministic. The eager engine keeps the random noise, the same as ``GFPGANer`` before. Other
+    noise modes (see :mod:`gfpgan.noise`) are used by all the engines:
+
+    - buffer: preallocated noise for each batch slot, sampled once, instead of new noise in every forward.
+    - fold: the noise injection of the layers with negligible noise strength is skipped, the others use buffers.
+
+    Compiled artifacts are cached in ``cache_dir``, so later processes skip the compilation:
+
+    - script: the modulated convolutions of the decoder fix the batch size in the traced graph, so one module is
+      traced for each batch size, the first time it is used. The traced modules are saved with ``torch.jit.save``.
+      The file name is a hash of ``cache_key`` (e.g., the model path and its modification time), the engine options,
+      the input shape and the torch version.
+    - compile: the FX graph cache of TorchInductor is enabled and stored in ``cache_dir/inductor``.
+
+    Args:
+        model (nn.Module): The GFPGAN model, in eval mode and on its device.
+        engine (str): eager | script | compile. Default: eager.
+        channels_last (bool): Use the channels_last memory format. Default: False.
+        bf16 (bool): Use bf16 autocast, if the device supports it. Default: False.
+        cache_dir (str | None): The folder of compiled artifacts. None for no cache. Default: None.
+        cache_key (str): Identify the model weights in the cache. Default: ''.
+        input_size (int): The size of the input faces. Default: 512.
+        noise_mode (str): random | buffer | fold. Default: random.
+    """
+
+    def __init__(self,
+                 model,
+                 engine='eager',
+                 channels_last=False,
+                 bf16=False,
+                 cache_dir=None,
+                 cache_key='',
+                 input_size=512,
+                 noise_mode='random'):
+        if engine not in TORCH_ENGINES:
+            raise ValueError(f'Wrong engine: {engine}. Supported ones are: {" | ".join(TORCH_ENGINES)}.')
+        if noise_mode not in NOISE_MODES:
+            raise ValueError(f'Wrong noise mode: {noise_mode}. Supported ones are: {" | ".join(NOISE_MODES)}.')
+        self.engine = engine
+        self.device = next(model.parameters()).device
+        self.channels_last = channels_last
+        self.bf16 = bf16
+        if bf16 and not bf16_supported(self.device):
+            print(f'\tbf16 is not supported on {self.device}, fall back to fp32.')
+            self.bf16 = False
+        self.cache_dir = cache_dir
+        self.cache_key = cache_key
+        self.input_size = input_size
+        self.noise_mode = noise_mode
+
+        if channels_last:
+            to_channels_last(model)
+        noise_buffers = None
+        if noise_mode != 'random':
+            if noise_mode == 'fold':
+                fold_noise(model.stylegan_decoder)
+            noise_buffers = NoiseBuffers(model.stylegan_decoder)
+        self.model = _RestoreForward(model, randomize_noise=engine == 'eager', noise_buffers=noise_buffers).eval()
+        self._traced = {}  # batch size -> traced module
+        if engine == 'compile':
+            if cache_dir is not None:
+                # must be set before the first compilation
+                import torch._inductor.config as inductor_config
+                os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.join(cache_dir, 'inductor'))
+                inductor_config.fx_graph_cache = True
+            self.model = torch.compile(self.model)
+
+    def _autocast(self):
+        if self.bf16:
+            return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def _prepare(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x
+
+    def _get_trace_path(self, shape):
+        hasher = hashlib.sha1()
+        hasher.update(f'{self.cache_key};{torch.__version__};{self.device.type};{tuple(shape)};'
+                      f'channels_last={self.channels_last};bf16={self.bf16};noise_mode={self.noise_mode}'.encode())
+        return os.path.join(self.cache_dir, f'gfpgan_script_{hasher.hexdigest()}.pt')
+
+    def _get_traced(self, x):
+        if x.size(0) not in self._traced:
+            self._traced[x.size(0)] = self._trace(x)
+        return self._traced[x.size(0)]
+
+    def _trace(self, x):
+        trace_path = None
+        if self.cache_dir is not None:
+            trace_path = self._get_trace_path(x.shape)
+            if os.path.isfile(trace_path):
+                try:
+                    return torch.jit.load(trace_path, map_location=self.device)
+                except RuntimeError as error:
+                    print(f'\tFailed to load the cached TorchScript module {trace_path}: {error}.')
+
+        traced = torch.jit.freeze(torch.jit.trace(self.model, x, check_trace=False))
+
+        if trace_path is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = f'{trace_path}.{os.getpid()}.tmp'
+            torch.jit.save(traced, tmp_path)
+            os.replace(tmp_path, trace_path)
+        return traced
+
+    @torch.no_grad()
+    def warmup(self, batch_sizes=(1, )):
+        """Run dummy inputs, so that the (lazy) compilation and the allocations are done before the real inputs."""
+        for batch_size in batch_sizes:
+            self(torch.zeros(batch_size, 3, self.input_size, self.input_size, device=self.device))
+
+    @torch.no_grad()
+    def __call__(self, x):
+        """Restore a batch of faces.
+
+        Args:
+            x (Tensor): Faces with shape (n, 3, h, w), normalized to [-1, 1].
+
+        Returns:
+            Tensor: The restored faces, float32.
+        """
+        x = self._prepare(x)
+        with self._autocast():
+            if self.engine == 'script':
+                output = self._get_traced(x)(x)
+            else:
+                output = self.model(x)
+        return output.float()
+
+
+class OnnxEngine():
+    """Run a GFPGAN model exported by ``scripts/export_onnx.py`` with onnxruntime on CPU.
+
+    If the model was exported with ``--noise input``, new random noise is given at each call, the same as the eager
+    PyTorch model. Otherwise, the noise is baked in the graph.
+
+    Args:
+        onnx_path (str): Path to the ONNX model.
+        num_threads (int): Number of intra-op threads. 0 for the onnxruntime default. Default: 0.
+    """
+
+    def __init__(self, onnx_path, num_threads=0):
+        import onnxruntime  # optional dependency
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        inputs = self.session.get_inputs()
+        self.input_name = inputs[0].name
+        self.input_size = inputs[0].shape[-1]
+        # (name, (h, w)) of the noise inputs
+        self.noise_inputs = [(node.name, tuple(node.shape[2:4])) for node in inputs[1:]]
+        self.device = torch.device('cpu')
+
+    def warmup(self, batch_sizes=(1, )):
+        """Run dummy inputs, so that the allocations are done before the real inputs."""
+        for batch_size in batch_sizes:
+            self(torch.zeros(batch_size, 3, self.input_size, self.input_size))
+
+    def __call__(self, x):
+        """Restore a batch of faces.
+
+        Args:
+            x (Tensor): Faces with shape (n, 3, h, w), normalized to [-1, 1].
+
+        Returns:
+            Tensor: The restored faces, float32, on cpu.
+        """
+        x = x.detach().float().cpu().numpy()
+        feeds = {self.input_name: x}
+        for name, (h, w) in self.noise_inputs:
+            feeds[name] = np.random.randn(x.shape[0], 1, h, w).astype(np.float32)
+        return torch.from_numpy(self.session.run(None, feeds)[0])
@@ -0,0 +1,103 @@
+import json
+import mmap
+import numpy as np
+import os
+import struct
+import torch
+
+MAGIC = b'GFPGANFW'
+FORMAT_VERSION = 1
+ALIGNMENT = 64  # bytes, for aligned (vectorized) reads of each tensor
+
+_DTYPES = {
+    'float32': torch.float32,
+    'float16': torch.float16,
+    'bfloat16': torch.bfloat16,
+    'int64': torch.int64,
+    'int32': torch.int32,
+    'int8': torch.int8,
+    'uint8': torch.uint8,
+    'bool': torch.bool
+}
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def is_flat_weights(path):
+    """Whether a file is in the flat weight format."""
+    if not os.path.isfile(path):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def save_flat_weights(state_dict, save_path, metadata=None):
+    """Save a state dict in the flat weight format.
+
+    The file is: ``MAGIC``, the header length (uint64, little endian), a JSON header with the name, dtype, shape and
+    offset of each tensor, and the raw tensor data, each tensor aligned to 64 bytes. So it can be memory-mapped and
+    the tensors can be used without copy.
+
+    Args:
+        state_dict (dict[str, Tensor]): The state dict.
+        save_path (str): The output path.
+        metadata (dict | None): JSON-serializable information, e.g., the arch options. Default: None.
+    """
+    tensors = {}
+    offset = 0
+    for name, tensor in state_dict.items():
+        dtype = str(tensor.dtype).replace('torch.', '')
+        if dtype not in _DTYPES:
+            raise TypeError(f'Unsupported dtype {tensor.dtype} of {name}.')
+        offset = _align(offset)
+        tensors[name] = {'dtype': dtype, 'shape': list(tensor.shape), 'offset': offset}
+        offset += tensor.numel() * tensor.element_size()
+    header = json.dumps({'version': FORMAT_VERSION, 'metadata': metadata or {}, 'tensors': tensors}).encode()
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f'{save_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, tensor in state_dict.items():
+            f.seek(data_start + tensors[name]['offset'])
+            # write the raw bytes, bfloat16 has no numpy dtype
+            data = tensor.detach().cpu().contiguous().view(-1)
+            f.write(data.view(torch.uint8).numpy().tobytes() if data.numel() else b'')
+    os.replace(tmp_path, save_path)
+
+
+def load_flat_weights(path):
+    """Load a file in the flat weight format, with memory mapping.
+
+    The tensors are views of a private (copy-on-write) mapping of the file: nothing is read until it is used, and
+    pages are shared with the page cache, and with other processes loading the same file.
+
+    Returns:
+        dict[str, Tensor]: The state dict, on cpu.
+        dict: The metadata.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not in the flat weight format.')
+        header_len = struct.unpack('<Q', f.read(8))[0]
+        header = json.loads(f.read(header_len))
+        if header['version'] > FORMAT_VERSION:
+            raise ValueError(f'Unsupported flat weight format version {header["version"]} of {path}.')
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    state_dict = {}
+    for name, info in header['tensors'].items():
+        dtype = _DTYPES[info['dtype']]
+        numel = int(np.prod(info['shape'], dtype=np.int64))
+        if numel == 0:
+            state_dict[name] = torch.empty(info['shape'], dtype=dtype)
+            continue
+        # torch.frombuffer keeps a reference to the mapping
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=numel, offset=data_start + info['offset'])
+        state_dict[name] = tensor.view(info['shape'])
+    return state_dict, header['metadata']
@@ -0,0 +1,320 @@
+import math
+import torch
+from basicsr.archs import stylegan2_arch
+from basicsr.ops.fused_act import FusedLeakyReLU
+from torch import nn
+
+from gfpgan.archs import stylegan2_bilinear_arch
+from gfpgan.archs.gfpganv1_arch import ConvUpLayer, ResUpBlock
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+
+# the equalized learning rate layers of the bilinear arch and of the original arch (basicsr)
+EQUAL_CONVS = (stylegan2_bilinear_arch.EqualConv2d, stylegan2_arch.EqualConv2d)
+EQUAL_LINEARS = (stylegan2_bilinear_arch.EqualLinear, stylegan2_arch.EqualLinear)
+SCALED_ACTIVATIONS = (stylegan2_bilinear_arch.ScaledLeakyReLU, stylegan2_arch.ScaledLeakyReLU, FusedLeakyReLU)
+MODULATED_CONVS = (stylegan2_bilinear_arch.ModulatedConv2d, stylegan2_arch.ModulatedConv2d)
+RES_BLOCKS = (stylegan2_bilinear_arch.ResBlock, stylegan2_arch.ResBlock, ResUpBlock)
+
+
+class FoldedResBlock(nn.Module):
+    """A residual block whose output scale (1 / sqrt(2)) is folded into the weights of its branches."""
+
+    def __init__(self, conv1, conv2, skip):
+        super(FoldedResBlock, self).__init__()
+        self.conv1 = conv1
+        self.conv2 = conv2
+        self.skip = skip
+
+    def forward(self, x):
+        return self.conv2(self.conv1(x)) + self.skip(x)
+
+
+def _activation_gain(activation):
+    """The gain, bias and negative slope of a scaled leaky relu (ScaledLeakyReLU or FusedLeakyReLU)."""
+    if isinstance(activation, FusedLeakyReLU):
+        return activation.scale, activation.bias.detach(), activation.negative_slope
+    return math.sqrt(2), None, activation.negative_slope
+
+
+def _folded_conv(layer, gain=1, bias=None):
+    """An nn.Conv2d computing ``gain * (layer(x) + bias)`` for an EqualConv2d or the conv of a ConvUpLayer."""
+    if bias is None:
+        bias = layer.bias.detach() if layer.bias is not None else None
+    out_channels, in_channels, kernel_size, _ = layer.weight.shape
+    conv = nn.Conv2d(
+        in_channels,
+        out_channels,
+        kernel_size,
+        stride=layer.stride,
+        padding=layer.padding,
+        bias=bias is not None,
+        device=layer.weight.device,
+        dtype=layer.weight.dtype)
+    conv.weight.data.copy_(layer.weight.detach() * (layer.scale * gain))
+    if bias is not None:
+        conv.bias.data.copy_(bias * gain)
+    return conv
+
+
+def _fold_layer(layer, gain=1):
+    """The folded layer computing ``gain * layer(x)``, or None if the layer has nothing to fold.
+
+    A positive gain goes through the leaky relus, so it is folded into the weights and biases before them.
+    """
+    if isinstance(layer, EQUAL_CONVS):
+        return _folded_conv(layer, gain)
+    if isinstance(layer, EQUAL_LINEARS):
+        bias = layer.bias.detach() * layer.lr_mul if layer.bias is not None else None
+        if layer.activation == 'fused_lrelu':
+            gain *= math.sqrt(2)
+        linear = nn.Linear(
+            layer.in_channels,
+            layer.out_channels,
+            bias=bias is not None,
+            device=layer.weight.device,
+            dtype=layer.weight.dtype)
+        linear.weight.data.copy_(layer.weight.detach() * (layer.scale * gain))
+        if bias is not None:
+            linear.bias.data.copy_(bias * gain)
+        if layer.activation == 'fused_lrelu':
+            return nn.Sequential(linear, nn.LeakyReLU(0.2, True))
+        return linear
+    if isinstance(layer, ConvUpLayer):
+        layers = [nn.Upsample(scale_factor=2, mode='bilinear', align_corners=False)]
+        if layer.activation is None:
+            layers.append(_folded_conv(layer, gain))
+        else:
+            act_gain, bias, negative_slope = _activation_gain(layer.activation)
+            layers.extend([_folded_conv(layer, gain * act_gain, bias), nn.LeakyReLU(negative_slope, True)])
+        return nn.Sequential(*layers)
+    if isinstance(layer, RES_BLOCKS):
+        conv1 = _fold_layer(layer.conv1)
+        conv2 = _fold_layer(layer.conv2, gain / math.sqrt(2))
+        skip = _fold_layer(layer.skip, gain / math.sqrt(2))
+        return FoldedResBlock(conv1, conv2, skip)
+    if isinstance(layer, nn.Sequential) and any(isinstance(child, EQUAL_CONVS) for child in layer):
+        # ConvLayer or SFT branch: fold the activations into the convs before them, and the gain into the last conv
+        children = list(layer)
+        last_conv = max(idx for idx, child in enumerate(children) if isinstance(child, EQUAL_CONVS))
+        layers = []
+        for idx, child in enumerate(children):
+            if isinstance(child, SCALED_ACTIVATIONS) and idx > 0 and isinstance(children[idx - 1], EQUAL_CONVS):
+                continue  # folded with the conv
+            if not isinstance(child, EQUAL_CONVS):
+                layers.append(child)
+                continue
+            conv_gain = gain if idx == last_conv else 1
+            activation = children[idx + 1] if idx + 1 < len(children) else None
+            if isinstance(activation, SCALED_ACTIVATIONS):
+                act_gain, bias, negative_slope = _activation_gain(activation)
+                layers.extend([_folded_conv(child, conv_gain * act_gain, bias), nn.LeakyReLU(negative_slope, True)])
+            else:
+                layers.append(_folded_conv(child, conv_gain))
+        return nn.Sequential(*layers)
+    if gain != 1:
+        raise ValueError(f'Cannot fold a gain into {layer.__class__.__name__}.')
+    return None
+
+
+@torch.no_grad()
+def fold_weights(model):
+    """Fold the equalized learning rate scales and the activation gains into the stored weights, in place.
+
+    It is for the inference of the bilinear and original archs, whose layers rescale their weights in every forward:
+
+    - EqualConv2d, EqualLinear and ConvUpLayer become nn.Conv2d / nn.Linear, with the scale (and lr_mul) folded.
+    - The sqrt(2) gains of ScaledLeakyReLU and FusedLeakyReLU after a conv, and the 1 / sqrt(2) output scale of the
+      ResBlocks, are folded into the convs before them (the leaky relu is positively homogeneous).
+    - The scale of ModulatedConv2d is folded into its weight.
+
+    The FusedLeakyReLU of the StyleConvs of the decoder is kept, since its gain cannot go through the demodulation.
+    The outputs are the same up to float rounding. The folded model should not be trained, the equalized learning
+    rate is lost.
+
+    Args:
+        model (nn.Module): The model, e.g. GFPGANBilinear or GFPGANv1.
+
+    Returns:
+        nn.Module: The same model.
+    """
+    for name, child in model.named_children():
+        folded = _fold_layer(child)
+        if folded is not None:
+            setattr(model, name, folded)
+            continue
+        if isinstance(child, MODULATED_CONVS):
+            child.weight.mul_(child.scale)
+            child.scale = 1
+        fold_weights(child)
+    return model
+
+
+def convert_bilinear_state_dict(state_dict_bilinear, state_dict_clean):
+    """Convert the state dict of a GFPGANBilinear to the one of a GFPGANv1Clean, with the same outputs.
+
+    The equalized learning rate scales, the lr_mul of the style MLP and the activation gains are folded into the
+    weights.
+
+    Args:
+        state_dict_bilinear (dict): The state dict of the GFPGANBilinear.
+        state_dict_clean (dict): The state dict of a GFPGANv1Clean with the same channels, updated in place.
+
+    Returns:
+        dict: The state dict of the GFPGANv1Clean.
+    """
+    for ori_k, ori_v in state_dict_bilinear.items():
+        if 'stylegan_decoder' in ori_k:
+            if 'style_mlp' in ori_k:  # style_mlp_layers
+                lr_mul = 0.01
+                prefix, name, idx, var = ori_k.split('.')
+                idx = (int(idx) * 2) - 1
+                crt_k = f'{prefix}.{name}.{idx}.{var}'
+                if var == 'weight':
+                    _, c_in = ori_v.size()
+                    scale = (1 / math.sqrt(c_in)) * lr_mul
+                    crt_v = ori_v * scale * 2**0.5
+                else:
+                    crt_v = ori_v * lr_mul * 2**0.5
+                state_dict_clean[crt_k] = crt_v
+            elif 'modulation' in ori_k:  # modulation in StyleConv
+                lr_mul = 1
+                crt_k = ori_k
+                var = ori_k.split('.')[-1]
+                if var == 'weight':
+                    _, c_in = ori_v.size()
+                    scale = (1 / math.sqrt(c_in)) * lr_mul
+                    crt_v = ori_v * scale
+                else:
+                    crt_v = ori_v * lr_mul
+                state_dict_clean[crt_k] = crt_v
+            elif 'style_conv' in ori_k:
+                # StyleConv in style_conv1 and style_convs
+                if 'activate' in ori_k:  # FusedLeakyReLU
+                    # eg. style_conv1.activate.bias
+                    # eg. style_convs.13.activate.bias
+                    split_rlt = ori_k.split('.')
+                    if len(split_rlt) == 4:
+                        prefix, name, _, var = split_rlt
+                        crt_k = f'{prefix}.{name}.{var}'
+                    elif len(split_rlt) == 5:
+                        prefix, name, idx, _, var = split_rlt
+                        crt_k = f'{prefix}.{name}.{idx}.{var}'
+                    crt_v = ori_v * 2**0.5  # 2**0.5 used in FusedLeakyReLU
+                    c = crt_v.size(0)
+                    state_dict_clean[crt_k] = crt_v.view(1, c, 1, 1)
+                elif 'modulated_conv' in ori_k:
+                    # eg. style_conv1.modulated_conv.weight
+                    # eg. style_convs.13.modulated_conv.weight
+                    _, c_out, c_in, k1, k2 = ori_v.size()
+                    scale = 1 / math.sqrt(c_in * k1 * k2)
+                    crt_k = ori_k
+                    state_dict_clean[crt_k] = ori_v * scale
+                elif 'weight' in ori_k:
+                    crt_k = ori_k
+                    state_dict_clean[crt_k] = ori_v * 2**0.5
+            elif 'to_rgb' in ori_k:  # StyleConv in to_rgb1 and to_rgbs
+                if 'modulated_conv' in ori_k:
+                    # eg. to_rgb1.modulated_conv.weight
+                    # eg. to_rgbs.5.modulated_conv.weight
+                    _, c_out, c_in, k1, k2 = ori_v.size()
+                    scale = 1 / math.sqrt(c_in * k1 * k2)
+                    crt_k = ori_k
+                    state_dict_clean[crt_k] = ori_v * scale
+                else:
+                    crt_k = ori_k
+                    state_dict_clean[crt_k] = ori_v
+            else:
+                crt_k = ori_k
+                state_dict_clean[crt_k] = ori_v
+            # end of 'stylegan_decoder'
+        elif 'conv_body_first' in ori_k or 'final_conv' in ori_k:
+            # key name
+            name, _, var = ori_k.split('.')
+            crt_k = f'{name}.{var}'
+            # weight and bias
+            if var == 'weight':
+                c_out, c_in, k1, k2 = ori_v.size()
+                scale = 1 / math.sqrt(c_in * k1 * k2)
+                state_dict_clean[crt_k] = ori_v * scale * 2**0.5
+            else:
+                state_dict_clean[crt_k] = ori_v * 2**0.5
+        elif 'conv_body' in ori_k:
+            if 'conv_body_up' in ori_k:
+                ori_k = ori_k.replace('conv2.weight', 'conv2.1.weight')
+                ori_k = ori_k.replace('skip.weight', 'skip.1.weight')
+            name1, idx1, name2, _, var = ori_k.split('.')
+            crt_k = f'{name1}.{idx1}.{name2}.{var}'
+            if name2 == 'skip':
+                c_out, c_in, k1, k2 = ori_v.size()
+                scale = 1 / math.sqrt(c_in * k1 * k2)
+                state_dict_clean[crt_k] = ori_v * scale / 2**0.5
+            else:
+                if var == 'weight':
+                    c_out, c_in, k1, k2 = ori_v.size()
+                    scale = 1 / math.sqrt(c_in * k1 * k2)
+                    state_dict_clean[crt_k] = ori_v * scale
+                else:
+                    state_dict_clean[crt_k] = ori_v
+                if 'conv1' in ori_k:
+                    state_dict_clean[crt_k] = state_dict_clean[crt_k] * 2**0.5  # not in place: it may be ori_v
+        elif 'toRGB' in ori_k:
+            crt_k = ori_k
+            if 'weight' in ori_k:
+                c_out, c_in, k1, k2 = ori_v.size()
+                scale = 1 / math.sqrt(c_in * k1 * k2)
+                state_dict_clean[crt_k] = ori_v * scale
+            else:
+                state_dict_clean[crt_k] = ori_v
+        elif 'final_linear' in ori_k:
+            crt_k = ori_k
+            if 'weight' in ori_k:
+                _, c_in = ori_v.size()
+                scale = 1 / math.sqrt(c_in)
+                state_dict_clean[crt_k] = ori_v * scale
+            else:
+                state_dict_clean[crt_k] = ori_v
+        elif 'condition' in ori_k:
+            crt_k = ori_k
+            if '0.weight' in ori_k:
+                c_out, c_in, k1, k2 = ori_v.size()
+                scale = 1 / math.sqrt(c_in * k1 * k2)
+                state_dict_clean[crt_k] = ori_v * scale * 2**0.5
+            elif '0.bias' in ori_k:
+                state_dict_clean[crt_k] = ori_v * 2**0.5
+            elif '2.weight' in ori_k:
+                c_out, c_in, k1, k2 = ori_v.size()
+                scale = 1 / math.sqrt(c_in * k1 * k2)
+                state_dict_clean[crt_k] = ori_v * scale
+            elif '2.bias' in ori_k:
+                state_dict_clean[crt_k] = ori_v
+
+    return state_dict_clean
+
+
+@torch.no_grad()
+def bilinear_to_clean(gfpgan, channel_multiplier, narrow=1):
+    """Convert a GFPGANBilinear model to a GFPGANv1Clean model with the same outputs, for inference.
+
+    Args:
+        gfpgan (GFPGANBilinear): The model.
+        channel_multiplier (int): Its channel multiplier.
+        narrow (float): Its narrow ratio. Default: 1.
+
+    Returns:
+        GFPGANv1Clean: The converted model, in eval mode.
+    """
+    decoder = gfpgan.stylegan_decoder
+    clean = GFPGANv1Clean(
+        out_size=2**gfpgan.log_size,
+        num_style_feat=gfpgan.num_style_feat,
+        channel_multiplier=channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=len(decoder.style_mlp) - 1,
+        input_is_latent=gfpgan.input_is_latent,
+        different_w=gfpgan.different_w,
+        narrow=narrow,
+        sft_half=decoder.sft_half)
+    state_dict = convert_bilinear_state_dict(gfpgan.state_dict(), clean.state_dict())
+    clean.load_state_dict(state_dict, strict=True)
+    return clean.to(decoder.noises.noise0.device).eval()
@@ -0,0 +1,88 @@
+import torch
+from torch import nn
+
+from gfpgan.archs import gfpganv1_clean_arch, stylegan2_bilinear_arch, stylegan2_clean_arch
+from gfpgan.archs.gfpganv1_arch import ConvUpLayer
+
+TO_RGBS = (stylegan2_clean_arch.ToRGB, stylegan2_bilinear_arch.ToRGB)
+# upsampling modes whose weights sum to 1, so that they commute with the per-channel linear maps (with a bias)
+COMMUTING_MODES = ('bilinear', 'nearest')
+
+
+def _is_pointwise_conv(conv):
+    """Whether an nn.Conv2d only mixes the channels of each pixel."""
+    return (conv.kernel_size == (1, 1) and conv.stride == (1, 1) and conv.padding in ((0, 0), 'valid')
+            and conv.groups == 1)
+
+
+def _is_upsample(layer):
+    return (isinstance(layer, nn.Upsample) and layer.mode in COMMUTING_MODES and layer.scale_factor is not None
+            and float(layer.scale_factor) > 1)
+
+
+def _reorder_sequential(seq):
+    """Swap the adjacent (Upsample, 1x1 Conv2d) pairs of a nn.Sequential, e.g. a folded ConvUpLayer.
+
+    Returns:
+        int: The number of swapped pairs.
+    """
+    num_swapped = 0
+    for idx in range(len(seq) - 1):
+        if _is_upsample(seq[idx]) and isinstance(seq[idx + 1], nn.Conv2d) and _is_pointwise_conv(seq[idx + 1]):
+            seq[idx], seq[idx + 1] = seq[idx + 1], seq[idx]
+            num_swapped += 1
+    return num_swapped
+
+
+def _merge_rgb_biases(decoder):
+    """Merge the biases of the ToRGB layers of a StyleGAN2 decoder into the last one.
+
+    The bias of a level is kept by the upsampling of the rgb skips, so the final image gets the sum of all the biases.
+    """
+    to_rgbs = [decoder.to_rgb1, *decoder.to_rgbs]
+    biases = [to_rgb.bias for to_rgb in to_rgbs if to_rgb.bias is not None]
+    bias = torch.stack([b.detach() for b in biases]).sum(0)
+    for to_rgb in to_rgbs[:-1]:
+        to_rgb.bias = None
+    to_rgbs[-1].bias = nn.Parameter(bias)
+    for to_rgb in to_rgbs:
+        to_rgb.inplace = True
+
+
+@torch.no_grad()
+def optimize_graph(model):
+    """Rewrite the linear op orderings of a GFPGAN model into cheaper equivalent ones, in place.
+
+    It is for the inference of GFPGANv1Clean, GFPGANBilinear, and of the models folded by
+    :func:`gfpgan.folding.fold_weights`:
+
+    - The 1x1 skip convs of the upsampling residual blocks run before the bilinear upsampling, on a quarter of the
+      pixels (the ResBlock of the clean arch, ConvUpLayer, and the nn.Sequential(Upsample, Conv2d) of the folded
+      models). Both ops are linear and the upsampling keeps constants, so they commute, also with a bias.
+    - The biases of the ToRGB layers are merged into the last one, and the rgb skips are added in place.
+    - The sqrt(2) output gain of the StyleConvs of the clean arch is applied to the demodulation coefficients
+      (b * c_out elements) instead of the outputs, and the noise, bias and leaky relu update the conv outputs in place.
+
+    The downsampling blocks already resample before their 1x1 skip convs, which is the cheaper order. The outputs are
+    the same up to float rounding. The intermediate rgb images of the decoders lose their biases, so the optimized
+    model only gives the final images, and should not be trained.
+
+    Args:
+        model (nn.Module): The model.
+
+    Returns:
+        nn.Module: The same model.
+    """
+    for module in model.modules():
+        if isinstance(module, gfpganv1_clean_arch.ResBlock) and module.scale_factor > 1:
+            module.skip_conv_first = True
+        elif isinstance(module, ConvUpLayer) and module.kernel_size == 1 and module.stride == 1:
+            module.conv_first = module.padding == 0
+        elif isinstance(module, nn.Sequential):
+            _reorder_sequential(module)
+        elif isinstance(module, stylegan2_clean_arch.StyleConv) and module.modulated_conv.demodulate:
+            module.fold_gain = True
+            module.modulated_conv.gain = 2**0.5
+        if isinstance(getattr(module, 'to_rgb1', None), TO_RGBS):
+            _merge_rgb_biases(module)
+    return model
@@ -0,0 +1,270 @@
+import csv
+import hashlib
+import numpy as np
+import os
+import tempfile
+import threading
+import torch
+from basicsr.utils import img2tensor
+from basicsr.utils.download_util import load_file_from_url
+from torch.nn import functional as F
+
+from gfpgan.archs.arcface_arch import ResNetArcFace
+
+ARCFACE_URL = 'https://github.com/TencentARC/GFPGAN/releases/download/v0.1.0/arcface_resnet18.pth'
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# bump it when the embeddings change, so that old entries are never read
+CACHE_VERSION = 1
+
+
+def gray_resize_for_identity(out, size=128):
+    """Convert RGB images to the gray inputs of ResNetArcFace.
+
+    Args:
+        out (Tensor): RGB images with shape (b, 3, h, w), in [-1, 1].
+        size (int): The output size. Default: 128.
+
+    Returns:
+        Tensor: Gray images with shape (b, 1, size, size).
+    """
+    out_gray = (0.2989 * out[:, 0, :, :] + 0.5870 * out[:, 1, :, :] + 0.1140 * out[:, 2, :, :])
+    out_gray = out_gray.unsqueeze(1)
+    out_gray = F.interpolate(out_gray, (size, size), mode='bilinear', align_corners=False)
+    return out_gray
+
+
+def cosine_similarity(embeddings_a, embeddings_b):
+    """Cosine similarity of the rows of two arrays of embeddings with shape (n, c)."""
+    embeddings_a = embeddings_a / np.linalg.norm(embeddings_a, axis=1, keepdims=True).clip(min=1e-12)
+    embeddings_b = embeddings_b / np.linalg.norm(embeddings_b, axis=1, keepdims=True).clip(min=1e-12)
+    return (embeddings_a * embeddings_b).sum(1)
+
+
+class EmbeddingCache():
+    """On-disk cache of identity embeddings.
+
+    Each entry is an ``.npy`` file with the embedding of one face image. The key is a hash of the image content and of
+    the embedding model (see :meth:`IdentityEmbedder.get_key`), so a stale entry is never hit.
+
+    Args:
+        cache_dir (str): The cache folder.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.num_hits = 0
+        self.num_misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f'{key}.npy')
+
+    def get(self, key):
+        """Get a cached embedding, None if the entry does not exist or cannot be read."""
+        path = self._path(key)
+        if not os.path.isfile(path):
+            self.num_misses += 1
+            return None
+        try:
+            embedding = np.load(path, allow_pickle=False)
+        except (OSError, ValueError, EOFError):  # corrupted entry
+            self.remove(key)
+            self.num_misses += 1
+            return None
+        self.num_hits += 1
+        return embedding
+
+    def put(self, key, embedding):
+        """Add a cache entry. The file is written atomically, so readers never see a partial entry."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.npy', dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, np.asarray(embedding, dtype=np.float32))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def remove(self, key):
+        """Remove a cache entry, if it exists."""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.cache_dir}): {self.num_hits} hits, {self.num_misses} misses'
+
+
+class IdentityEmbedder():
+    """Batched identity embeddings of face images with ResNetArcFace, the identity network of the training.
+
+    The faces are converted to gray and resized to 128x128 as in the training (:func:`gray_resize_for_identity`), and
+    run in batches. The embeddings are L2-normalized, so the dot product of two embeddings is their cosine similarity.
+
+    Args:
+        model_path (str): Path or url of the ArcFace model. Default: ARCFACE_URL (arcface_resnet18.pth).
+        device (torch.device | None): The device. Default: None (cuda if available).
+        batch_size (int): The maximum number of faces in one forward. Default: 64.
+        cache (EmbeddingCache | None): The persistent cache of the embeddings. Default: None.
+        block (str): Block of the ArcFace architecture. Default: IRBlock.
+        layers (tuple(int)): Block numbers in each layer. Default: (2, 2, 2, 2).
+        use_se (bool): Whether the blocks use squeeze and excitation. Default: False.
+    """
+
+    def __init__(self,
+                 model_path=ARCFACE_URL,
+                 device=None,
+                 batch_size=64,
+                 cache=None,
+                 block='IRBlock',
+                 layers=(2, 2, 2, 2),
+                 use_se=False):
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu') if device is None else device
+        self.batch_size = batch_size
+        self.cache = cache
+
+        if model_path.startswith('https://'):
+            model_path = load_file_from_url(
+                url=model_path, model_dir=os.path.join(ROOT_DIR, 'gfpgan/weights'), progress=True, file_name=None)
+        self.arcface = ResNetArcFace(block, layers, use_se)
+        loadnet = torch.load(model_path, map_location='cpu')
+        if 'params' in loadnet:
+            loadnet = loadnet['params']
+        # remove the prefix of DataParallel models
+        loadnet = {key[7:] if key.startswith('module.') else key: value for key, value in loadnet.items()}
+        self.arcface.load_state_dict(loadnet, strict=True)
+        self.arcface = self.arcface.eval().to(self.device)
+
+        # the embeddings of other weights or architectures are never hit in the cache
+        hasher = hashlib.sha1(f'{block};{tuple(layers)};{use_se};'.encode())
+        with open(model_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                hasher.update(chunk)
+        self.model_key = hasher.hexdigest()
+
+    def get_key(self, img):
+        """Get the cache key of a face image: a hash of its content and of the model."""
+        hasher = hashlib.sha1()
+        img = np.ascontiguousarray(img)
+        hasher.update(f'v{CACHE_VERSION};{self.model_key};{img.shape};{img.dtype};'.encode())
+        hasher.update(img.data)
+        return hasher.hexdigest()
+
+    def preprocess(self, imgs):
+        """Convert BGR uint8 face images (of any sizes) to the gray inputs with shape (n, 1, 128, 128)."""
+        grays = []
+        for img in imgs:
+            face_t = img2tensor(img / 255., bgr2rgb=True, float32=True).unsqueeze(0).to(self.device)
+            grays.append(gray_resize_for_identity(face_t * 2 - 1))
+        return torch.cat(grays)
+
+    @torch.no_grad()
+    def _embed(self, imgs):
+        embeddings = []
+        for start in range(0, len(imgs), self.batch_size):
+            x = self.preprocess(imgs[start:start + self.batch_size])
+            embeddings.append(F.normalize(self.arcface(x).float(), dim=1).cpu().numpy())
+        return np.concatenate(embeddings)
+
+    def embed(self, imgs):
+        """Get the identity embeddings of face images.
+
+        Args:
+            imgs (list[ndarray]): BGR uint8 face images, aligned as the inputs and outputs of GFPGAN.
+
+        Returns:
+            ndarray: L2-normalized float32 embeddings with shape (n, 512).
+        """
+        if len(imgs) == 0:
+            return np.zeros((0, 512), dtype=np.float32)
+        if self.cache is None:
+            return self._embed(imgs)
+
+        keys = [self.get_key(img) for img in imgs]
+        embeddings = [self.cache.get(key) for key in keys]
+        missing = [idx for idx, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            for idx, embedding in zip(missing, self._embed([imgs[idx] for idx in missing])):
+                self.cache.put(keys[idx], embedding)
+                embeddings[idx] = embedding
+        return np.stack(embeddings)
+
+    def similarity(self, imgs_a, imgs_b):
+        """Cosine similarity of the identities of pairs of face images.
+
+        Args:
+            imgs_a (list[ndarray]): BGR uint8 face images, e.g. the original faces.
+            imgs_b (list[ndarray]): BGR uint8 face images, e.g. the restored faces.
+
+        Returns:
+            ndarray: The similarities with shape (n, ), in [-1, 1].
+        """
+        if len(imgs_a) != len(imgs_b):
+            raise ValueError(f'Different numbers of faces: {len(imgs_a)} and {len(imgs_b)}.')
+        embeddings = self.embed(list(imgs_a) + list(imgs_b))
+        return cosine_similarity(embeddings[:len(imgs_a)], embeddings[len(imgs_a):])
+
+
+class IdentityReport():
+    """Identity consistency between the original and the restored faces of a batch job, for QA.
+
+    The pairs are added from any thread (e.g. the writers of :class:`RestorePipeline`), and scored in batches of the
+    embedder, so that only the scores are kept.
+
+    Args:
+        embedder (IdentityEmbedder): The embedder.
+        threshold (float): The pairs with a lower similarity are listed in the summary. Default: 0.5.
+    """
+
+    def __init__(self, embedder, threshold=0.5):
+        self.embedder = embedder
+        self.threshold = threshold
+        self.scores = []
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def add(self, name, face, restored_face):
+        """Add a pair of an original face and its restored face."""
+        with self._lock:
+            self._pending.append((name, face, restored_face))
+            if len(self._pending) * 2 < self.embedder.batch_size:
+                return
+            pending, self._pending = self._pending, []
+        self._score(pending)
+
+    def flush(self):
+        """Score the remaining pairs."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        self._score(pending)
+
+    def _score(self, pending):
+        if not pending:
+            return
+        names, faces, restored_faces = zip(*pending)
+        similarities = self.embedder.similarity(faces, restored_faces)
+        with self._lock:
+            self.scores.extend(zip(names, similarities.tolist()))
+
+    def save(self, path):
+        """Score the remaining pairs and write the similarities to a csv file, sorted by name."""
+        self.flush()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['name', 'similarity'])
+            for name, similarity in sorted(self.scores):
+                writer.writerow([name, f'{similarity:.4f}'])
+
+    def summary(self):
+        """Get a text summary: the number of pairs, the mean and min similarities and the pairs below threshold."""
+        self.flush()
+        if not self.scores:
+            return 'Identity similarity: no faces.'
+        similarities = np.array([similarity for _, similarity in self.scores])
+        low = sorted(name for name, similarity in self.scores if similarity < self.threshold)
+        text = (f'Identity similarity of {len(similarities)} faces: mean {similarities.mean():.4f}, '
+                f'min {similarities.min():.4f}, {len(low)} below {self.threshold}')
+        return text + (': ' + ', '.join(low) if low else '.')
@@ -0,0 +1,36 @@
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+
+def measure_peak_memory(fn, device=None):
+    """Measure the peak memory allocated by a function, over the memory allocated before it.
+
+    On cuda, it is given by the caching allocator. On cpu, it is the maximum of the running sum of the allocations
+    and frees recorded by the profiler.
+
+    Args:
+        fn (callable): The function, without arguments.
+        device (torch.device | str | None): The device. Default: None (cpu).
+
+    Returns:
+        Any: The output of ``fn``.
+        int: The peak memory, in bytes.
+    """
+    device = torch.device('cpu' if device is None else device)
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+        baseline = torch.cuda.memory_allocated(device)
+        torch.cuda.reset_peak_memory_stats(device)
+        output = fn()
+        torch.cuda.synchronize(device)
+        return output, torch.cuda.max_memory_allocated(device) - baseline
+
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        output = fn()
+    memory_events = sorted((event.start_ns(), event.nbytes()) for event in prof.profiler.kineto_results.events()
+                           if event.name() == '[memory]' and event.device_type() == torch.autograd.DeviceType.CPU)
+    current = peak = 0
+    for _, nbytes in memory_events:
+        current += nbytes
+        peak = max(peak, current)
+    return output, peak
@@ -0,0 +1,212 @@
+import torch
+from basicsr.archs import build_network
+from basicsr.losses import build_loss
+from basicsr.utils import get_root_logger
+from basicsr.utils.registry import MODEL_REGISTRY
+from collections import OrderedDict
+from torch import nn
+
+from .gfpgan_model import GFPGANModel
+
+
+def register_condition_hooks(net, conditions):
+    """Record the SFT conditions of a GFPGAN network in ``conditions``, in the order of the decoder (scale, shift).
+
+    Args:
+        net (nn.Module): The GFPGAN network (clean, bilinear or original).
+        conditions (list): The list that the conditions are appended to, at each forward.
+
+    Returns:
+        list[RemovableHandle]: The handles of the hooks.
+    """
+
+    def _hook(module, inputs, output):
+        conditions.append(output)
+
+    handles = []
+    for scale, shift in zip(net.condition_scale, net.condition_shift):
+        handles.append(scale.register_forward_hook(_hook))
+        handles.append(shift.register_forward_hook(_hook))
+    return handles
+
+
+def get_condition_channels(net):
+    """The channel numbers of the SFT conditions of a GFPGAN network, in the order of the decoder."""
+    channels = []
+    for scale, shift in zip(net.condition_scale, net.condition_shift):
+        channels.extend([scale[-1].out_channels, shift[-1].out_channels])
+    return channels
+
+
+@MODEL_REGISTRY.register()
+class GFPGANDistillModel(GFPGANModel):
+    """Distill a frozen GFPGAN teacher into a narrow and fast GFPGAN student.
+
+    The student (``network_g``) is usually built with ``narrow: 0.5`` or ``channel_multiplier: 1``. It is trained to
+    match the outputs, the intermediate RGB images (pyramid) and the SFT conditions of the teacher
+    (``network_teacher``) on the same degraded inputs, with the same decoder noise. The conditions of the student are
+    mapped to the channels of the teacher by 1x1 convs (``net_adapter``), which are only used for training. An
+    optional pixel loss to the ground truth keeps the student anchored to the real images.
+
+    The saved ``net_g`` checkpoints have the same layout as the GFPGAN ones, and can be loaded by ``GFPGANer`` with the
+    ``narrow`` and ``channel_multiplier`` of the student.
+    """
+
+    def init_training_settings(self):
+        train_opt = self.opt['train']
+        logger = get_root_logger()
+
+        # ----------- define the frozen teacher ----------- #
+        self.net_teacher = build_network(self.opt['network_teacher']).to(self.device)
+        load_path = self.opt['path'].get('pretrain_network_teacher', None)
+        if load_path is not None:
+            param_key = self.opt['path'].get('param_key_teacher', 'params_ema')
+            self.load_network(self.net_teacher, load_path, True, param_key)
+        else:
+            logger.warning('No pretrain_network_teacher: distill from a randomly initialized teacher.')
+        self.net_teacher.eval()
+        for param in self.net_teacher.parameters():
+            param.requires_grad = False
+
+        # ----------- define net_g with Exponential Moving Average (EMA) ----------- #
+        self.net_g_ema = build_network(self.opt['network_g']).to(self.device)
+        load_path = self.opt['path'].get('pretrain_network_g', None)
+        if load_path is not None:
+            self.load_network(self.net_g_ema, load_path, self.opt['path'].get('strict_load_g', True), 'params_ema')
+        else:
+            self.model_ema(0)  # copy net_g weight
+
+        self.net_g.train()
+        self.net_g_ema.eval()
+
+        # ----------- record the SFT conditions ----------- #
+        self.student_conditions = []
+        self.teacher_conditions = []
+        register_condition_hooks(self.get_bare_model(self.net_g), self.student_conditions)
+        register_condition_hooks(self.net_teacher, self.teacher_conditions)
+
+        # 1x1 convs from the condition channels of the student to the ones of the teacher
+        student_channels = get_condition_channels(self.get_bare_model(self.net_g))
+        teacher_channels = get_condition_channels(self.net_teacher)
+        if len(student_channels) != len(teacher_channels):
+            raise ValueError('The teacher and the student should have the same out_size.')
+        self.net_adapter = nn.ModuleList([
+            nn.Identity() if in_c == out_c else nn.Conv2d(in_c, out_c, 1)
+            for in_c, out_c in zip(student_channels, teacher_channels)
+        ])
+        self.net_adapter = self.model_to_device(self.net_adapter)
+        load_path = self.opt['path'].get('pretrain_network_adapter', None)
+        if load_path is not None:
+            self.load_network(self.net_adapter, load_path, True, 'params')
+        self.net_adapter.train()
+
+        # ----------- define losses ----------- #
+        # output loss, to the outputs of the teacher
+        self.cri_output = build_loss(train_opt['output_opt']).to(self.device)
+
+        # pixel loss, to the ground truth
+        if train_opt.get('pixel_opt'):
+            self.cri_pix = build_loss(train_opt['pixel_opt']).to(self.device)
+        else:
+            self.cri_pix = None
+
+        # perceptual loss, to the outputs of the teacher
+        if train_opt.get('perceptual_opt'):
+            self.cri_perceptual = build_loss(train_opt['perceptual_opt']).to(self.device)
+        else:
+            self.cri_perceptual = None
+
+        # L1 loss is used in pyramid loss and condition loss
+        self.cri_l1 = build_loss(train_opt['L1_opt']).to(self.device)
+
+        # set up optimizers and schedulers
+        self.setup_optimizers()
+        self.setup_schedulers()
+
+    def setup_optimizers(self):
+        train_opt = self.opt['train']
+        # the adapters are trained with net_g
+        optim_params = [param for param in self.net_g.parameters() if param.requires_grad]
+        optim_params.extend(self.net_adapter.parameters())
+        optim_type = train_opt['optim_g'].pop('type')
+        self.optimizer_g = self.get_optimizer(optim_type, optim_params, **train_opt['optim_g'])
+        self.optimizers.append(self.optimizer_g)
+
+    def get_noise(self, batch_size):
+        """Sample the noise of the decoder, shared by the teacher and the student."""
+        decoder = self.get_bare_model(self.net_g).stylegan_decoder
+        return [
+            torch.randn(batch_size, 1, *getattr(decoder.noises, f'noise{i}').shape[2:], device=self.device)
+            for i in range(decoder.num_layers)
+        ]
+
+    def optimize_parameters(self, current_iter):
+        train_opt = self.opt['train']
+        pyramid_loss_weight = train_opt.get('pyramid_loss_weight', 0)
+        condition_loss_weight = train_opt.get('condition_loss_weight', 0)
+        return_rgb = pyramid_loss_weight > 0
+
+        self.optimizer_g.zero_grad()
+        self.student_conditions.clear()
+        self.teacher_conditions.clear()
+        noise = self.get_noise(self.lq.size(0))
+        with torch.no_grad():
+            teacher_output, teacher_rgbs = self.net_teacher(self.lq, return_rgb=return_rgb, noise=noise)
+        self.output, out_rgbs = self.net_g(self.lq, return_rgb=return_rgb, noise=noise)
+
+        l_g_total = 0
+        loss_dict = OrderedDict()
+        # output loss
+        l_out = self.cri_output(self.output, teacher_output)
+        l_g_total += l_out
+        loss_dict['l_out'] = l_out
+
+        # pixel loss
+        if self.cri_pix:
+            l_g_pix = self.cri_pix(self.output, self.gt)
+            l_g_total += l_g_pix
+            loss_dict['l_g_pix'] = l_g_pix
+
+        # perceptual loss
+        if self.cri_perceptual:
+            l_g_percep, l_g_style = self.cri_perceptual(self.output, teacher_output)
+            if l_g_percep is not None:
+                l_g_total += l_g_percep
+                loss_dict['l_g_percep'] = l_g_percep
+            if l_g_style is not None:
+                l_g_total += l_g_style
+                loss_dict['l_g_style'] = l_g_style
+
+        # image pyramid loss, to the intermediate rgb images of the teacher
+        if pyramid_loss_weight > 0:
+            for i in range(0, self.log_size - 2):
+                l_pyramid = self.cri_l1(out_rgbs[i], teacher_rgbs[i]) * pyramid_loss_weight
+                l_g_total += l_pyramid
+                loss_dict[f'l_p_{2**(i+3)}'] = l_pyramid
+
+        # condition loss, to the SFT conditions (scale and shift) of the teacher
+        if condition_loss_weight > 0:
+            for i in range(0, self.log_size - 2):
+                l_cond = 0
+                for j in (2 * i, 2 * i + 1):
+                    condition = self.net_adapter[j](self.student_conditions[j])
+                    l_cond += self.cri_l1(condition, self.teacher_conditions[j]) * condition_loss_weight
+                l_g_total += l_cond
+                loss_dict[f'l_cond_{2**(i+3)}'] = l_cond
+
+        l_g_total.backward()
+        self.optimizer_g.step()
+        self.student_conditions.clear()
+        self.teacher_conditions.clear()
+
+        # EMA
+        self.model_ema(decay=0.5**(32 / (10 * 1000)))
+
+        self.log_dict = self.reduce_loss_dict(loss_dict)
+
+    def save(self, epoch, current_iter):
+        # save net_g, in the layout loaded by GFPGANer, and the adapters for resuming
+        self.save_network([self.net_g, self.net_g_ema], 'net_g', current_iter, param_key=['params', 'params_ema'])
+        self.save_network(self.net_adapter, 'net_adapter', current_iter)
+        # save training state
+        self.save_training_state(epoch, current_iter)
@@ -13,6 +13,9 @@ from torch.nn import functional as F
 from torchvision.ops import roi_align
 from tqdm import tqdm
 
+from gfpgan.data.batch_degradation import BatchDegradation
+from gfpgan.identity import gray_resize_for_identity
+
 
 @MODEL_REGISTRY.register()
 class GFPGANModel(BaseModel):
@@ -35,6 +38,13 @@ class GFPGANModel(BaseModel):
 
         self.log_size = int(math.log(self.opt['network_g']['out_size'], 2))
 
+        # synthesize the lq images of whole batches, when the training dataset only loads the gt
+        dataset_opt = self.opt.get('datasets', {}).get('train', {})
+        if self.is_train and dataset_opt.get('batch_degradation', False):
+            self.batch_degradation = BatchDegradation(dataset_opt)
+        else:
+            self.batch_degradation = None
+
         if self.is_train:
             self.init_training_settings()
 
@@ -199,11 +209,18 @@ class GFPGANModel(BaseModel):
             self.optimizers.append(self.optimizer_d_mouth)
 
     def feed_data(self, data):
-        self.lq = data['lq'].to(self.device)
-        if 'gt' in data:
+        if 'lq' not in data and self.batch_degradation is not None:
             self.gt = data['gt'].to(self.device)
-
-        if 'loc_left_eye' in data:
+            self.lq, self.gt = self.batch_degradation(self.gt)
+        else:
+            self.lq = data['lq'].to(self.device)
+            if 'gt' in data:
+                self.gt = data['gt'].to(self.device)
+
+        if 'locations' in data:
+            # get facial component locations, shape (batch, 3, 4): left eye, right eye and mouth
+            self.loc_left_eyes, self.loc_right_eyes, self.loc_mouths = data['locations'].unbind(1)
+        elif 'loc_left_eye' in data:
             # get facial component locations, shape (batch, 4)
             self.loc_left_eyes = data['loc_left_eye']
             self.loc_right_eyes = data['loc_right_eye']
@@ -279,10 +296,7 @@ class GFPGANModel(BaseModel):
         return gram
 
     def gray_resize_for_identity(self, out, size=128):
-        out_gray = (0.2989 * out[:, 0, :, :] + 0.5870 * out[:, 1, :, :] + 0.1140 * out[:, 2, :, :])
-        out_gray = out_gray.unsqueeze(1)
-        out_gray = F.interpolate(out_gray, (size, size), mode='bilinear', align_corners=False)
-        return out_gray
+        return gray_resize_for_identity(out, size)
 
     def optimize_parameters(self, current_iter):
         # optimize net_g
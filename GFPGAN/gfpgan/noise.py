@@ -0,0 +1,78 @@
+import torch
+
+NOISE_MODES = ('random', 'buffer', 'fold')
+# the noise (std 1) is scaled by the noise strength of each StyleConv and added to features of std about 1
+FOLD_THRESHOLD = 1e-2
+
+
+def get_noise_convs(decoder):
+    """The StyleConv layers of a StyleGAN2 decoder, in the order of its noise list."""
+    return [decoder.style_conv1, *decoder.style_convs]
+
+
+def get_noise_strength(conv):
+    """The learned noise strength of a StyleConv (clean, bilinear or basicsr)."""
+    weight = conv.noise.weight if hasattr(conv, 'noise') else conv.weight
+    return weight.detach().abs().max().item()
+
+
+def fold_noise(decoder, threshold=FOLD_THRESHOLD):
+    """Skip the noise injection of the StyleConv layers whose noise strength is at most ``threshold``, in place.
+
+    The noise has zero mean, so a folded layer outputs the expectation over the noise. Only the StyleConv of the clean
+    and bilinear archs can be folded.
+
+    Args:
+        decoder (nn.Module): The StyleGAN2 decoder.
+        threshold (float): The maximum noise strength to fold. Default: FOLD_THRESHOLD.
+
+    Returns:
+        int: The number of folded layers.
+    """
+    num_folded = 0
+    for conv in get_noise_convs(decoder):
+        if hasattr(conv, 'fold_noise'):
+            conv.fold_noise = get_noise_strength(conv) <= threshold
+            num_folded += conv.fold_noise
+    return num_folded
+
+
+class NoiseBuffers():
+    """Preallocated noise for the StyleConv layers of a StyleGAN2 decoder.
+
+    The noise is sampled once for each batch slot and resolution, and reused by the later forwards, instead of
+    allocating and sampling new noise in every StyleConv of every forward. The buffers grow with the largest batch
+    size. The noise of a face only depends on its position in the batch. The layers with folded noise have no buffer.
+
+    Args:
+        decoder (nn.Module): The StyleGAN2 decoder. The shapes of its stored noise give the resolutions.
+        seed (int): The seed of the noise. Default: 0.
+    """
+
+    def __init__(self, decoder, seed=0):
+        self.shapes = [getattr(decoder.noises, f'noise{i}').shape[2:] for i in range(decoder.num_layers)]
+        self.folded = [getattr(conv, 'fold_noise', False) for conv in get_noise_convs(decoder)]
+        self.device = decoder.noises.noise0.device
+        self.seed = seed
+        self.buffers = [None] * decoder.num_layers
+        self.capacity = 0
+
+    def _sample(self, slot):
+        # one seed per batch slot, and sampled on cpu, so that the noise does not depend on the growth or the device
+        generator = torch.Generator().manual_seed(self.seed * 1000003 + slot)
+        return [
+            None if folded else torch.randn(1, 1, *shape, generator=generator)
+            for shape, folded in zip(self.shapes, self.folded)
+        ]
+
+    def __call__(self, batch_size):
+        """Get the noise list of a batch: tensors with shape (batch_size, 1, h, w), None for the folded layers."""
+        if batch_size > self.capacity:
+            slots = [self._sample(slot) for slot in range(self.capacity, batch_size)]
+            for idx in range(len(self.buffers)):
+                if self.folded[idx]:
+                    continue
+                noise = torch.cat([noises[idx] for noises in slots]).to(self.device)
+                self.buffers[idx] = noise if self.buffers[idx] is None else torch.cat([self.buffers[idx], noise])
+            self.capacity = batch_size
+        return [None if buffer is None else buffer[:batch_size] for buffer in self.buffers]
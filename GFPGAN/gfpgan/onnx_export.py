@@ -0,0 +1,113 @@
+import torch
+from torch import nn
+from torch.nn import functional as F
+
+from gfpgan.archs.stylegan2_clean_arch import set_modulated_conv_strategy
+
+EXPORT_NOISE_MODES = ('baked', 'input')
+
+
+class BiasLeakyReLU(nn.Module):
+    """FusedLeakyReLU with plain PyTorch ops.
+
+    Args:
+        act (nn.Module): The FusedLeakyReLU to replace. Its bias is shared.
+    """
+
+    def __init__(self, act):
+        super(BiasLeakyReLU, self).__init__()
+        self.bias = act.bias
+        self.negative_slope = act.negative_slope
+        self.scale = act.scale
+
+    def forward(self, x):
+        bias = self.bias.view(1, -1, *[1] * (x.dim() - 2))
+        return F.leaky_relu(x + bias, self.negative_slope) * self.scale
+
+
+def replace_fused_activations(model):
+    """Replace all the FusedLeakyReLU layers of a model by BiasLeakyReLU, in place."""
+    for module in list(model.modules()):
+        for name, child in module.named_children():
+            if type(child).__name__ == 'FusedLeakyReLU':
+                setattr(module, name, BiasLeakyReLU(child))
+    return model
+
+
+class ExportWrapper(nn.Module):
+    """Only return the restored faces. The noise is the stored one (baked) or given as inputs."""
+
+    def __init__(self, gfpgan, noise_mode):
+        super(ExportWrapper, self).__init__()
+        self.gfpgan = gfpgan
+        self.noise_mode = noise_mode
+
+    def forward(self, x, *noise):
+        if self.noise_mode == 'input':
+            return self.gfpgan(x, return_rgb=False, noise=list(noise))[0]
+        return self.gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+
+
+def get_stored_noise(gfpgan):
+    decoder = gfpgan.stylegan_decoder
+    return [getattr(decoder.noises, f'noise{i}') for i in range(decoder.num_layers)]
+
+
+@torch.no_grad()
+def export_onnx(gfpgan, save_path, noise_mode='baked', opset=17, size=512):
+    """Export a GFPGAN model to ONNX. The input ``input`` and the output ``output`` have a dynamic batch axis.
+
+    The modulated convolutions of the StyleGAN2 decoder run a grouped conv with ``groups=batch``, which fixes the
+    batch size in the exported graph. So they are switched to the ``activation`` strategy, in place.
+
+    Args:
+        gfpgan (nn.Module): A GFPGANv1Clean model, or a GFPGANBilinear model after
+            :func:`replace_fused_activations`.
+        save_path (str): Path to the ONNX model.
+        noise_mode (str): baked: the stored noise of the decoder is baked in the graph. input: the noise is given as
+            the inputs ``noise{i}``. Default: baked.
+        opset (int): The ONNX opset. Default: 17.
+        size (int): The input size. Default: 512.
+    """
+    if noise_mode not in EXPORT_NOISE_MODES:
+        raise ValueError(f'Wrong noise mode: {noise_mode}. Supported ones are: {" | ".join(EXPORT_NOISE_MODES)}.')
+    model = ExportWrapper(set_modulated_conv_strategy(gfpgan, 'activation'), noise_mode).eval()
+    inputs = (torch.zeros(2, 3, size, size), )
+    input_names = ['input']
+    dynamic_axes = {'input': {0: 'batch'}, 'output': {0: 'batch'}}
+    if noise_mode == 'input':
+        for i, noise in enumerate(get_stored_noise(gfpgan)):
+            inputs += (noise.expand(2, -1, -1, -1).contiguous(), )
+            input_names.append(f'noise{i}')
+            dynamic_axes[f'noise{i}'] = {0: 'batch'}
+    torch.onnx.export(
+        model,
+        inputs,
+        save_path,
+        input_names=input_names,
+        output_names=['output'],
+        dynamic_axes=dynamic_axes,
+        opset_version=opset,
+        dynamo=False)
+
+
+@torch.no_grad()
+def check_onnx(gfpgan, onnx_engine, batch_sizes=(1, 3), atol=1e-3):
+    """Compare the outputs of onnxruntime with PyTorch, with the same (stored) noise.
+
+    Returns:
+        bool: Whether all the errors are within ``atol``.
+    """
+    passed = True
+    size = onnx_engine.input_size
+    for batch_size in batch_sizes:
+        x = torch.rand(batch_size, 3, size, size) * 2 - 1
+        expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+        feeds = {onnx_engine.input_name: x.numpy()}
+        for (name, _), noise in zip(onnx_engine.noise_inputs, get_stored_noise(gfpgan)):
+            feeds[name] = noise.expand(batch_size, -1, -1, -1).numpy()
+        output = torch.from_numpy(onnx_engine.session.run(None, feeds)[0])
+        error = (output - expected).abs().max().item()
+        print(f'batch {batch_size}: max abs error {error:.2e}')
+        passed = passed and error <= atol
+    return passed
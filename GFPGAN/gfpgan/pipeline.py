@@ -0,0 +1,229 @@
+import cv2
+import queue
+import threading
+import time
+import torch
+
+_STOP = object()  # sentinel passed between the stages
+
+
+class StageStats():
+    """Thread-safe counters of one pipeline stage.
+
+    Args:
+        name (str): Stage name.
+        num_workers (int): Number of workers in this stage.
+    """
+
+    def __init__(self, name, num_workers):
+        self.name = name
+        self.num_workers = num_workers
+        self.num_items = 0
+        self.busy_time = 0
+        self._lock = threading.Lock()
+
+    def add(self, num_items, busy_time):
+        with self._lock:
+            self.num_items += num_items
+            self.busy_time += busy_time
+
+    @property
+    def throughput(self):
+        """Items per second, with all the workers of the stage busy."""
+        if self.busy_time == 0:
+            return 0
+        return self.num_items * self.num_workers / self.busy_time
+
+    def __repr__(self):
+        return (f'{self.name}: {self.num_items} items, {self.num_workers} worker(s), busy {self.busy_time:.2f} s, '
+                f'{self.throughput:.2f} items/s')
+
+
+class RestorePipeline():
+    """Pipelined restoration of many images with GFPGANer.
+
+    The work is split into four stages, connected by bounded queues:
+
+    1. reader: a thread pool that reads the images.
+    2. detection: one thread that detects, aligns and crops faces (``GFPGANer.align_faces``).
+    3. restoration: one thread that restores the faces of several images together (``GFPGANer.restore_faces``).
+    4. writer: a thread pool that pastes the faces back (``GFPGANer.paste_faces``) and saves the results.
+
+    So the CPU work of reading, pasting and writing overlaps with detection and restoration.
+
+    Args:
+        restorer (GFPGANer): The restorer.
+        num_readers (int): Number of reader threads. Default: 2.
+        num_writers (int): Number of writer threads. Default: 2.
+        queue_size (int): The maximum number of images in each queue between two stages. Default: 16.
+        batch_images (int): The maximum number of images whose faces are restored together. Default: 4.
+    """
+
+    def __init__(self, restorer, num_readers=2, num_writers=2, queue_size=16, batch_images=4):
+        self.restorer = restorer
+        self.num_readers = num_readers
+        self.num_writers = num_writers
+        self.queue_size = queue_size
+        self.batch_images = batch_images
+
+    def run(self, img_list, save_fn, has_aligned=False, only_center_face=False, paste_back=True):
+        """Restore all the images.
+
+        The failures of one image (unreadable image, face detection or saving) are printed and skipped. If a stage
+        fails otherwise, e.g. the restoration runs out of memory, all the stages stop and the error is raised.
+
+        Args:
+            img_list (list[str]): Image paths.
+            save_fn (callable): Called in the writer threads as
+                ``save_fn(img_path, cropped_faces, restored_faces, restored_img)``.
+            has_aligned (bool): Whether the inputs are aligned faces. Default: False.
+            only_center_face (bool): Only restore the center face. Default: False.
+            paste_back (bool): Whether to paste the restored faces back. Default: True.
+
+        Returns:
+            list[StageStats]: Statistics of each stage.
+        """
+        self.stats = [
+            StageStats('read', self.num_readers),
+            StageStats('detect', 1),
+            StageStats('restore', 1),
+            StageStats('write', self.num_writers)
+        ]
+        self._errors = []
+        self._abort = threading.Event()
+        path_queue = queue.Queue()
+        for img_path in img_list:
+            path_queue.put(img_path)
+        read_queue = queue.Queue(maxsize=self.queue_size)
+        detect_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        threads = [threading.Thread(target=self._read, args=(path_queue, read_queue)) for _ in range(self.num_readers)]
+        threads.append(
+            threading.Thread(target=self._detect, args=(read_queue, detect_queue, has_aligned, only_center_face)))
+        threads.append(threading.Thread(target=self._restore, args=(detect_queue, write_queue)))
+        threads.extend([
+            threading.Thread(target=self._write, args=(write_queue, save_fn, has_aligned, paste_back))
+            for _ in range(self.num_writers)
+        ])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return self.stats
+
+    def _fail(self, error, in_queue, num_stops):
+        """Record the error of a stage, stop the other stages, and drain the input queue of the stage until its
+        ``num_stops`` remaining sentinels, so that the previous stage never blocks on a full queue."""
+        self._errors.append(error)
+        self._abort.set()
+        while num_stops > 0:
+            if in_queue.get() is _STOP:
+                num_stops -= 1
+
+    def _read(self, path_queue, read_queue):
+        try:
+            while not self._abort.is_set():
+                try:
+                    img_path = path_queue.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+                self.stats[0].add(1, time.perf_counter() - start)
+                if img is None:
+                    print(f'\tFailed to read {img_path}.')
+                    continue
+                read_queue.put((img_path, img))
+        except Exception as error:
+            self._fail(error, path_queue, 0)
+        finally:
+            read_queue.put(_STOP)
+
+    def _detect(self, read_queue, detect_queue, has_aligned, only_center_face):
+        num_stopped = 0
+        try:
+            while num_stopped < self.num_readers:
+                item = read_queue.get()
+                if item is _STOP:
+                    num_stopped += 1
+                    continue
+                if self._abort.is_set():  # drain the queue
+                    continue
+                img_path, img = item
+                start = time.perf_counter()
+                try:
+                    cropped_faces, affine_matrices = self.restorer.align_faces(
+                        img, has_aligned=has_aligned, only_center_face=only_center_face)
+                except Exception as error:
+                    print(f'\tFailed face detection for {img_path}: {error}.')
+                    continue
+                finally:
+                    self.stats[1].add(1, time.perf_counter() - start)
+                detect_queue.put((img_path, img, cropped_faces, affine_matrices))
+        except Exception as error:
+            self._fail(error, read_queue, self.num_readers - num_stopped)
+        finally:
+            detect_queue.put(_STOP)
+
+    def _restore(self, detect_queue, write_queue):
+        stopped = False
+        try:
+            while not stopped:
+                # collect the faces of several images, without waiting for more than the first image
+                items = [detect_queue.get()]
+                while items[-1] is not _STOP and len(items) < self.batch_images:
+                    try:
+                        items.append(detect_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if items[-1] is _STOP:
+                    items.pop()
+                    stopped = True
+                if not items or self._abort.is_set():
+                    continue
+
+                start = time.perf_counter()
+                all_faces = [face for item in items for face in item[2]]
+                with torch.no_grad():
+                    all_restored_faces = self.restorer.restore_faces(all_faces)
+                self.stats[2].add(len(items), time.perf_counter() - start)
+
+                # split the restored faces back to each image
+                idx = 0
+                for img_path, img, cropped_faces, affine_matrices in items:
+                    restored_faces = all_restored_faces[idx:idx + len(cropped_faces)]
+                    idx += len(cropped_faces)
+                    write_queue.put((img_path, img, cropped_faces, restored_faces, affine_matrices))
+        except Exception as error:
+            self._fail(error, detect_queue, 0 if stopped else 1)
+        finally:
+            for _ in range(self.num_writers):
+                write_queue.put(_STOP)
+
+    def _write(self, write_queue, save_fn, has_aligned, paste_back):
+        stopped = False
+        try:
+            while not stopped:
+                item = write_queue.get()
+                if item is _STOP:
+                    stopped = True
+                    continue
+                if self._abort.is_set():
+                    continue
+                img_path, img, cropped_faces, restored_faces, affine_matrices = item
+                start = time.perf_counter()
+                try:
+                    if not has_aligned and paste_back:
+                        restored_img = self.restorer.paste_faces(img, restored_faces, affine_matrices)
+                    else:
+                        restored_img = None
+                    save_fn(img_path, cropped_faces, restored_faces, restored_img)
+                except Exception as error:
+                    print(f'\tFailed to save results of {img_path}: {error}.')
+                finally:
+                    self.stats[3].add(1, time.perf_counter() - start)
+        except Exception as error:
+            self._fail(error, write_queue, 0 if stopped else 1)
@@ -0,0 +1,187 @@
+import math
+import torch
+from torch import nn
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+
+
+def get_channel_map(gfpgan):
+    """The full channel map of a GFPGANv1Clean, in the format of its ``channel_map`` argument."""
+    log_size = gfpgan.log_size
+    unet = {f'{2**log_size}': gfpgan.conv_body_first.out_channels}
+    for i, block in enumerate(gfpgan.conv_body_down):
+        unet[f'{2**(log_size - i - 1)}'] = block.conv2.out_channels
+    return {
+        'unet': unet,
+        'down': [block.conv1.out_channels for block in gfpgan.conv_body_down],
+        'up': [block.conv1.out_channels for block in gfpgan.conv_body_up],
+        'condition_scale': [branch[0].out_channels for branch in gfpgan.condition_scale],
+        'condition_shift': [branch[0].out_channels for branch in gfpgan.condition_shift]
+    }
+
+
+def get_channel_groups(gfpgan):
+    """The prunable channel groups of a GFPGANv1Clean.
+
+    A group is a set of channels which are pruned together: the U-Net channels of a level (shared by the encoder, the
+    skips and the decoder of the level), the mid channels of a ResBlock and the hidden channels of a SFT branch. The
+    channels of the decoder and the SFT conditions are not pruned, since they are tied to the StyleGAN2 prior.
+
+    Returns:
+        dict: For each group, with the keys of ``channel_map`` (``('unet', '512')``, ``('down', 0)``, ...):
+            ``producers``: the layers whose output channels are the group, ``consumers``: the layers whose input
+            channels are the group.
+    """
+    log_size = gfpgan.log_size
+    groups = {}
+
+    def level(size):
+        return groups.setdefault(('unet', f'{size}'), {'producers': [], 'consumers': []})
+
+    # encoder
+    level(2**log_size)['producers'].append(gfpgan.conv_body_first)
+    for i, block in enumerate(gfpgan.conv_body_down):
+        level(2**(log_size - i))['consumers'].extend([block.conv1, block.skip])
+        level(2**(log_size - i - 1))['producers'].extend([block.conv2, block.skip])
+        groups[('down', i)] = {'producers': [block.conv1], 'consumers': [block.conv2]}
+    level(4)['producers'].append(gfpgan.final_conv)
+    level(4)['consumers'].extend([gfpgan.final_conv, gfpgan.final_linear])
+    # decoder
+    for i, block in enumerate(gfpgan.conv_body_up):
+        level(2**(i + 2))['consumers'].extend([block.conv1, block.skip])
+        level(2**(i + 3))['producers'].extend([block.conv2, block.skip])
+        level(2**(i + 3))['consumers'].extend(
+            [gfpgan.toRGB[i], gfpgan.condition_scale[i][0], gfpgan.condition_shift[i][0]])
+        groups[('up', i)] = {'producers': [block.conv1], 'consumers': [block.conv2]}
+        groups[('condition_scale', i)] = {
+            'producers': [gfpgan.condition_scale[i][0]],
+            'consumers': [gfpgan.condition_scale[i][2]]
+        }
+        groups[('condition_shift', i)] = {
+            'producers': [gfpgan.condition_shift[i][0]],
+            'consumers': [gfpgan.condition_shift[i][2]]
+        }
+    return groups
+
+
+def _input_channels(layer, tensor):
+    """The per-channel view (n, c, -1) of the input of a layer. The flattened input of final_linear is (c, 4, 4)."""
+    if isinstance(layer, nn.Linear):
+        return tensor.view(tensor.size(0), -1, 16)
+    return tensor.flatten(2)
+
+
+def _weight_norms(layer):
+    """The L2 norm of the weights of each input channel of a layer."""
+    weight = layer.weight.detach()
+    if isinstance(layer, nn.Linear):
+        weight = weight.view(weight.size(0), -1, 16).transpose(0, 1)
+    else:
+        weight = weight.transpose(0, 1)
+    return weight.flatten(1).norm(dim=1)
+
+
+@torch.no_grad()
+def compute_channel_importance(gfpgan, batches):
+    """Rank the prunable channels of a GFPGANv1Clean on a calibration set.
+
+    The importance of a channel is the sum, over the layers that consume it, of its mean absolute activation times
+    the L2 norm of the weights that read it, i.e. how much it contributes to the next layers.
+
+    Args:
+        gfpgan (GFPGANv1Clean): The model.
+        batches (Iterable[Tensor]): The calibration faces, with shape (n, 3, h, w), in [-1, 1].
+
+    Returns:
+        dict[tuple, Tensor]: The importance of each channel, for each group of :func:`get_channel_groups`.
+    """
+    groups = get_channel_groups(gfpgan)
+    consumers = {layer for group in groups.values() for layer in group['consumers']}
+    activations = {layer: 0 for layer in consumers}
+    num_faces = 0
+
+    def _hook(layer, inputs):
+        activations[layer] = activations[layer] + _input_channels(layer, inputs[0]).abs().mean(dim=2).sum(dim=0)
+
+    handles = [layer.register_forward_pre_hook(_hook) for layer in consumers]
+    try:
+        for batch in batches:
+            gfpgan(batch, return_rgb=True, randomize_noise=False)
+            num_faces += batch.size(0)
+    finally:
+        for handle in handles:
+            handle.remove()
+    if num_faces == 0:
+        raise ValueError('The calibration set is empty.')
+
+    return {
+        key: sum(activations[layer] / num_faces * _weight_norms(layer) for layer in group['consumers'])
+        for key, group in groups.items()
+    }
+
+
+def _slice_layer(layer, out_idx=None, in_idx=None):
+    """Keep the ``out_idx`` output channels and the ``in_idx`` input channels of the weights of a conv or linear."""
+    weight = layer.weight.detach()
+    if out_idx is not None:
+        weight = weight[out_idx]
+    if in_idx is not None:
+        if isinstance(layer, nn.Linear):  # the flattened (c, 4, 4) input of final_linear
+            in_idx = (in_idx[:, None] * 16 + torch.arange(16, device=in_idx.device)).flatten()
+        weight = weight[:, in_idx]
+    bias = None
+    if layer.bias is not None:
+        bias = layer.bias.detach() if out_idx is None else layer.bias.detach()[out_idx]
+    return weight, bias
+
+
+@torch.no_grad()
+def prune_gfpgan(gfpgan, gfpgan_opt, importance, keep_ratio=0.5, min_channels=8):
+    """Prune the channels with the lowest importance of a GFPGANv1Clean.
+
+    Each group keeps a ratio of its channels (at least ``min_channels``). The kept channels keep their order
+    and their weights, so that the pruned model can be fine-tuned, e.g. by ``GFPGANDistillModel`` with the original
+    model as the teacher.
+
+    Args:
+        gfpgan (GFPGANv1Clean): The model.
+        gfpgan_opt (dict): The arguments of GFPGANv1Clean used to build the model, without ``channel_map``.
+        importance (dict[tuple, Tensor]): The importance of the channels, from :func:`compute_channel_importance`.
+        keep_ratio (float | dict): The ratio of channels to keep in each group, or a dict of the ratio for each kind
+            of group (``unet``, ``down``, ``up``, ``condition_scale``, ``condition_shift``, 1 for the missing ones).
+            Default: 0.5.
+        min_channels (int): The minimum number of channels of a group. Default: 8.
+
+    Returns:
+        GFPGANv1Clean: The pruned model.
+        dict: Its channel map.
+    """
+    groups = get_channel_groups(gfpgan)
+    keep = {}
+    for key, scores in importance.items():
+        ratio = keep_ratio.get(key[0], 1) if isinstance(keep_ratio, dict) else keep_ratio
+        num_keep = min(len(scores), max(min_channels, math.ceil(len(scores) * ratio)))
+        keep[key] = scores.topk(num_keep).indices.sort().values
+
+    channel_map = get_channel_map(gfpgan)
+    for (name, idx), kept in keep.items():
+        channel_map[name][idx] = len(kept)
+
+    pruned = GFPGANv1Clean(**gfpgan_opt, channel_map=channel_map).to(gfpgan.final_linear.weight.device)
+    # the outputs and inputs to keep of each layer
+    out_idx, in_idx = {}, {}
+    for key, group in groups.items():
+        for layer in group['producers']:
+            out_idx[layer] = keep[key]
+        for layer in group['consumers']:
+            in_idx[layer] = keep[key]
+
+    state_dict = gfpgan.state_dict()
+    for name, layer in gfpgan.named_modules():
+        if layer in out_idx or layer in in_idx:
+            weight, bias = _slice_layer(layer, out_idx.get(layer), in_idx.get(layer))
+            state_dict[f'{name}.weight'] = weight
+            if bias is not None:
+                state_dict[f'{name}.bias'] = bias
+    pruned.load_state_dict(state_dict, strict=True)
+    return pruned.eval(), channel_map
@@ -0,0 +1,145 @@
+import torch
+from torch import nn
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+DECODER_MODES = ('fp32', 'dynamic', 'weight_only')
+
+
+def get_static_module_names(gfpgan):
+    """Names of the U-Net and SFT condition modules of GFPGANv1Clean, which are statically quantized."""
+    names = ['conv_body_first', 'final_conv']
+    for name in ('conv_body_down', 'conv_body_up', 'condition_scale', 'condition_shift'):
+        names.extend(f'{name}.{i}' for i in range(len(getattr(gfpgan, name))))
+    return names
+
+
+def _set_submodule(model, name, module):
+    parent, _, child = name.rpartition('.')
+    setattr(model.get_submodule(parent) if parent else model, child, module)
+
+
+def _get_example_inputs(gfpgan, names, x):
+    """Get the inputs of the named submodules with one forward of x, for FX tracing."""
+    inputs = {}
+    hooks = [
+        gfpgan.get_submodule(name).register_forward_pre_hook(
+            lambda module, args, name=name: inputs.setdefault(name, args)) for name in names
+    ]
+    with torch.no_grad():
+        gfpgan(x, return_rgb=False, randomize_noise=False)
+    for hook in hooks:
+        hook.remove()
+    return inputs
+
+
+def prepare_static(gfpgan, example_input, backend='x86'):
+    """Insert observers in the U-Net and SFT condition modules, in place.
+
+    Each module is traced with torch.fx on its own, since the forward of GFPGANv1Clean has Python control flow. The
+    activations between two modules (e.g., the leaky relu of the first conv and the U-Net skips) stay in fp32.
+
+    Args:
+        gfpgan (nn.Module): GFPGANv1Clean in eval mode, on cpu.
+        example_input (Tensor): An input batch with shape (n, 3, h, w), only used for tracing.
+        backend (str): The quantized engine: x86 | fbgemm | qnnpack | onednn. Default: x86.
+    """
+    torch.backends.quantized.engine = backend
+    qconfig_mapping = get_default_qconfig_mapping(backend)
+    names = get_static_module_names(gfpgan)
+    example_inputs = _get_example_inputs(gfpgan, names, example_input)
+    for name in names:
+        module = gfpgan.get_submodule(name)
+        if isinstance(module, nn.Conv2d):  # the root of an fx graph cannot be a conv
+            module = nn.Sequential(module)
+        _set_submodule(gfpgan, name, prepare_fx(module, qconfig_mapping, example_inputs[name]))
+    return gfpgan
+
+
+def convert_static(gfpgan):
+    """Convert the observed modules to quantized ones, in place."""
+    for name in get_static_module_names(gfpgan):
+        _set_submodule(gfpgan, name, convert_fx(gfpgan.get_submodule(name)))
+    return gfpgan
+
+
+def quantize_decoder(gfpgan, decoder_mode='dynamic'):
+    """Dynamically quantize the linear layers of the encoder head and the decoder, in place.
+
+    The modulated convolutions compute their weights from the styles at run time, so their convs cannot be quantized.
+    With ``weight_only``, their weights are stored in int8 in the checkpoint (see :func:`save_quantized_gfpgan`).
+    """
+    if decoder_mode != 'fp32':
+        gfpgan.final_linear = quantize_dynamic(nn.Sequential(gfpgan.final_linear), {nn.Linear})[0]
+        gfpgan.stylegan_decoder = quantize_dynamic(gfpgan.stylegan_decoder, {nn.Linear})
+    return gfpgan
+
+
+@torch.no_grad()
+def quantize_gfpgan(gfpgan, calib_batches, decoder_mode='dynamic', backend='x86'):
+    """Post-training quantization of GFPGANv1Clean, in place.
+
+    Args:
+        gfpgan (nn.Module): GFPGANv1Clean in eval mode, on cpu.
+        calib_batches (list[Tensor]): Calibration faces with shape (n, 3, h, w), normalized to [-1, 1].
+        decoder_mode (str): fp32 | dynamic | weight_only. Default: dynamic.
+        backend (str): The quantized engine. Default: x86.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    if decoder_mode not in DECODER_MODES:
+        raise ValueError(f'Wrong decoder mode: {decoder_mode}. Supported ones are: {" | ".join(DECODER_MODES)}.')
+    prepare_static(gfpgan, calib_batches[0], backend)
+    for batch in calib_batches:
+        gfpgan(batch, return_rgb=False, randomize_noise=False)
+    convert_static(gfpgan)
+    return quantize_decoder(gfpgan, decoder_mode)
+
+
+def _get_modulated_weight_names(state_dict):
+    return [key for key in state_dict if key.startswith('stylegan_decoder.') and key.endswith('modulated_conv.weight')]
+
+
+def save_quantized_gfpgan(gfpgan, save_path, quant_config):
+    """Save a quantized GFPGANv1Clean.
+
+    The checkpoint has ``params_int8`` (the state dict of the quantized model), ``quant_config`` and, with the
+    ``weight_only`` decoder mode, ``weights_int8``: the modulated conv weights with per output channel int8 values.
+    """
+    state_dict = gfpgan.state_dict()
+    weights_int8 = {}
+    if quant_config['decoder_mode'] == 'weight_only':
+        for key in _get_modulated_weight_names(state_dict):
+            weight = state_dict.pop(key)  # (1, c_out, c_in, k, k)
+            scale = weight.abs().amax(dim=(0, 2, 3, 4), keepdim=True).clamp_(min=1e-8) / 127
+            weights_int8[key] = {'int8': torch.round(weight / scale).to(torch.int8), 'scale': scale}
+    torch.save(dict(params_int8=state_dict, weights_int8=weights_int8, quant_config=quant_config), save_path)
+
+
+@torch.no_grad()
+def load_quantized_gfpgan(gfpgan, checkpoint):
+    """Load a checkpoint saved by :func:`save_quantized_gfpgan`.
+
+    Args:
+        gfpgan (nn.Module): GFPGANv1Clean with the same options as the quantized one, in eval mode, on cpu. Its
+            weights are not used.
+        checkpoint (dict): The loaded checkpoint.
+
+    Returns:
+        nn.Module: The quantized model.
+    """
+    quant_config = checkpoint['quant_config']
+    size = quant_config.get('input_size', 512)
+    # build the quantized modules, the observers are not calibrated, since all the qparams are loaded
+    prepare_static(gfpgan, torch.zeros(1, 3, size, size), quant_config['backend'])
+    convert_static(gfpgan)
+    quantize_decoder(gfpgan, quant_config['decoder_mode'])
+
+    state_dict = checkpoint['params_int8'].copy()
+    # the versions of the quantized modules are needed to load their states
+    state_dict._metadata = checkpoint['params_int8']._metadata
+    for key, weight_int8 in checkpoint.get('weights_int8', {}).items():
+        state_dict[key] = weight_int8['int8'].float() * weight_int8['scale']
+    gfpgan.load_state_dict(state_dict, strict=True)
+    return gfpgan.eval()
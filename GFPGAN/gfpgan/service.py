@@ -0,0 +1,357 @@
+import cv2
+import numpy as np
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_STOP = object()  # sentinel to stop the workers
+
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+STAGES = ('queue', 'detect', 'batch_wait', 'restore', 'paste', 'total')
+# output formats of the ext parameter, with their content types
+CONTENT_TYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'bmp': 'image/bmp'
+}
+
+
+class ServiceBusy(Exception):
+    """Raised when the request queue is full."""
+
+
+class LatencyHistogram():
+    """Thread-safe histogram of latencies, with fixed buckets (in the Prometheus way).
+
+    Args:
+        buckets (tuple[float]): Upper bounds of the buckets, in seconds. Default: LATENCY_BUCKETS.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        idx = int(np.searchsorted(self.buckets, value))
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile with the upper bound of its bucket. None if there is no value."""
+        with self._lock:
+            if self.count == 0:
+                return None
+            cumulative = np.cumsum(self.counts)
+            idx = int(np.searchsorted(cumulative, q * self.count))
+        return self.buckets[idx] if idx < len(self.buckets) else float('inf')
+
+    def render(self, name, labels):
+        """Render in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+            lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class _Request():
+
+    def __init__(self, img, has_aligned, only_center_face):
+        self.img = img
+        self.has_aligned = has_aligned
+        self.only_center_face = only_center_face
+        self.future = Future()
+        self.cropped_faces = []
+        self.affine_matrices = []
+        self.times = {'submit': time.perf_counter()}
+
+
+class RestoreService():
+    """A resident restoration service, which restores the faces of concurrent requests in dynamic batches.
+
+    Requests go through two worker threads, connected by bounded queues:
+
+    1. detection: detects, aligns and crops faces (``GFPGANer.align_faces``), one request at a time.
+    2. restoration: collects the faces of several requests, until ``max_batch`` faces or ``max_latency`` seconds after
+       the first one, and restores them together (``GFPGANer.restore_faces``).
+
+    The pasting (``GFPGANer.paste_faces``) runs in the threads of the callers. When the request queue is full,
+    :meth:`submit` raises :class:`ServiceBusy`, so that clients can back off. A full batch queue blocks the detection,
+    so that the request queue fills up.
+
+    Args:
+        restorer (GFPGANer): The restorer.
+        max_batch (int | None): The maximum number of faces in a batch. Default: None (``restorer.max_batch``).
+        max_latency (float): The maximum time to wait for more faces after the first one of a batch, in seconds.
+            Default: 0.01.
+        queue_size (int): The maximum number of requests in each queue. Default: 16.
+    """
+
+    def __init__(self, restorer, max_batch=None, max_latency=0.01, queue_size=16):
+        self.restorer = restorer
+        self.max_batch = restorer.max_batch if max_batch is None else max_batch
+        self.max_latency = max_latency
+        self.request_queue = queue.Queue(maxsize=queue_size)
+        self.batch_queue = queue.Queue(maxsize=queue_size)
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self.batch_sizes = LatencyHistogram(buckets=tuple(2**i for i in range(int(np.log2(self.max_batch)) + 1)))
+        self.num_requests = {'ok': 0, 'rejected': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._threads = [
+            threading.Thread(target=self._detect_loop, daemon=True),
+            threading.Thread(target=self._restore_loop, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        """Stop the workers, after the queued requests."""
+        self.request_queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+
+    def _count(self, status):
+        with self._lock:
+            self.num_requests[status] += 1
+
+    def submit(self, img, has_aligned=False, only_center_face=False):
+        """Submit a request without waiting.
+
+        Returns:
+            Future: Its result is the request, with ``cropped_faces``, ``restored_faces`` and ``affine_matrices``.
+
+        Raises:
+            ServiceBusy: If the request queue is full.
+        """
+        request = _Request(img, has_aligned, only_center_face)
+        try:
+            self.request_queue.put_nowait(request)
+        except queue.Full:
+            self._count('rejected')
+            raise ServiceBusy('The request queue is full.')
+        return request.future
+
+    def restore(self, img, has_aligned=False, only_center_face=False, paste_back=True):
+        """Restore an image, and wait for the result.
+
+        Args:
+            img (ndarray): Input image with shape (h, w, c), BGR order.
+            has_aligned (bool): Whether the input is an aligned face. Default: False.
+            only_center_face (bool): Only restore the center face. Default: False.
+            paste_back (bool): Whether to paste the restored faces back. Default: True.
+
+        Returns:
+            list[ndarray]: Cropped faces.
+            list[ndarray]: Restored faces.
+            ndarray | None: The restored image, None for aligned inputs or if paste_back is False.
+
+        Raises:
+            ServiceBusy: If the request queue is full.
+        """
+        request = self.submit(img, has_aligned=has_aligned, only_center_face=only_center_face).result()
+        restored_img = None
+        if not has_aligned and paste_back:
+            start = time.perf_counter()
+            restored_img = self.restorer.paste_faces(img, request.restored_faces, request.affine_matrices)
+            self.histograms['paste'].observe(time.perf_counter() - start)
+        self.histograms['total'].observe(time.perf_counter() - request.times['submit'])
+        return request.cropped_faces, request.restored_faces, restored_img
+
+    def _finish(self, request, error=None):
+        if error is None:
+            self._count('ok')
+            request.future.set_result(request)
+        else:
+            self._count('failed')
+            request.future.set_exception(error)
+
+    def _detect_loop(self):
+        while True:
+            request = self.request_queue.get()
+            if request is _STOP:
+                break
+            start = time.perf_counter()
+            self.histograms['queue'].observe(start - request.times['submit'])
+            try:
+                cropped_faces, affine_matrices = self.restorer.align_faces(
+                    request.img, has_aligned=request.has_aligned, only_center_face=request.only_center_face)
+            except Exception as error:
+                self._finish(request, error)
+                continue
+            # the lists of the face helper are reset by the next detection
+            request.cropped_faces = list(cropped_faces)
+            request.affine_matrices = list(affine_matrices)
+            request.times['detected'] = time.perf_counter()
+            self.histograms['detect'].observe(request.times['detected'] - start)
+            if not request.cropped_faces:
+                request.restored_faces = []
+                self._finish(request)
+                continue
+            self.batch_queue.put(request)
+        self.batch_queue.put(_STOP)
+
+    def _restore_loop(self):
+        stopped = False
+        while not stopped:
+            requests = [self.batch_queue.get()]
+            if requests[0] is _STOP:
+                break
+            # wait for more faces, until the batch is full or the deadline of the first request
+            num_faces = len(requests[0].cropped_faces)
+            deadline = requests[0].times['detected'] + self.max_latency
+            while num_faces < self.max_batch:
+                try:
+                    request = self.batch_queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                except queue.Empty:
+                    break
+                if request is _STOP:
+                    stopped = True
+                    break
+                requests.append(request)
+                num_faces += len(request.cropped_faces)
+
+            start = time.perf_counter()
+            for request in requests:
+                self.histograms['batch_wait'].observe(start - request.times['detected'])
+            try:
+                all_restored_faces = self.restorer.restore_faces(
+                    [face for request in requests for face in request.cropped_faces])
+            except Exception as error:
+                for request in requests:
+                    self._finish(request, error)
+                continue
+            restore_time = time.perf_counter() - start
+            self.batch_sizes.observe(num_faces)
+
+            # split the restored faces back to each request
+            idx = 0
+            for request in requests:
+                request.restored_faces = all_restored_faces[idx:idx + len(request.cropped_faces)]
+                idx += len(request.cropped_faces)
+                self.histograms['restore'].observe(restore_time)
+                self._finish(request)
+
+    def render_metrics(self):
+        """All the metrics, in the Prometheus text format."""
+        lines = ['# TYPE gfpgan_stage_latency_seconds histogram']
+        for stage, histogram in self.histograms.items():
+            lines.extend(histogram.render('gfpgan_stage_latency_seconds', f'stage="{stage}"'))
+        lines.append('# TYPE gfpgan_batch_faces histogram')
+        lines.extend(self.batch_sizes.render('gfpgan_batch_faces', 'service="gfpgan"'))
+        lines.append('# TYPE gfpgan_queue_depth gauge')
+        lines.append(f'gfpgan_queue_depth{{queue="request"}} {self.request_queue.qsize()}')
+        lines.append(f'gfpgan_queue_depth{{queue="batch"}} {self.batch_queue.qsize()}')
+        lines.append('# TYPE gfpgan_requests_total counter')
+        with self._lock:
+            for status, count in self.num_requests.items():
+                lines.append(f'gfpgan_requests_total{{status="{status}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """HTTP API of a RestoreService.
+
+    - ``POST /restore?aligned=0&only_center_face=0&ext=png``: the body is an encoded image. The response is the
+      restored image, or the restored face for aligned inputs, encoded to ext (png, jpg, jpeg, webp or bmp). 503 when
+      the service is busy.
+    - ``GET /metrics``: metrics in the Prometheus text format.
+    - ``GET /health``: 200 when the service is up.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, code, body, content_type='text/plain; charset=utf-8', headers=None):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == '/health':
+            self._reply(200, b'ok\n')
+        elif path == '/metrics':
+            self._reply(200, self.server.service.render_metrics().encode())
+        else:
+            self._reply(404, b'not found\n')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if url.path != '/restore':
+            self._reply(404, b'not found\n')
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        has_aligned = params.get('aligned', '0') == '1'
+        only_center_face = params.get('only_center_face', '0') == '1'
+        ext = params.get('ext', 'png').lower()
+        if ext not in CONTENT_TYPES:
+            self._reply(400, f'unsupported ext {ext}, should be one of {", ".join(CONTENT_TYPES)}\n'.encode())
+            return
+        img = cv2.imdecode(np.frombuffer(body, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            self._reply(400, b'cannot decode the image\n')
+            return
+        try:
+            _, restored_faces, restored_img = self.server.service.restore(
+                img, has_aligned=has_aligned, only_center_face=only_center_face)
+        except ServiceBusy:
+            self._reply(503, b'busy\n', headers={'Retry-After': '1'})
+            return
+        except Exception as error:
+            self._reply(500, f'{error}\n'.encode())
+            return
+        if has_aligned:
+            restored_img = restored_faces[0]
+        flag, encoded = cv2.imencode(f'.{ext}', restored_img)
+        if not flag:
+            self._reply(400, f'cannot encode the image to {ext}\n'.encode())
+            return
+        self._reply(200, encoded.tobytes(), content_type=CONTENT_TYPES[ext])
+
+    def log_message(self, format, *args):  # noqa: A002
+        pass  # no access log, see the metrics instead
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)  # BaseHTTPRequestHandler expects a (host, port) address
+
+
+class _TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128  # the connections over the backlog are refused
+
+
+def make_server(service, host='127.0.0.1', port=8000, unix_socket=None):
+    """Make an HTTP server for a RestoreService, on a TCP port or a Unix socket. Call ``serve_forever`` to run it."""
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, _RequestHandler)
+    else:
+        server = _TCPHTTPServer((host, port), _RequestHandler)
+    server.service = service
+    return server
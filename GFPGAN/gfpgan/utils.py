@@ -1,7 +1,9 @@
+import contextlib
+import copy
 import cv2
+import numpy as np
 import os
 import torch
-from basicsr.utils import img2tensor, tensor2img
 from basicsr.utils.download_util import load_file_from_url
 from facexlib.utils.face_restoration_helper import FaceRestoreHelper
 from torchvision.transforms.functional import normalize
@@ -9,10 +11,140 @@ from torchvision.transforms.functional import normalize
 from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
 from gfpgan.archs.gfpganv1_arch import GFPGANv1
 from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.compositor import FaceCompositor
+from gfpgan.engine import InferenceEngine, OnnxEngine
+from gfpgan.flat_weights import is_flat_weights, load_flat_weights
+from gfpgan.folding import bilinear_to_clean, fold_weights
+from gfpgan.graph_optimizer import optimize_graph
+from gfpgan.quantization import load_quantized_gfpgan
 
 ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
+def faces2tensor(faces, device=None):
+    """Stack cropped faces into one normalized batch tensor.
+
+    Args:
+        faces (list[ndarray]): Faces with shape (h, w, 3), BGR order, uint8 in [0, 255].
+        device (torch.device | None): The device of the output tensor. Default: None.
+
+    Returns:
+        Tensor: RGB tensor with shape (n, 3, h, w), normalized to [-1, 1].
+    """
+    faces_t = torch.from_numpy(np.stack(faces, axis=0))
+    if device is not None:
+        faces_t = faces_t.to(device)  # move uint8 data, which is 4x smaller than float32
+    # (n, h, w, c) BGR -> (n, c, h, w) RGB
+    faces_t = faces_t.permute(0, 3, 1, 2).flip(1).contiguous().float().div_(255.)
+    normalize(faces_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+    return faces_t
+
+
+def tensor2faces(tensor):
+    """Convert a batch of restored faces back to images in one vectorized step.
+
+    Args:
+        tensor (Tensor): RGB tensor with shape (n, 3, h, w), in [-1, 1].
+
+    Returns:
+        list[ndarray]: Faces with shape (h, w, 3), BGR order, uint8 in [0, 255].
+    """
+    tensor = tensor.detach().float().clamp_(-1, 1)
+    tensor = ((tensor + 1) / 2 * 255.).round_()
+    # (n, c, h, w) RGB -> (n, h, w, c) BGR
+    faces = tensor.flip(1).permute(0, 2, 3, 1).to(torch.uint8).cpu().numpy()
+    return list(faces)
+
+
+def build_gfpgan(arch='clean', channel_multiplier=2, narrow=1, channel_map=None):
+    """Build the 512x512 GFPGAN architecture of the released models, with random weights.
+
+    Args:
+        arch (str): The GFPGAN architecture. Option: clean | bilinear | original. Default: clean.
+        channel_multiplier (int): Channel multiplier for large networks of StyleGAN2. Default: 2.
+        narrow (float): The narrow ratio for channels. Default: 1.
+        channel_map (dict | None): The explicit channels of a pruned clean model. Default: None.
+
+    Returns:
+        nn.Module: The model.
+    """
+    if arch == 'clean':
+        return GFPGANv1Clean(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=narrow,
+            sft_half=True,
+            channel_map=channel_map)
+    elif arch == 'bilinear':
+        return GFPGANBilinear(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=False,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=narrow,
+            sft_half=True)
+    elif arch == 'original':
+        return GFPGANv1(
+            out_size=512,
+            num_style_feat=512,
+            channel_multiplier=channel_multiplier,
+            decoder_load_path=None,
+            fix_decoder=True,
+            num_mlp=8,
+            input_is_latent=True,
+            different_w=True,
+            narrow=narrow,
+            sft_half=True)
+    raise ValueError(f'Wrong arch: {arch}. Supported ones are: clean | bilinear | original.')
+
+
+def load_gfpgan(model_path, arch='clean', channel_multiplier=2, narrow=1, channel_map=None):
+    """Build a GFPGAN model and load its weights, in eval mode on cpu.
+
+    Flat weights (see :mod:`gfpgan.flat_weights`) are assigned without copy, so the clean and bilinear models are
+    built on the meta device, without allocating and initializing the weights. The original arch is built on cpu:
+    its upfirdn kernels are plain tensor attributes, that load_state_dict does not assign.
+
+    Args:
+        model_path (str): The local path to the model: a pth file, int8 weights or flat weights.
+        arch (str): The GFPGAN architecture. Option: clean | bilinear | original. Default: clean.
+        channel_multiplier (int): Channel multiplier for large networks of StyleGAN2. Default: 2.
+        narrow (float): The narrow ratio for channels. Default: 1.
+        channel_map (dict | None): The explicit channels of a pruned clean model. Default: None.
+
+    Returns:
+        nn.Module: The model.
+        bool: Whether the model is quantized to int8.
+    """
+    if is_flat_weights(model_path):
+        with torch.device('meta') if arch != 'original' else contextlib.nullcontext():
+            gfpgan = build_gfpgan(arch, channel_multiplier, narrow, channel_map)
+        # the memory-mapped weights are assigned to the model, without copy
+        gfpgan.load_state_dict(load_flat_weights(model_path)[0], strict=True, assign=True)
+        return gfpgan.eval(), False
+
+    gfpgan = build_gfpgan(arch, channel_multiplier, narrow, channel_map)
+    loadnet = torch.load(model_path, map_location='cpu')
+    if 'params_int8' in loadnet:
+        return load_quantized_gfpgan(gfpgan.eval(), loadnet), True
+    if 'params_ema' in loadnet:
+        keyname = 'params_ema'
+    else:
+        keyname = 'params'
+    gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    return gfpgan.eval(), False
+
+
 class GFPGANer():
     """Helper for restoration with GFPGAN.
 
@@ -22,56 +154,68 @@ class GFPGANer():
     Finally, the faces will be pasted back to the upsample background image.
 
     Args:
-        model_path (str): The path to the GFPGAN model. It can be urls (will first download it automatically).
+        model_path (str): The path to the GFPGAN model. It can be urls (will first download it automatically). For the
+            onnx engine, it is the path to the ONNX model exported by ``scripts/export_onnx.py``. Int8 models from
+            ``scripts/quantize_gfpgan.py`` are run on cpu. Flat weights from ``scripts/convert_to_flat_weights.py``
+            are memory-mapped.
         upscale (float): The upscale of the final output. Default: 2.
-        arch (str): The GFPGAN architecture. Option: clean | original. Default: clean.
+        arch (str): The GFPGAN architecture. Option: clean | bilinear | original. Default: clean.
         channel_multiplier (int): Channel multiplier for large networks of StyleGAN2. Default: 2.
+        narrow (float): The narrow ratio for channels, e.g. 0.5 for the students trained by ``GFPGANDistillModel``.
+            Default: 1.
+        channel_map (dict | None): The explicit channels of a pruned clean model, from ``scripts/prune_gfpgan.py``.
+            See :class:`GFPGANv1Clean`. Default: None.
         bg_upsampler (nn.Module): The upsampler for the background. Default: None.
+        max_batch (int): The maximum number of faces restored in one forward. Default: 8.
+        landmark_cache (LandmarkCache | None): The cache of face landmarks and affine matrices. With a cache hit,
+            the face detection is skipped. Default: None.
+        compositor (str): How to paste the faces back. facexlib: ``FaceRestoreHelper.paste_faces_to_input_image``.
+            numpy | torch: :class:`FaceCompositor`, which only works in the region of each face. Default: facexlib.
+        engine (str): How to run the model: eager | script (TorchScript trace) | compile (torch.compile) | onnx
+            (onnxruntime on CPU). The script and compile engines use the fixed noise of the decoder. See
+            :class:`InferenceEngine` and :class:`OnnxEngine`. Default: eager.
+        channels_last (bool): Use the channels_last memory format. Default: False.
+        bf16 (bool): Use bf16 autocast, if the device supports it. Default: False.
+        engine_cache_dir (str | None): The folder to cache the compiled engines. Default: None.
+        noise_mode (str): The noise of the decoder: random | buffer (preallocated) | fold (skip the negligible noise).
+            Not used by the onnx engine. See :mod:`gfpgan.noise`. Default: random.
+        optimize (bool): Rewrite the model for a cheaper forward: bilinear models are converted to the clean
+            architecture and the weights of original models are folded (see :mod:`gfpgan.folding`), the linear ops
+            are reordered by :func:`gfpgan.graph_optimizer.optimize_graph`, and the styles of the decoder layers are
+            computed by one matmul. False runs the reference forward of the architecture. Not used by quantized
+            models and the onnx engine. Default: True.
     """
 
-    def __init__(self, model_path, upscale=2, arch='clean', channel_multiplier=2, bg_upsampler=None):
+    def __init__(self,
+                 model_path,
+                 upscale=2,
+                 arch='clean',
+                 channel_multiplier=2,
+                 narrow=1,
+                 channel_map=None,
+                 bg_upsampler=None,
+                 max_batch=8,
+                 landmark_cache=None,
+                 compositor='facexlib',
+                 engine='eager',
+                 channels_last=False,
+                 bf16=False,
+                 engine_cache_dir=None,
+                 noise_mode='random',
+                 optimize=True):
+        if max_batch < 1:
+            raise ValueError(f'max_batch should be at least 1, but got {max_batch}.')
         self.upscale = upscale
         self.bg_upsampler = bg_upsampler
+        self.max_batch = max_batch
+        self.landmark_cache = landmark_cache
 
         # initialize model
         self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        # initialize the GFP-GAN
-        if arch == 'clean':
-            self.gfpgan = GFPGANv1Clean(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=False,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
-        elif arch == 'bilinear':
-            self.gfpgan = GFPGANBilinear(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=False,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
-        elif arch == 'original':
-            self.gfpgan = GFPGANv1(
-                out_size=512,
-                num_style_feat=512,
-                channel_multiplier=channel_multiplier,
-                decoder_load_path=None,
-                fix_decoder=True,
-                num_mlp=8,
-                input_is_latent=True,
-                different_w=True,
-                narrow=1,
-                sft_half=True)
+        if compositor == 'facexlib':
+            self.compositor = None
+        else:
+            self.compositor = FaceCompositor(upscale, backend=compositor, device=self.device)
         # initialize face helper
         self.face_helper = FaceRestoreHelper(
             upscale,
@@ -84,60 +228,174 @@ class GFPGANer():
         if model_path.startswith('https://'):
             model_path = load_file_from_url(
                 url=model_path, model_dir=os.path.join(ROOT_DIR, 'gfpgan/weights'), progress=True, file_name=None)
-        loadnet = torch.load(model_path)
-        if 'params_ema' in loadnet:
-            keyname = 'params_ema'
+        if engine == 'onnx':  # the model is in the ONNX graph
+            self.gfpgan = None
+            self.engine = OnnxEngine(model_path)
         else:
-            keyname = 'params'
-        self.gfpgan.load_state_dict(loadnet[keyname], strict=True)
-        self.gfpgan.eval()
-        self.gfpgan = self.gfpgan.to(self.device)
+            self.gfpgan, quantized = load_gfpgan(model_path, arch, channel_multiplier, narrow, channel_map)
+            self.gfpgan.eval()
+            if optimize and not quantized:
+                # fold the equalized learning rate scales and the activation gains into the weights
+                if arch == 'bilinear':
+                    self.gfpgan = bilinear_to_clean(self.gfpgan, channel_multiplier, narrow)
+                elif arch == 'original':
+                    fold_weights(self.gfpgan)
+                # cheaper orderings of the linear ops
+                optimize_graph(self.gfpgan)
+                if isinstance(self.gfpgan, GFPGANv1Clean):
+                    # compute the styles of all the decoder layers with one matmul
+                    self.gfpgan.stylegan_decoder.fuse_modulations()
+            if not quantized:  # quantized models only run on cpu
+                self.gfpgan = self.gfpgan.to(self.device)
+
+            self.engine = InferenceEngine(
+                self.gfpgan,
+                engine=engine,
+                channels_last=channels_last,
+                bf16=bf16,
+                cache_dir=engine_cache_dir,
+                cache_key=(f'{arch};{channel_multiplier};{narrow};{optimize};{os.path.abspath(model_path)};'
+                           f'{os.path.getmtime(model_path)}'),
+                noise_mode=noise_mode)
+        if engine != 'eager':
+            # compile at startup, for single faces and full batches
+            self.engine.warmup(sorted({1, max_batch}))
 
     @torch.no_grad()
-    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True):
+    def restore_faces(self, cropped_faces):
+        """Restore cropped faces in batches of at most ``max_batch`` faces.
+
+        Args:
+            cropped_faces (list[ndarray]): Aligned faces with shape (512, 512, 3), BGR order, uint8.
+
+        Returns:
+            list[ndarray]: Restored faces, in the same order as the inputs.
+        """
+        restored_faces = []
+        for start in range(0, len(cropped_faces), self.max_batch):
+            restored_faces.extend(self._restore_batch(cropped_faces[start:start + self.max_batch]))
+        return restored_faces
+
+    def _restore_batch(self, faces):
+        faces_t = faces2tensor(faces, self.engine.device)
+        try:
+            output = self.engine(faces_t)
+        except RuntimeError as error:
+            if len(faces) == 1:
+                print(f'\tFailed inference for GFPGAN: {error}.')
+                return [faces[0].astype('uint8')]
+            # retry face by face, so that only the failed faces fall back to the unrestored ones
+            del faces_t
+            return [self._restore_batch([face])[0] for face in faces]
+        return tensor2faces(output)
+
+    def align_faces(self, img, has_aligned=False, only_center_face=False, landmarks=None, eye_dist_threshold=5):
+        """Detect, align and crop the faces in an image.
+
+        It uses ``self.face_helper``, so it should only be called from one thread at a time. The 5-point landmarks
+        of the faces are left in ``self.face_helper.all_landmarks_5``.
+
+        Args:
+            img (ndarray): Input image with shape (h, w, c), BGR order.
+            has_aligned (bool): Whether the input is an aligned face. Default: False.
+            only_center_face (bool): Only keep the center face. Default: False.
+            landmarks (list[ndarray] | None): Known 5-point landmarks with shape (5, 2) for each face, e.g., tracked
+                from the previous video frame. If given, the face detection is skipped. Default: None.
+            eye_dist_threshold (float): Skip faces whose eye distance is smaller than it (in pixels). Default: 5.
+
+        Returns:
+            list[ndarray]: Cropped faces with shape (512, 512, 3).
+            list[ndarray]: Affine matrices from the input image to the cropped faces. Empty if has_aligned.
+        """
         self.face_helper.clean_all()
 
         if has_aligned:  # the inputs are already aligned
             img = cv2.resize(img, (512, 512))
             self.face_helper.cropped_faces = [img]
-        else:
+        elif landmarks is not None:
             self.face_helper.read_image(img)
-            # get face landmarks for each face
-            self.face_helper.get_face_landmarks_5(only_center_face=only_center_face, eye_dist_threshold=5)
-            # eye_dist_threshold=5: skip faces whose eye distance is smaller than 5 pixels
-            # TODO: even with eye_dist_threshold, it will still introduce wrong detections and restorations.
-            # align and warp each face
+            self.face_helper.all_landmarks_5 = list(landmarks)
             self.face_helper.align_warp_face()
+        else:
+            self.face_helper.read_image(img)
+            cache_key, cache_entry = None, None
+            if self.landmark_cache is not None:
+                cache_key = self.landmark_cache.get_key(
+                    self.face_helper.input_img,
+                    only_center_face=only_center_face,
+                    eye_dist_threshold=eye_dist_threshold,
+                    face_size=self.face_helper.face_size,
+                    face_template=self.face_helper.face_template)
+                cache_entry = self.landmark_cache.get(cache_key)
 
-        # face restoration
-        for cropped_face in self.face_helper.cropped_faces:
-            # prepare data
-            cropped_face_t = img2tensor(cropped_face / 255., bgr2rgb=True, float32=True)
-            normalize(cropped_face_t, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
-            cropped_face_t = cropped_face_t.unsqueeze(0).to(self.device)
-
-            try:
-                output = self.gfpgan(cropped_face_t, return_rgb=False)[0]
-                # convert to image
-                restored_face = tensor2img(output.squeeze(0), rgb2bgr=True, min_max=(-1, 1))
-            except RuntimeError as error:
-                print(f'\tFailed inference for GFPGAN: {error}.')
-                restored_face = cropped_face
+            if cache_entry is not None:
+                self.face_helper.all_landmarks_5 = cache_entry['landmarks']
+                if 'cropped_faces' in cache_entry:
+                    self.face_helper.affine_matrices = cache_entry['affine_matrices']
+                    self.face_helper.cropped_faces = cache_entry['cropped_faces']
+                else:
+                    self.face_helper.align_warp_face()
+            else:
+                # get face landmarks for each face
+                self.face_helper.get_face_landmarks_5(
+                    only_center_face=only_center_face, eye_dist_threshold=eye_dist_threshold)
+                # eye_dist_threshold=5: skip faces whose eye distance is smaller than 5 pixels
+                # TODO: even with eye_dist_threshold, it will still introduce wrong detections and restorations.
+                # align and warp each face
+                self.face_helper.align_warp_face()
+                if cache_key is not None:
+                    self.landmark_cache.put(cache_key, self.face_helper.all_landmarks_5,
+                                            self.face_helper.affine_matrices, self.face_helper.cropped_faces)
+        return self.face_helper.cropped_faces, self.face_helper.affine_matrices
+
+    @torch.no_grad()
+    def paste_faces(self, img, restored_faces, affine_matrices):
+        """Upsample the background and paste the restored faces back.
+
+        It works on a shallow copy of ``self.face_helper``, which shares the detection and parsing models but keeps
+        its own face lists. Therefore, it can run in other threads while ``align_faces`` is working.
+
+        Args:
+            img (ndarray): Input image with shape (h, w, c), BGR order.
+            restored_faces (list[ndarray]): Restored faces.
+            affine_matrices (list[ndarray]): Affine matrices returned by ``align_faces``.
+
+        Returns:
+            ndarray: The restored image.
+        """
+        face_helper = copy.copy(self.face_helper)
+        face_helper.clean_all()
+        face_helper.read_image(img)
+        face_helper.affine_matrices = list(affine_matrices)
+        face_helper.restored_faces = list(restored_faces)
+        return self._paste_back(face_helper, self._upsample_background(img))
 
-            restored_face = restored_face.astype('uint8')
+    def _paste_back(self, face_helper, bg_img):
+        if self.compositor is not None:
+            return self.compositor.paste(
+                face_helper.input_img, face_helper.restored_faces, face_helper.affine_matrices, upsample_img=bg_img)
+        face_helper.get_inverse_affine(None)
+        # paste each restored face to the input image
+        return face_helper.paste_faces_to_input_image(upsample_img=bg_img)
+
+    def _upsample_background(self, img):
+        if self.bg_upsampler is not None:
+            # Now only support RealESRGAN for upsampling background
+            return self.bg_upsampler.enhance(img, outscale=self.upscale)[0]
+        return None
+
+    @torch.no_grad()
+    def enhance(self, img, has_aligned=False, only_center_face=False, paste_back=True):
+        self.align_faces(img, has_aligned=has_aligned, only_center_face=only_center_face)
+
+        # face restoration (batched)
+        for restored_face in self.restore_faces(self.face_helper.cropped_faces):
             self.face_helper.add_restored_face(restored_face)
 
         if not has_aligned and paste_back:
             # upsample the background
-            if self.bg_upsampler is not None:
-                # Now only support RealESRGAN for upsampling background
-                bg_img = self.bg_upsampler.enhance(img, outscale=self.upscale)[0]
-            else:
-                bg_img = None
-
-            self.face_helper.get_inverse_affine(None)
-            # paste each restored face to the input image
-            restored_img = self.face_helper.paste_faces_to_input_image(upsample_img=bg_img)
+            bg_img = self._upsample_background(img)
+            restored_img = self._paste_back(self.face_helper, bg_img)
             return self.face_helper.cropped_faces, self.face_helper.restored_faces, restored_img
         else:
             return self.face_helper.cropped_faces, self.face_helper.restored_faces, None
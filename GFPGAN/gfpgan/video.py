@@ -0,0 +1,175 @@
+import cv2
+import numpy as np
+import time
+
+
+def read_video_frames(video_path):
+    """Read the frames of a video file.
+
+    Args:
+        video_path (str): Path to the video file.
+
+    Yields:
+        ndarray: Frames with shape (h, w, 3), BGR order, uint8.
+    """
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise IOError(f'Cannot open video {video_path}.')
+    try:
+        while True:
+            flag, frame = capture.read()
+            if not flag:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+
+def read_raw_frames(stream, width, height):
+    """Read raw bgr24 frames from a pipe, e.g., ``ffmpeg -i in.mp4 -f rawvideo -pix_fmt bgr24 -``.
+
+    Args:
+        stream (file): A binary stream, e.g., ``sys.stdin.buffer``.
+        width (int): Frame width.
+        height (int): Frame height.
+
+    Yields:
+        ndarray: Frames with shape (h, w, 3), BGR order, uint8.
+    """
+    frame_bytes = width * height * 3
+    while True:
+        buffer = stream.read(frame_bytes)
+        if len(buffer) < frame_bytes:
+            break
+        yield np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 3)
+
+
+def get_video_fps(video_path, default=25):
+    """Get the frame rate of a video file, or ``default`` if it is unknown."""
+    capture = cv2.VideoCapture(video_path)
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    capture.release()
+    return fps if fps > 0 else default
+
+
+class LandmarkTracker():
+    """Track 5-point face landmarks between video frames with pyramidal Lucas-Kanade optical flow.
+
+    Args:
+        scene_threshold (float): A scene change is reported when the mean absolute difference of two consecutive
+            (downsampled, gray) frames is larger than it, in [0, 255]. Default: 30.
+        max_flow_error (float): Tracking fails when the optical flow error of a landmark is larger than it.
+            Default: 20.
+    """
+
+    def __init__(self, scene_threshold=30, max_flow_error=20):
+        self.scene_threshold = scene_threshold
+        self.max_flow_error = max_flow_error
+        self.reset()
+
+    def reset(self):
+        self.prev_gray = None
+        self.prev_thumb = None
+        self.landmarks = None
+
+    def set_frame(self, gray, landmarks=None):
+        """Set the current frame and, if given, the landmarks of its faces."""
+        self.prev_gray = gray
+        self.prev_thumb = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.float32)
+        if landmarks is not None:
+            self.landmarks = [np.asarray(landmark, dtype=np.float32).reshape(5, 2) for landmark in landmarks]
+
+    def is_scene_change(self, gray):
+        if self.prev_thumb is None:
+            return True
+        thumb = cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.float32)
+        return float(np.mean(np.abs(thumb - self.prev_thumb))) > self.scene_threshold
+
+    def track(self, gray):
+        """Track the landmarks to a new frame.
+
+        Args:
+            gray (ndarray): The new gray frame, uint8.
+
+        Returns:
+            list[ndarray] | None: The tracked landmarks, or None if the tracking fails.
+        """
+        if self.prev_gray is None or self.landmarks is None:
+            return None
+        if len(self.landmarks) == 0:
+            return []
+        points = np.concatenate(self.landmarks, axis=0).reshape(-1, 1, 2)
+        next_points, status, error = cv2.calcOpticalFlowPyrLK(
+            self.prev_gray, gray, points, None, winSize=(21, 21), maxLevel=3)
+        if next_points is None or not np.all(status) or np.max(error) > self.max_flow_error:
+            return None
+        return list(next_points.reshape(-1, 5, 2))
+
+
+class VideoFaceRestorer():
+    """Restore the faces in a video, with full face detection only every K frames.
+
+    Between two detections, the 5-point landmarks are tracked with optical flow (see :class:`LandmarkTracker`).
+    The detection runs again at a scene change, or when the tracking fails.
+
+    Args:
+        restorer (GFPGANer): The restorer.
+        detect_interval (int): Run the face detection every ``detect_interval`` frames. Default: 10.
+        scene_threshold (float): See :class:`LandmarkTracker`. Default: 30.
+        only_center_face (bool): Only restore the center face. Default: False.
+    """
+
+    def __init__(self, restorer, detect_interval=10, scene_threshold=30, only_center_face=False):
+        self.restorer = restorer
+        self.detect_interval = detect_interval
+        self.only_center_face = only_center_face
+        self.tracker = LandmarkTracker(scene_threshold=scene_threshold)
+        self.num_frames = 0
+        self.num_detections = 0
+        self.detect_time = 0
+        self.total_time = 0
+
+    def restore(self, frames):
+        """Restore the frames.
+
+        Args:
+            frames (iterable[ndarray]): Input frames with shape (h, w, 3), BGR order, uint8.
+
+        Yields:
+            ndarray: Restored frames, upsampled by ``restorer.upscale``.
+        """
+        self.tracker.reset()
+        self.num_frames = 0
+        self.num_detections = 0
+        self.detect_time = 0
+        self.total_time = 0
+        frames_since_detection = 0
+        for frame in frames:
+            start = time.perf_counter()
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            landmarks = None
+            if frames_since_detection < self.detect_interval - 1 and not self.tracker.is_scene_change(gray):
+                landmarks = self.tracker.track(gray)
+
+            if landmarks is None:
+                detect_start = time.perf_counter()
+                cropped_faces, affine_matrices = self.restorer.align_faces(
+                    frame, only_center_face=self.only_center_face)
+                self.detect_time += time.perf_counter() - detect_start
+                self.num_detections += 1
+                frames_since_detection = 0
+                self.tracker.set_frame(gray, self.restorer.face_helper.all_landmarks_5)
+            else:
+                cropped_faces, affine_matrices = self.restorer.align_faces(frame, landmarks=landmarks)
+                frames_since_detection += 1
+                self.tracker.set_frame(gray, landmarks)
+
+            restored_faces = self.restorer.restore_faces(cropped_faces)
+            restored_frame = self.restorer.paste_faces(frame, restored_faces, affine_matrices)
+            self.num_frames += 1
+            self.total_time += time.perf_counter() - start
+            yield restored_frame
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__}: {self.num_frames} frames, {self.num_detections} detections, '
+                f'detection {self.detect_time:.2f} s of {self.total_time:.2f} s')
@@ -1,12 +1,105 @@
 import argparse
 import cv2
+import functools
 import glob
 import numpy as np
 import os
+import sys
+import time
 import torch
+import yaml
 from basicsr.utils import imwrite
 
 from gfpgan import GFPGANer
+from gfpgan.identity import ARCFACE_URL, EmbeddingCache, IdentityEmbedder, IdentityReport
+from gfpgan.landmark_cache import LandmarkCache
+from gfpgan.noise import NOISE_MODES
+from gfpgan.pipeline import RestorePipeline
+from gfpgan.service import RestoreService, make_server
+from gfpgan.video import VideoFaceRestorer, get_video_fps, read_raw_frames, read_video_frames
+
+
+def save_results(args, img_path, cropped_faces, restored_faces, restored_img, identity_report=None):
+    """Save the cropped faces, restored faces, comparisons and the restored image of one input.
+
+    The pairs of cropped and restored faces are also added to ``identity_report``, if given.
+    """
+    img_name = os.path.basename(img_path)
+    basename, ext = os.path.splitext(img_name)
+
+    # save faces
+    for idx, (cropped_face, restored_face) in enumerate(zip(cropped_faces, restored_faces)):
+        if identity_report is not None:
+            identity_report.add(f'{basename}_{idx:02d}', cropped_face, restored_face)
+        # save cropped face
+        save_crop_path = os.path.join(args.output, 'cropped_faces', f'{basename}_{idx:02d}.png')
+        imwrite(cropped_face, save_crop_path)
+        # save restored face
+        if args.suffix is not None:
+            save_face_name = f'{basename}_{idx:02d}_{args.suffix}.png'
+        else:
+            save_face_name = f'{basename}_{idx:02d}.png'
+        save_restore_path = os.path.join(args.output, 'restored_faces', save_face_name)
+        imwrite(restored_face, save_restore_path)
+        # save comparison image
+        cmp_img = np.concatenate((cropped_face, restored_face), axis=1)
+        imwrite(cmp_img, os.path.join(args.output, 'cmp', f'{basename}_{idx:02d}.png'))
+
+    # save restored img
+    if restored_img is not None:
+        if args.ext == 'auto':
+            extension = ext[1:]
+        else:
+            extension = args.ext
+
+        if args.suffix is not None:
+            save_restore_path = os.path.join(args.output, 'restored_imgs', f'{basename}_{args.suffix}.{extension}')
+        else:
+            save_restore_path = os.path.join(args.output, 'restored_imgs', f'{basename}.{extension}')
+        imwrite(restored_img, save_restore_path)
+
+
+def frame_size(value):
+    """Parse a WxH frame size to a (width, height) tuple, for argparse."""
+    try:
+        width, height = map(int, value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid frame size {value!r}, expected WxH, e.g. 1280x720')
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f'invalid frame size {value!r}, the width and height should be positive')
+    return width, height
+
+
+def restore_video(args, restorer):
+    """Restore the faces in a video and write the restored frames to a video."""
+    if args.input == '-':
+        width, height = args.frame_size
+        frames = read_raw_frames(sys.stdin.buffer, width, height)
+        basename = 'stdin'
+        fps = args.fps or 25
+    else:
+        frames = read_video_frames(args.input)
+        basename = os.path.splitext(os.path.basename(args.input))[0]
+        fps = args.fps or get_video_fps(args.input)
+    if args.suffix is not None:
+        basename = f'{basename}_{args.suffix}'
+    save_path = os.path.join(args.output, 'restored_videos', f'{basename}.mp4')
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+
+    video_restorer = VideoFaceRestorer(
+        restorer,
+        detect_interval=args.detect_interval,
+        scene_threshold=args.scene_threshold,
+        only_center_face=args.only_center_face)
+    writer = None
+    for restored_frame in video_restorer.restore(frames):
+        if writer is None:
+            h, w = restored_frame.shape[0:2]
+            writer = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (w, h))
+        writer.write(restored_frame)
+    if writer is not None:
+        writer.release()
+    print(video_restorer)
 
 
 def main():
@@ -36,19 +129,130 @@ def main():
     parser.add_argument('--suffix', type=str, default=None, help='Suffix of the restored faces')
     parser.add_argument('--only_center_face', action='store_true', help='Only restore the center face')
     parser.add_argument('--aligned', action='store_true', help='Input are aligned faces')
+    parser.add_argument(
+        '--max_batch', type=int, default=8, help='Maximum number of faces restored in one forward. Default: 8')
+    parser.add_argument(
+        '--compositor',
+        type=str,
+        default='facexlib',
+        choices=['facexlib', 'numpy', 'torch'],
+        help='How to paste the faces back. numpy | torch only work in the face regions. Default: facexlib')
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='eager',
+        choices=['eager', 'script', 'compile', 'onnx'],
+        help='How to run GFPGAN: eager | script (TorchScript trace) | compile (torch.compile) | onnx (onnxruntime). '
+        'Default: eager')
+    parser.add_argument(
+        '--model_path',
+        type=str,
+        default=None,
+        help='Model of the version, e.g., an int8 model from scripts/quantize_gfpgan.py. Default: the released one')
+    parser.add_argument(
+        '--channel_multiplier',
+        type=int,
+        default=None,
+        help='Channel multiplier of the model, e.g. 1 for a distilled student of the version. Default: the version one')
+    parser.add_argument(
+        '--narrow',
+        type=float,
+        default=1,
+        help='Narrow ratio of the model channels, e.g. 0.5 for a distilled student of the version. Default: 1')
+    parser.add_argument(
+        '--channel_map',
+        type=str,
+        default=None,
+        help='Architecture description (yml) of a pruned model from scripts/prune_gfpgan.py. Default: None')
+    parser.add_argument(
+        '--onnx_path', type=str, default=None, help='ONNX model exported by scripts/export_onnx.py, for --engine onnx')
+    parser.add_argument('--channels_last', action='store_true', help='Use the channels_last memory format')
+    parser.add_argument('--bf16', action='store_true', help='Use bf16 autocast, if the device supports it')
+    parser.add_argument(
+        '--no_optimize',
+        action='store_true',
+        help='Run the reference forward of the model, without folding the weights and reordering the ops')
+    parser.add_argument(
+        '--engine_cache', type=str, default=None, help='Folder to cache the compiled engines. Default: None')
+    parser.add_argument(
+        '--noise_mode',
+        type=str,
+        default='random',
+        choices=NOISE_MODES,
+        help='Decoder noise: random | buffer (preallocated) | fold (skip the negligible noise). Default: random')
     parser.add_argument(
         '--ext',
         type=str,
         default='auto',
         help='Image extension. Options: auto | jpg | png, auto means using the same extension as inputs. Default: auto')
+    parser.add_argument(
+        '--landmark_cache',
+        type=str,
+        default=None,
+        help='Folder to cache face landmarks and affine matrices, to skip face detection in later runs')
+    parser.add_argument('--cache_faces', action='store_true', help='Also cache the cropped faces')
+    parser.add_argument('--clear_landmark_cache', action='store_true', help='Clear the landmark cache before running')
+    # identity consistency of the restored faces
+    parser.add_argument(
+        '--identity_report',
+        '--identity-report',
+        action='store_true',
+        help='Write the ArcFace similarity of each cropped and restored face to identity_report.csv (image modes)')
+    parser.add_argument(
+        '--identity_model', type=str, default=ARCFACE_URL, help='ArcFace model. Default: arcface_resnet18')
+    parser.add_argument(
+        '--identity_cache', type=str, default=None, help='Folder to cache the identity embeddings. Default: None')
+    parser.add_argument(
+        '--identity_threshold', type=float, default=0.5, help='List the faces below this similarity. Default: 0.5')
+    # pipelined processing of many images
+    parser.add_argument(
+        '--pipeline', action='store_true', help='Overlap reading, detection, restoration and writing of images')
+    parser.add_argument('--num_readers', type=int, default=2, help='Number of reader threads. Default: 2')
+    parser.add_argument('--num_writers', type=int, default=2, help='Number of writer threads. Default: 2')
+    parser.add_argument(
+        '--queue_size', type=int, default=16, help='Maximum number of images queued between stages. Default: 16')
+    parser.add_argument(
+        '--batch_images',
+        type=int,
+        default=4,
+        help='Maximum number of images whose faces are restored together. Default: 4')
+    # video mode
+    parser.add_argument(
+        '--video',
+        action='store_true',
+        help='Input is a video file, or "-" for raw bgr24 frames from stdin (requires --frame_size)')
+    parser.add_argument(
+        '--frame_size', type=frame_size, default=None, help='Frame size WxH of the raw frames from stdin')
+    parser.add_argument(
+        '--fps', type=float, default=None, help='Frame rate of the output video. Default: same as input')
+    parser.add_argument(
+        '--detect_interval', type=int, default=10, help='Run face detection every N frames in video mode. Default: 10')
+    parser.add_argument(
+        '--scene_threshold',
+        type=float,
+        default=30,
+        help='Mean frame difference (0-255) regarded as a scene change, which triggers face detection. Default: 30')
+    # service mode
+    parser.add_argument(
+        '--serve', action='store_true', help='Run a resident HTTP service, POST images to /restore. See /metrics')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Host of the service. Default: 127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000, help='Port of the service. Default: 8000')
+    parser.add_argument('--unix_socket', type=str, default=None, help='Listen on a Unix socket instead of a port')
+    parser.add_argument(
+        '--max_latency_ms',
+        type=float,
+        default=10,
+        help='Maximum time to wait for more faces to fill a batch in the service, in ms. Default: 10')
     args = parser.parse_args()
-
-    args = parser.parse_args()
+    if args.video and args.input == '-' and args.frame_size is None:
+        parser.error('--frame_size WxH is required to read raw frames from stdin (--video -i -)')
 
     # ------------------------ input & output ------------------------
     if args.input.endswith('/'):
         args.input = args.input[:-1]
-    if os.path.isfile(args.input):
+    if args.video or args.serve:
+        img_list = []
+    elif os.path.isfile(args.input):
         img_list = [args.input]
     else:
         img_list = sorted(glob.glob(os.path.join(args.input, '*')))
@@ -93,61 +297,109 @@ def main():
     else:
         raise ValueError(f'Wrong model version {args.version}.')
 
+    if args.channel_multiplier is not None:
+        channel_multiplier = args.channel_multiplier
+
+    if args.channel_map is not None:
+        with open(args.channel_map, mode='r') as f:
+            channel_map = yaml.safe_load(f)['network_g']['channel_map']
+    else:
+        channel_map = None
+
     # determine model paths
     model_path = os.path.join('experiments/pretrained_models', model_name + '.pth')
     if not os.path.isfile(model_path):
         model_path = os.path.join('realesrgan/weights', model_name + '.pth')
+    if args.model_path is not None:
+        model_path = args.model_path
+    if args.engine == 'onnx':
+        if args.onnx_path is None:
+            raise ValueError('The onnx engine requires --onnx_path.')
+        model_path = args.onnx_path
     if not os.path.isfile(model_path):
-        raise ValueError(f'Model {model_name} does not exist.')
+        raise ValueError(f'Model {model_path} does not exist.')
+
+    if args.landmark_cache is not None:
+        landmark_cache = LandmarkCache(args.landmark_cache, save_faces=args.cache_faces)
+        if args.clear_landmark_cache:
+            landmark_cache.clear()
+    else:
+        landmark_cache = None
 
     restorer = GFPGANer(
         model_path=model_path,
         upscale=args.upscale,
         arch=arch,
         channel_multiplier=channel_multiplier,
-        bg_upsampler=bg_upsampler)
+        narrow=args.narrow,
+        channel_map=channel_map,
+        bg_upsampler=bg_upsampler,
+        max_batch=args.max_batch,
+        landmark_cache=landmark_cache,
+        compositor=args.compositor,
+        engine=args.engine,
+        channels_last=args.channels_last,
+        bf16=args.bf16,
+        engine_cache_dir=args.engine_cache,
+        noise_mode=args.noise_mode,
+        optimize=not args.no_optimize)
+
+    if args.identity_report and not (args.serve or args.video):
+        identity_cache = EmbeddingCache(args.identity_cache) if args.identity_cache is not None else None
+        identity_report = IdentityReport(
+            IdentityEmbedder(args.identity_model, cache=identity_cache), threshold=args.identity_threshold)
+    else:
+        identity_report = None
 
     # ------------------------ restore ------------------------
-    for img_path in img_list:
-        # read image
-        img_name = os.path.basename(img_path)
-        print(f'Processing {img_name} ...')
-        basename, ext = os.path.splitext(img_name)
-        input_img = cv2.imread(img_path, cv2.IMREAD_COLOR)
-
-        # restore faces and background if necessary
-        cropped_faces, restored_faces, restored_img = restorer.enhance(
-            input_img, has_aligned=args.aligned, only_center_face=args.only_center_face, paste_back=True)
-
-        # save faces
-        for idx, (cropped_face, restored_face) in enumerate(zip(cropped_faces, restored_faces)):
-            # save cropped face
-            save_crop_path = os.path.join(args.output, 'cropped_faces', f'{basename}_{idx:02d}.png')
-            imwrite(cropped_face, save_crop_path)
-            # save restored face
-            if args.suffix is not None:
-                save_face_name = f'{basename}_{idx:02d}_{args.suffix}.png'
-            else:
-                save_face_name = f'{basename}_{idx:02d}.png'
-            save_restore_path = os.path.join(args.output, 'restored_faces', save_face_name)
-            imwrite(restored_face, save_restore_path)
-            # save comparison image
-            cmp_img = np.concatenate((cropped_face, restored_face), axis=1)
-            imwrite(cmp_img, os.path.join(args.output, 'cmp', f'{basename}_{idx:02d}.png'))
-
-        # save restored img
-        if restored_img is not None:
-            if args.ext == 'auto':
-                extension = ext[1:]
-            else:
-                extension = args.ext
-
-            if args.suffix is not None:
-                save_restore_path = os.path.join(args.output, 'restored_imgs', f'{basename}_{args.suffix}.{extension}')
-            else:
-                save_restore_path = os.path.join(args.output, 'restored_imgs', f'{basename}.{extension}')
-            imwrite(restored_img, save_restore_path)
+    if args.serve:
+        service = RestoreService(
+            restorer, max_batch=args.max_batch, max_latency=args.max_latency_ms / 1000, queue_size=args.queue_size)
+        server = make_server(service, host=args.host, port=args.port, unix_socket=args.unix_socket)
+        print(f'Serving on {args.unix_socket or f"http://{args.host}:{args.port}"} ...')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        server.server_close()
+        service.close()
+        return
+    elif args.video:
+        restore_video(args, restorer)
+    elif args.pipeline:
+        pipeline = RestorePipeline(
+            restorer,
+            num_readers=args.num_readers,
+            num_writers=args.num_writers,
+            queue_size=args.queue_size,
+            batch_images=args.batch_images)
+        start = time.perf_counter()
+        stats = pipeline.run(
+            img_list,
+            functools.partial(save_results, args, identity_report=identity_report),
+            has_aligned=args.aligned,
+            only_center_face=args.only_center_face,
+            paste_back=True)
+        print(f'Processed {len(img_list)} images in {time.perf_counter() - start:.2f} s.')
+        for stage_stats in stats:
+            print(f'\t{stage_stats}')
+    else:
+        for img_path in img_list:
+            # read image
+            img_name = os.path.basename(img_path)
+            print(f'Processing {img_name} ...')
+            input_img = cv2.imread(img_path, cv2.IMREAD_COLOR)
+
+            # restore faces and background if necessary
+            cropped_faces, restored_faces, restored_img = restorer.enhance(
+                input_img, has_aligned=args.aligned, only_center_face=args.only_center_face, paste_back=True)
+            save_results(args, img_path, cropped_faces, restored_faces, restored_img, identity_report)
 
+    if landmark_cache is not None:
+        print(landmark_cache)
+    if identity_report is not None:
+        identity_report.save(os.path.join(args.output, 'identity_report.csv'))
+        print(identity_report.summary())
     print(f'Results are in the [{args.output}] folder.')
 
 
@@ -0,0 +1,93 @@
+"""Benchmark the forward latency, throughput and memory of the GFPGAN architectures on cpu.
+
+It sweeps the archs, out sizes, batch sizes, channel multipliers and narrow ratios (see gfpgan/benchmark.py), with
+randomly initialized weights. Each case runs in a new process (unless --no_isolate), so that the peak RSS is the one of
+the case. The results are written to a JSON file. With --baseline, they are compared with a previous JSON file, and
+the script exits with status 1 if a metric grew more than its threshold or a case now fails.
+
+Examples:
+    # store a baseline, then check a change against it
+    python scripts/benchmark_archs.py --out_sizes 256 512 -o benchmarks/baseline.json
+    python scripts/benchmark_archs.py --out_sizes 256 512 -o benchmarks/current.json \
+        --baseline benchmarks/baseline.json --latency_threshold 0.1
+    # a quick sweep of one arch
+    python scripts/benchmark_archs.py --archs GFPGANv1Clean --out_sizes 512 --batch_sizes 1 --channel_multipliers 2
+"""
+import argparse
+import json
+import os
+import sys
+
+from gfpgan.benchmark import ARCHS, CASE_KEYS, compare_results, get_cases, run_benchmark
+
+
+def format_value(value):
+    return '-' if value is None else f'{value:g}'
+
+
+def print_result(result):
+    case = (f'{result["arch"]:<30}{result["out_size"]:>6}{result["batch_size"]:>6}'
+            f'{format_value(result["channel_multiplier"]):>5}{format_value(result["narrow"]):>5}')
+    if 'error' in result:
+        print(f'{case}\tFailed: {result["error"]}')
+        return
+    rss = '-' if result.get('peak_rss_mb') is None else f'{result["peak_rss_mb"]:.1f}'
+    print(f'{case}{result["params_m"]:>9.1f}{result["latency_ms"]:>12.1f}{result["throughput"]:>10.2f}'
+          f'{result["peak_alloc_mb"]:>11.1f}{rss:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--archs', type=str, nargs='+', default=list(ARCHS), choices=ARCHS)
+    parser.add_argument('--out_sizes', type=int, nargs='+', default=[256, 512, 1024])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--channel_multipliers', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--narrows', type=float, nargs='+', default=[1])
+    parser.add_argument('--num_iters', type=int, default=5)
+    parser.add_argument('--num_warmup', type=int, default=1)
+    parser.add_argument('--num_threads', type=int, default=None, help='Torch threads. Default: torch default')
+    parser.add_argument('--no_isolate', action='store_true', help='Run all the cases in this process, without RSS')
+    parser.add_argument('-o', '--output', type=str, default='benchmark_results.json', help='Output JSON file')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON results to compare with. Default: None')
+    parser.add_argument('--latency_threshold', type=float, default=0.1, help='Max latency increase. Default: 0.1')
+    parser.add_argument('--memory_threshold', type=float, default=0.1, help='Max memory increase. Default: 0.1')
+    args = parser.parse_args()
+
+    cases = get_cases(args.archs, args.out_sizes, args.batch_sizes, args.channel_multipliers, args.narrows)
+    print(f'{len(cases)} cases.')
+    print(f'{"arch":<30}{"size":>6}{"batch":>6}{"cm":>5}{"nar":>5}{"params M":>9}{"latency ms":>12}{"img/s":>10}'
+          f'{"alloc MB":>11}{"RSS MB":>10}')
+    results = run_benchmark(
+        cases,
+        num_iters=args.num_iters,
+        num_warmup=args.num_warmup,
+        num_threads=args.num_threads,
+        isolate=not args.no_isolate,
+        callback=print_result)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'Results are in {args.output}.')
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        thresholds = dict(
+            latency_ms=args.latency_threshold, peak_alloc_mb=args.memory_threshold, peak_rss_mb=args.memory_threshold)
+        comparisons = compare_results(results, baseline, thresholds)
+        regressions = [comparison for comparison in comparisons if comparison['regression']]
+        print(f'Compared {len(comparisons)} metrics with {args.baseline}: {len(regressions)} regressions.')
+        for comparison in regressions:
+            case = ', '.join(f'{key}={comparison[key]}' for key in CASE_KEYS)
+            if comparison['metric'] == 'error':
+                print(f'\t{case}: now fails with {comparison["current"]}')
+            else:
+                print(f'\t{case}: {comparison["metric"]} {comparison["baseline"]:.1f} -> '
+                      f'{comparison["current"]:.1f} ({comparison["ratio"]:.2f}x)')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""FLOPs and latency of a GFPGANv1Clean model before and after ``gfpgan.graph_optimizer.optimize_graph``.
+
+It prints the GFLOPs of the whole model and of the ResBlock skip convs (reordered in the upsampling blocks), the
+latency per batch and the max abs difference of the outputs. The weights are random if no model is given.
+
+Examples:
+    python scripts/benchmark_graph_optimizer.py --model_path experiments/pretrained_models/GFPGANv1.3.pth
+    python scripts/benchmark_graph_optimizer.py --batch_sizes 1 4 --device cuda --num_iters 20
+"""
+import argparse
+import copy
+import time
+import torch
+from torch.utils.flop_counter import FlopCounterMode
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.graph_optimizer import optimize_graph
+
+
+def measure(fn, num_iters, device):
+    fn()  # warm up
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / num_iters
+
+
+def count_gflops(gfpgan, x):
+    """GFLOPs of the whole model and of the skip convs of its ResBlocks."""
+    flop_counter = FlopCounterMode(display=False)
+    with flop_counter:
+        gfpgan.inference(x, randomize_noise=False)
+    # the modules are named by class, so that it sums the skips of all the ResBlocks
+    skip_flops = sum(flop_counter.get_flop_counts().get('ResBlock.skip', {}).values())
+    return flop_counter.get_total_flops() / 1e9, skip_flops / 1e9
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, default=None, help='Path to the GFPGANv1Clean model')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--num_iters', type=int, default=3)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    gfpgan = GFPGANv1Clean(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=args.channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    if args.model_path is not None:
+        loadnet = torch.load(args.model_path, map_location='cpu')
+        keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+        gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    gfpgan = gfpgan.to(device).eval()
+    optimized = optimize_graph(copy.deepcopy(gfpgan))
+
+    x = torch.rand(1, 3, 512, 512, device=device) * 2 - 1
+    print(f'{"model":<12}{"GFLOPs":>10}{"skip GFLOPs":>14}')
+    for name, model in (('original', gfpgan), ('optimized', optimized)):
+        total, skip = count_gflops(model, x)
+        print(f'{name:<12}{total:>10.2f}{skip:>14.2f}')
+
+    print(f'{"batch":>6}{"original ms":>14}{"optimized ms":>15}{"speedup":>9}{"max diff":>10}')
+    for batch_size in args.batch_sizes:
+        x = torch.rand(batch_size, 3, 512, 512, device=device) * 2 - 1
+        diff = (gfpgan.inference(x, randomize_noise=False) -
+                optimized.inference(x, randomize_noise=False)).abs().max().item()
+        times = [
+            measure(lambda: model.inference(x, randomize_noise=False), args.num_iters, device)
+            for model in (gfpgan, optimized)
+        ]
+        print(f'{batch_size:>6}{times[0] * 1000:>14.1f}{times[1] * 1000:>15.1f}{times[0] / times[1]:>9.2f}'
+              f'{diff:>10.1e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Micro-benchmark of the execution strategies of ModulatedConv2d, for the layers of the GFPGAN decoder.
+
+``grouped`` modulates a weight tensor per sample and runs a grouped conv. ``activation`` scales the inputs by the styles
+and the outputs by the demodulation coefficients, and runs a conv with shared weights. For each layer and batch size,
+it prints the latency of both, the max abs difference of their outputs and the strategy that ``auto`` selects, to check
+the crossover of ``select_modulated_conv_strategy`` on a device.
+
+Examples:
+    python scripts/benchmark_modulated_conv.py --batch_sizes 1 2 4 8
+    python scripts/benchmark_modulated_conv.py --device cuda --num_iters 20
+"""
+import argparse
+import time
+import torch
+
+from gfpgan.archs.stylegan2_clean_arch import ModulatedConv2d, select_modulated_conv_strategy
+
+
+def get_decoder_layers(out_size=512, channel_multiplier=2):
+    """(in_channels, out_channels, input size, sample_mode) of the 3x3 modulated convs of StyleGAN2GeneratorClean."""
+    channels = {
+        '4': int(512), '8': int(512), '16': int(512), '32': int(512),
+        '64': int(256 * channel_multiplier), '128': int(128 * channel_multiplier),
+        '256': int(64 * channel_multiplier), '512': int(32 * channel_multiplier)
+    }  # yapf: disable
+    layers = [(channels['4'], channels['4'], 4, None)]
+    size = 4
+    while size < out_size:
+        in_channels, out_channels = channels[f'{size}'], channels[f'{size * 2}']
+        layers.append((in_channels, out_channels, size, 'upsample'))
+        layers.append((out_channels, out_channels, size * 2, None))
+        size *= 2
+    return layers
+
+
+def measure(fn, num_iters, device):
+    fn()  # warm up
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        fn()
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / num_iters
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--out_size', type=int, default=512)
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--device', type=str, default='cpu')
+    parser.add_argument('--num_iters', type=int, default=5)
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    print(f'{"layer":<24}{"batch":>6}{"grouped ms":>12}{"activation ms":>15}{"speedup":>9}{"max diff":>10}'
+          f'{"auto":>12}')
+    for in_channels, out_channels, size, sample_mode in get_decoder_layers(args.out_size, args.channel_multiplier):
+        conv = ModulatedConv2d(in_channels, out_channels, 3, 512, sample_mode=sample_mode).to(device).eval()
+        out_size = size * 2 if sample_mode == 'upsample' else size
+        name = f'{in_channels}->{out_channels}@{out_size}' + (' up' if sample_mode else '')
+        for batch_size in args.batch_sizes:
+            x = torch.randn(batch_size, in_channels, size, size, device=device)
+            style = torch.randn(batch_size, 512, device=device)
+            times, outputs = {}, {}
+            for strategy in ('grouped', 'activation'):
+                conv.strategy = strategy
+                outputs[strategy] = conv(x, style)
+                times[strategy] = measure(lambda: conv(x, style), args.num_iters, device)
+            diff = (outputs['grouped'] - outputs['activation']).abs().max().item()
+            auto = select_modulated_conv_strategy(batch_size, in_channels, out_channels, 3, size**2, out_size**2)
+            print(f'{name:<24}{batch_size:>6}{times["grouped"] * 1000:>12.2f}{times["activation"] * 1000:>15.2f}'
+                  f'{times["grouped"] / times["activation"]:>9.2f}{diff:>10.1e}{auto:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Convert a GFPGAN checkpoint to the flat weight format, for fast, memory-mapped loading in GFPGANer.
+
+Only ``params_ema`` (or ``params`` if there is no ``params_ema``) is kept: the other one is not used for inference.
+
+Examples:
+    python scripts/convert_to_flat_weights.py --ori_path experiments/pretrained_models/GFPGANv1.3.pth \
+        --save_path experiments/pretrained_models/GFPGANv1.3.gfw
+    python inference_gfpgan.py -i inputs/whole_imgs -v 1.3 --model_path experiments/pretrained_models/GFPGANv1.3.gfw
+"""
+import argparse
+import os
+import torch
+
+from gfpgan.flat_weights import save_flat_weights
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ori_path', type=str, help='Path to the original model')
+    parser.add_argument('--save_path', type=str, help='Path to the flat weights')
+    args = parser.parse_args()
+
+    loadnet = torch.load(args.ori_path, map_location='cpu')
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    save_flat_weights(loadnet[keyname], args.save_path, metadata={'source': os.path.basename(args.ori_path)})
+    print(f'Save {keyname} to {args.save_path} ({os.path.getsize(args.ori_path) / 2**20:.1f} MB -> '
+          f'{os.path.getsize(args.save_path) / 2**20:.1f} MB).')
@@ -0,0 +1,81 @@
+"""Export GFPGANv1Clean or GFPGANBilinear to ONNX, with a dynamic batch axis.
+
+The modulated convolutions of the StyleGAN2 decoder run a grouped conv with ``groups=batch``, which fixes the batch
+size in the exported graph. For the export, they use the ``activation`` strategy, with shared weights: the inputs are
+scaled by the styles and the outputs by the demodulation coefficients. The FusedLeakyReLU of the bilinear arch (a CUDA
+extension of basicsr) is replaced by plain PyTorch ops.
+
+Examples:
+    python scripts/export_onnx.py --model_path experiments/pretrained_models/GFPGANv1.3.pth --save_path gfpgan.onnx
+    python inference_gfpgan.py -i inputs/whole_imgs --engine onnx --onnx_path gfpgan.onnx
+"""
+import argparse
+import time
+import torch
+
+from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.engine import OnnxEngine
+from gfpgan.onnx_export import EXPORT_NOISE_MODES, check_onnx, export_onnx, replace_fused_activations
+
+
+def build_model(arch, model_path, channel_multiplier):
+    gfpgan_cls = GFPGANv1Clean if arch == 'clean' else GFPGANBilinear
+    gfpgan = gfpgan_cls(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    loadnet = torch.load(model_path, map_location='cpu')
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    return replace_fused_activations(gfpgan).eval()
+
+
+@torch.no_grad()
+def benchmark(gfpgan, onnx_engine, batch_sizes, num_iters=5):
+    """Print the latency and throughput of eager PyTorch and onnxruntime on CPU."""
+    size = onnx_engine.input_size
+    for batch_size in batch_sizes:
+        x = torch.rand(batch_size, 3, size, size) * 2 - 1
+        for name, run in [('pytorch', lambda: gfpgan(x, return_rgb=False)[0]), ('onnxruntime', lambda: onnx_engine(x))]:
+            run()  # warm up
+            start = time.perf_counter()
+            for _ in range(num_iters):
+                run()
+            latency = (time.perf_counter() - start) / num_iters
+            print(f'{name:>12} batch {batch_size}: {latency * 1000:.1f} ms, {batch_size / latency:.2f} faces/s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, help='Path to the GFPGAN model (clean or bilinear)')
+    parser.add_argument('--arch', type=str, default='clean', help='clean | bilinear. Default: clean')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--save_path', type=str, help='Path to the ONNX model')
+    parser.add_argument(
+        '--noise',
+        type=str,
+        default='baked',
+        choices=EXPORT_NOISE_MODES,
+        help='baked: the stored noise is baked in the graph. input: the noise is given as inputs. Default: baked')
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--atol', type=float, default=1e-3, help='Tolerance of the numerical check')
+    parser.add_argument('--benchmark', type=str, default=None, help='Batch sizes to benchmark, e.g., 1,4,8')
+    args = parser.parse_args()
+
+    gfpgan = build_model(args.arch, args.model_path, args.channel_multiplier)
+    print(f'Export to {args.save_path}.')
+    export_onnx(gfpgan, args.save_path, args.noise, args.opset)
+
+    onnx_engine = OnnxEngine(args.save_path)
+    if not check_onnx(gfpgan, onnx_engine, atol=args.atol):
+        raise ValueError(f'The ONNX outputs differ from PyTorch by more than {args.atol}.')
+    if args.benchmark is not None:
+        benchmark(gfpgan, onnx_engine, [int(batch_size) for batch_size in args.benchmark.split(',')])
@@ -0,0 +1,54 @@
+"""Identity similarity (ArcFace cosine) between pairs of aligned faces, e.g. the cropped and restored faces of a run.
+
+The faces of the two folders are paired by file name. The embeddings are computed in batches, and cached on disk with
+``--cache`` (keyed by the image content), so that re-scoring a job only embeds the new faces.
+
+Examples:
+    python scripts/identity_similarity.py -a results/cropped_faces -b results/restored_faces -o identity.csv
+    python scripts/identity_similarity.py -a results/cropped_faces -b results/restored_faces --cache .identity_cache
+"""
+import argparse
+import cv2
+import os
+import time
+
+from gfpgan.identity import ARCFACE_URL, EmbeddingCache, IdentityEmbedder, IdentityReport
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--input_a', type=str, required=True, help='Folder of the original faces')
+    parser.add_argument('-b', '--input_b', type=str, required=True, help='Folder of the restored faces')
+    parser.add_argument('-o', '--output', type=str, default='identity_report.csv', help='Output csv file')
+    parser.add_argument('--model_path', type=str, default=ARCFACE_URL, help='ArcFace model. Default: arcface_resnet18')
+    parser.add_argument('--cache', type=str, default=None, help='Folder of the embedding cache. Default: None')
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--threshold', type=float, default=0.5, help='List the pairs below it. Default: 0.5')
+    args = parser.parse_args()
+
+    names = sorted(set(os.listdir(args.input_a)) & set(os.listdir(args.input_b)))
+    if not names:
+        raise ValueError(f'No faces with the same names in {args.input_a} and {args.input_b}.')
+    cache = EmbeddingCache(args.cache) if args.cache is not None else None
+    report = IdentityReport(
+        IdentityEmbedder(args.model_path, batch_size=args.batch_size, cache=cache), threshold=args.threshold)
+
+    start = time.perf_counter()
+    for name in names:
+        face = cv2.imread(os.path.join(args.input_a, name), cv2.IMREAD_COLOR)
+        restored_face = cv2.imread(os.path.join(args.input_b, name), cv2.IMREAD_COLOR)
+        if face is None or restored_face is None:
+            print(f'\tFailed to read {name}, skip it.')
+            continue
+        report.add(name, face, restored_face)
+    report.save(args.output)
+    elapsed = time.perf_counter() - start
+    print(report.summary())
+    print(f'{len(report.scores)} pairs in {elapsed:.1f} s ({len(report.scores) / elapsed * 60:.0f} pairs/min). '
+          f'Similarities are in {args.output}.')
+    if cache is not None:
+        print(cache)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Load generator for the restoration service (``inference_gfpgan.py --serve``).
+
+For each concurrency level, it sends the images of a folder in a closed loop (each client sends a new request when the
+previous one is answered) for a fixed duration, and reports the throughput and the p50/p99 latencies, so that the
+batching options (--max_batch, --max_latency_ms) can be tuned.
+
+Examples:
+    python inference_gfpgan.py --serve --port 8000 --max_batch 8 --max_latency_ms 10
+    python scripts/load_generator.py --url http://127.0.0.1:8000 -i inputs/whole_imgs --concurrency 1 2 4 8
+    python scripts/load_generator.py --unix_socket /tmp/gfpgan.sock -i inputs/cropped_faces --aligned
+"""
+import argparse
+import glob
+import http.client
+import numpy as np
+import os
+import socket
+import threading
+import time
+from urllib.parse import urlparse
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, unix_socket, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_socket = unix_socket
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_socket)
+
+
+def make_connection(args):
+    if args.unix_socket is not None:
+        return UnixHTTPConnection(args.unix_socket)
+    url = urlparse(args.url)
+    return http.client.HTTPConnection(url.hostname, url.port or 80, timeout=60)
+
+
+def run_client(args, bodies, path, stop_time, results, lock):
+    conn = make_connection(args)
+    latencies, num_rejected, num_failed = [], 0, 0
+    idx = 0
+    while time.perf_counter() < stop_time:
+        body = bodies[idx % len(bodies)]
+        idx += 1
+        start = time.perf_counter()
+        try:
+            conn.request('POST', path, body=body, headers={'Content-Type': 'application/octet-stream'})
+            response = conn.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            num_failed += 1
+            conn.close()
+            conn = make_connection(args)
+            time.sleep(args.backoff)
+            continue
+        if response.status == 200:
+            latencies.append(time.perf_counter() - start)
+        elif response.status == 503:
+            num_rejected += 1
+            time.sleep(args.backoff)
+        else:
+            num_failed += 1
+    conn.close()
+    with lock:
+        results['latencies'].extend(latencies)
+        results['rejected'] += num_rejected
+        results['failed'] += num_failed
+
+
+def run_level(args, bodies, path, concurrency):
+    results = {'latencies': [], 'rejected': 0, 'failed': 0}
+    lock = threading.Lock()
+    stop_time = time.perf_counter() + args.duration
+    threads = [
+        threading.Thread(target=run_client, args=(args, bodies, path, stop_time, results, lock))
+        for _ in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = np.array(results['latencies']) * 1000
+    p50, p99 = np.percentile(latencies, [50, 99]) if len(latencies) else (float('nan'), float('nan'))
+    return len(latencies) / elapsed, p50, p99, results['rejected'], results['failed']
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', type=str, default='http://127.0.0.1:8000', help='URL of the service')
+    parser.add_argument('--unix_socket', type=str, default=None, help='Unix socket of the service, instead of --url')
+    parser.add_argument('-i', '--input', type=str, default='inputs/whole_imgs', help='Input image or folder')
+    parser.add_argument('--aligned', action='store_true', help='Input are aligned faces')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8], help='Numbers of clients')
+    parser.add_argument('--duration', type=float, default=10, help='Duration of each level, in seconds. Default: 10')
+    parser.add_argument(
+        '--backoff', type=float, default=0.05, help='Sleep after a 503 or an error, in seconds. Default: 0.05')
+    args = parser.parse_args()
+
+    if os.path.isfile(args.input):
+        img_list = [args.input]
+    else:
+        img_list = sorted(glob.glob(os.path.join(args.input, '*')))
+    bodies = []
+    for img_path in img_list:
+        with open(img_path, 'rb') as f:
+            bodies.append(f.read())
+    if not bodies:
+        raise ValueError(f'No images in {args.input}.')
+    path = f'/restore?aligned={int(args.aligned)}&ext=jpg'
+
+    print(f'{"clients":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"rejected":>10}{"failed":>8}')
+    for concurrency in args.concurrency:
+        throughput, p50, p99, num_rejected, num_failed = run_level(args, bodies, path, concurrency)
+        print(f'{concurrency:>8}{throughput:>10.2f}{p50:>10.1f}{p99:>10.1f}{num_rejected:>10}{num_failed:>8}')
+
+
+if __name__ == '__main__':
+    main()
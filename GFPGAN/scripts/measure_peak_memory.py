@@ -0,0 +1,69 @@
+"""Measure the peak memory of the forward and the lean inference forward of GFPGANv1Clean.
+
+The peak memory does not depend on the weights, so the models are randomly initialized, unless --model_path is given
+(for out_size 512).
+
+Examples:
+    python scripts/measure_peak_memory.py --out_sizes 512 1024 --batch_sizes 1 4
+    python scripts/measure_peak_memory.py --device cuda --out_sizes 1024 --batch_sizes 8
+"""
+import argparse
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.memory import measure_peak_memory
+
+
+def build_model(out_size, channel_multiplier, model_path=None):
+    gfpgan = GFPGANv1Clean(
+        out_size=out_size,
+        num_style_feat=512,
+        channel_multiplier=channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    if model_path is not None:
+        loadnet = torch.load(model_path, map_location='cpu')
+        keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+        gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    return gfpgan.eval()
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out_sizes', type=int, nargs='+', default=[512, 1024])
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--model_path', type=str, default=None, help='Weights of the 512 model. Default: random')
+    parser.add_argument('--device', type=str, default='cpu')
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    runs = {
+        'forward': lambda gfpgan, x: gfpgan(x, return_rgb=False, randomize_noise=False)[0],
+        'lean': lambda gfpgan, x: gfpgan.inference(x, randomize_noise=False, lazy_conditions=False),
+        'lean+lazy': lambda gfpgan, x: gfpgan.inference(x, randomize_noise=False, lazy_conditions=True)
+    }
+    print(f'{"size":>6}{"batch":>6}' + ''.join(f'{name + " MB":>16}' for name in runs) + f'{"saved":>8}'
+          f'{"max diff":>10}')
+    for out_size in args.out_sizes:
+        model_path = args.model_path if out_size == 512 else None
+        gfpgan = build_model(out_size, args.channel_multiplier, model_path).to(device)
+        for batch_size in args.batch_sizes:
+            x = torch.rand(batch_size, 3, out_size, out_size, device=device) * 2 - 1
+            peaks, outputs = {}, {}
+            for name, run in runs.items():
+                outputs[name], peaks[name] = measure_peak_memory(lambda: run(gfpgan, x), device)
+            diff = max((outputs[name] - outputs['forward']).abs().max().item() for name in runs)
+            saved = 1 - peaks['lean+lazy'] / peaks['forward']
+            peaks_mb = ''.join(f'{peak / 2**20:>16.1f}' for peak in peaks.values())
+            print(f'{out_size:>6}{batch_size:>6}{peaks_mb}{saved:>8.0%}{diff:>10.1e}')
+
+
+if __name__ == '__main__':
+    main()
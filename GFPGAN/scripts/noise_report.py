@@ -0,0 +1,121 @@
+"""Report the speed, memory and output difference of the noise modes of the GFPGANv1Clean decoder.
+
+- random: new noise in every StyleConv of every forward (the default of GFPGANer).
+- buffer: preallocated noise for each batch slot, sampled once.
+- fold: the noise injection of the layers with a noise strength at most --fold_threshold is skipped.
+
+The output difference (PSNR against a forward with random noise) is compared with the difference between two
+forwards with random noise, which is the variation that the noise causes anyway.
+
+Examples:
+    python scripts/noise_report.py --model_path experiments/pretrained_models/GFPGANv1.3.pth
+"""
+import argparse
+import cv2
+import glob
+import numpy as np
+import os
+import time
+import torch
+from basicsr.metrics import calculate_psnr
+from torch.profiler import ProfilerActivity, profile
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.engine import InferenceEngine
+from gfpgan.noise import FOLD_THRESHOLD, NOISE_MODES, fold_noise, get_noise_convs, get_noise_strength
+from gfpgan.utils import faces2tensor, tensor2faces
+
+
+def read_faces(folder, size=512):
+    faces = []
+    for path in sorted(glob.glob(os.path.join(folder, '*'))):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            faces.append(cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR))
+    return faces
+
+
+def build_model(model_path, channel_multiplier):
+    gfpgan = GFPGANv1Clean(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    loadnet = torch.load(model_path, map_location='cpu')
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    return gfpgan.eval()
+
+
+def restore(engine, faces, batch_size):
+    restored_faces = []
+    for start in range(0, len(faces), batch_size):
+        restored_faces.extend(tensor2faces(engine(faces2tensor(faces[start:start + batch_size], engine.device))))
+    return restored_faces
+
+
+def measure(engine, x, num_iters):
+    """Latency per face in seconds, and the bytes allocated by one forward."""
+    engine(x)  # warm up, and allocate the noise buffers
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        engine(x)
+    latency = (time.perf_counter() - start) / num_iters / x.size(0)
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        engine(x)
+    allocated = sum(event.self_cpu_memory_usage for event in prof.key_averages() if event.self_cpu_memory_usage > 0)
+    return latency, allocated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, help='Path to the GFPGANv1Clean model')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('-i', '--input', type=str, default='inputs/cropped_faces', help='Aligned faces')
+    parser.add_argument('--fold_threshold', type=float, default=FOLD_THRESHOLD)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_iters', type=int, default=3)
+    args = parser.parse_args()
+
+    faces = read_faces(args.input)
+    if not faces:
+        raise ValueError(f'No faces in {args.input}.')
+    batch_size = min(args.batch_size, len(faces))
+    x = faces2tensor(faces[:batch_size])
+
+    gfpgan = build_model(args.model_path, args.channel_multiplier)
+    strengths = [get_noise_strength(conv) for conv in get_noise_convs(gfpgan.stylegan_decoder)]
+    print('Noise strength of each StyleConv: ' + ', '.join(f'{strength:.3g}' for strength in strengths))
+
+    torch.manual_seed(0)
+    engine = InferenceEngine(gfpgan, noise_mode='random')
+    ref_faces = restore(engine, faces, batch_size)
+    results = {}
+    for noise_mode in NOISE_MODES:
+        # a fresh model, since folding is in place
+        gfpgan = build_model(args.model_path, args.channel_multiplier)
+        if noise_mode == 'fold':
+            num_folded = fold_noise(gfpgan.stylegan_decoder, args.fold_threshold)
+            print(f'Fold {num_folded}/{len(strengths)} layers with a noise strength <= {args.fold_threshold}.')
+        engine = InferenceEngine(gfpgan, noise_mode=noise_mode)
+        latency, allocated = measure(engine, x, args.num_iters)
+        restored_faces = restore(engine, faces, batch_size)
+        psnr = np.mean([calculate_psnr(face, ref, crop_border=0) for face, ref in zip(restored_faces, ref_faces)])
+        results[noise_mode] = (latency, allocated, psnr)
+
+    print(f'{"mode":<8}{"ms/face":>10}{"speedup":>10}{"MB/forward":>12}{"PSNR vs random":>16}')
+    latency_random = results['random'][0]
+    for noise_mode, (latency, allocated, psnr) in results.items():
+        print(f'{noise_mode:<8}{latency * 1000:>10.1f}{latency_random / latency:>10.2f}{allocated / 2**20:>12.1f}'
+              f'{psnr:>16.2f}')
+    print('The PSNR of random is between two forwards with different random noise.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,85 +1,71 @@
+"""Parse the eye and mouth components of the FFHQ faces from the landmarks of the official metadata.
+
+The metadata JSON (ffhq-dataset-v2.json) is streamed, and the components of all the faces are computed at once from
+a (N, 68, 2) landmark array. They are saved as a (N, 3, 3) float32 npy file (left eye, right eye and mouth; x, y and
+half length), the ``component_path`` of FFHQDegradationDataset. With --save_img, the crops of the components are
+written to check the landmarks, in parallel.
+
+Examples:
+    python scripts/parse_landmark.py --json_path ffhq-dataset-v2.json -o FFHQ_eye_mouth_landmarks_512.npy
+    python scripts/parse_landmark.py --save_img --face_path datasets/ffhq/ffhq_512.lmdb --num_workers 8
+"""
+import argparse
 import cv2
-import json
 import numpy as np
 import os
-import torch
+import time
 from basicsr.utils import FileClient, imfrombytes
-from collections import OrderedDict
-
-# ---------------------------- This script is used to parse facial landmarks ------------------------------------- #
-# Configurations
-save_img = False
-scale = 0.5  # 0.5 for official FFHQ (512x512), 1 for others
-enlarge_ratio = 1.4  # only for eyes
-json_path = 'ffhq-dataset-v2.json'
-face_path = 'datasets/ffhq/ffhq_512.lmdb'
-save_path = './FFHQ_eye_mouth_landmarks_512.pth'
+from multiprocessing import Pool
 
-print('Load JSON metadata...')
-# use the official json file in FFHQ dataset
-with open(json_path, 'rb') as f:
-    json_data = json.load(f, object_pairs_hook=OrderedDict)
+from gfpgan.data.facial_components import (COMPONENTS, component_locations, components_from_landmarks,
+                                           load_ffhq_landmarks)
 
-print('Open LMDB file...')
-# read ffhq images
-file_client = FileClient('lmdb', db_paths=face_path)
-with open(os.path.join(face_path, 'meta_info.txt')) as fin:
-    paths = [line.split('.')[0] for line in fin]
+_file_client = None
 
-save_dict = {}
 
-for item_idx, item in enumerate(json_data.values()):
-    print(f'\r{item_idx} / {len(json_data)}, {item["image"]["file_path"]} ', end='', flush=True)
+def init_worker(face_path):
+    global _file_client
+    _file_client = FileClient('lmdb', db_paths=face_path)
 
-    # parse landmarks
-    lm = np.array(item['image']['face_landmarks'])
-    lm = lm * scale
 
-    item_dict = {}
-    # get image
-    if save_img:
-        img_bytes = file_client.get(paths[item_idx])
-        img = imfrombytes(img_bytes, float32=True)
+def save_crops(args):
+    """Write the component crops of a face."""
+    path, item_idx, locations, save_dir = args
+    img = imfrombytes(_file_client.get(path))
+    for part, loc in zip(COMPONENTS, locations):
+        cv2.imwrite(os.path.join(save_dir, f'{item_idx:08d}_{part}.png'), img[loc[1]:loc[3], loc[0]:loc[2]])
 
-    # get landmarks for each component
-    map_left_eye = list(range(36, 42))
-    map_right_eye = list(range(42, 48))
-    map_mouth = list(range(48, 68))
 
-    # eye_left
-    mean_left_eye = np.mean(lm[map_left_eye], 0)  # (x, y)
-    half_len_left_eye = np.max((np.max(np.max(lm[map_left_eye], 0) - np.min(lm[map_left_eye], 0)) / 2, 16))
-    item_dict['left_eye'] = [mean_left_eye[0], mean_left_eye[1], half_len_left_eye]
-    # mean_left_eye[0] = 512 - mean_left_eye[0]  # for testing flip
-    half_len_left_eye *= enlarge_ratio
-    loc_left_eye = np.hstack((mean_left_eye - half_len_left_eye + 1, mean_left_eye + half_len_left_eye)).astype(int)
-    if save_img:
-        eye_left_img = img[loc_left_eye[1]:loc_left_eye[3], loc_left_eye[0]:loc_left_eye[2], :]
-        cv2.imwrite(f'tmp/{item_idx:08d}_eye_left.png', eye_left_img * 255)
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--json_path', type=str, default='ffhq-dataset-v2.json', help='The official FFHQ metadata')
+    parser.add_argument('-o', '--save_path', type=str, default='FFHQ_eye_mouth_landmarks_512.npy')
+    parser.add_argument('--scale', type=float, default=0.5, help='0.5 for official FFHQ (512x512), 1 for others')
+    parser.add_argument('--save_img', action='store_true', help='Write the component crops, to check them')
+    parser.add_argument('--face_path', type=str, default='datasets/ffhq/ffhq_512.lmdb', help='Faces for --save_img')
+    parser.add_argument('--save_dir', type=str, default='tmp', help='Folder of the crops. Default: tmp')
+    parser.add_argument('--enlarge_ratio', type=float, default=1.4, help='Enlarge ratio of the eye crops')
+    parser.add_argument('--num_workers', type=int, default=4, help='Processes that write the crops. Default: 4')
+    args = parser.parse_args()
 
-    # eye_right
-    mean_right_eye = np.mean(lm[map_right_eye], 0)
-    half_len_right_eye = np.max((np.max(np.max(lm[map_right_eye], 0) - np.min(lm[map_right_eye], 0)) / 2, 16))
-    item_dict['right_eye'] = [mean_right_eye[0], mean_right_eye[1], half_len_right_eye]
-    # mean_right_eye[0] = 512 - mean_right_eye[0]  # # for testing flip
-    half_len_right_eye *= enlarge_ratio
-    loc_right_eye = np.hstack(
-        (mean_right_eye - half_len_right_eye + 1, mean_right_eye + half_len_right_eye)).astype(int)
-    if save_img:
-        eye_right_img = img[loc_right_eye[1]:loc_right_eye[3], loc_right_eye[0]:loc_right_eye[2], :]
-        cv2.imwrite(f'tmp/{item_idx:08d}_eye_right.png', eye_right_img * 255)
+    start = time.time()
+    print('Load JSON metadata...')
+    landmarks = load_ffhq_landmarks(args.json_path)
+    components = components_from_landmarks(landmarks, args.scale)
+    np.save(args.save_path, components)
+    print(f'Saved the components of {len(components)} faces to {args.save_path} in {time.time() - start:.1f}s.')
 
-    # mouth
-    mean_mouth = np.mean(lm[map_mouth], 0)
-    half_len_mouth = np.max((np.max(np.max(lm[map_mouth], 0) - np.min(lm[map_mouth], 0)) / 2, 16))
-    item_dict['mouth'] = [mean_mouth[0], mean_mouth[1], half_len_mouth]
-    # mean_mouth[0] = 512 - mean_mouth[0]  # for testing flip
-    loc_mouth = np.hstack((mean_mouth - half_len_mouth + 1, mean_mouth + half_len_mouth)).astype(int)
-    if save_img:
-        mouth_img = img[loc_mouth[1]:loc_mouth[3], loc_mouth[0]:loc_mouth[2], :]
-        cv2.imwrite(f'tmp/{item_idx:08d}_mouth.png', mouth_img * 255)
+    if args.save_img:
+        with open(os.path.join(args.face_path, 'meta_info.txt')) as fin:
+            paths = [line.split('.')[0] for line in fin]
+        os.makedirs(args.save_dir, exist_ok=True)
+        locations = component_locations(components, args.enlarge_ratio).astype(int)
+        tasks = [(path, idx, loc, args.save_dir) for idx, (path, loc) in enumerate(zip(paths, locations))]
+        with Pool(args.num_workers, initializer=init_worker, initargs=(args.face_path, )) as pool:
+            for idx, _ in enumerate(pool.imap_unordered(save_crops, tasks, chunksize=64)):
+                print(f'\r{idx + 1} / {len(tasks)}', end='', flush=True)
+        print(f'\nThe crops are in {args.save_dir}.')
 
-    save_dict[f'{item_idx:08d}'] = item_dict
 
-print('Save...')
-torch.save(save_dict, save_path)
+if __name__ == '__main__':
+    main()
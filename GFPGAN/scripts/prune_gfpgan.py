@@ -0,0 +1,152 @@
+"""Prune the channels of a GFPGANv1Clean model, ranked on a calibration set of aligned faces.
+
+The U-Net channels of each level, the mid channels of the ResBlocks and the hidden channels of the SFT branches are
+pruned (see gfpgan/pruning.py). It writes the pruned checkpoint and its architecture description (the network_g
+options, with the channel_map), and reports the params, FLOPs, speed and the difference to the original outputs.
+
+The pruned model can be fine-tuned with GFPGANDistillModel (network_g from the description, pretrain_network_g the
+checkpoint, and the original model as the teacher), and run with:
+    python inference_gfpgan.py --model_path experiments/pretrained_models/GFPGANv1.3_pruned.pth \
+        --channel_map experiments/pretrained_models/GFPGANv1.3_pruned.yml
+
+Examples:
+    python scripts/prune_gfpgan.py --model_path experiments/pretrained_models/GFPGANv1.3.pth \
+        -i datasets/calibration_faces --keep_ratio 0.5 -o experiments/pretrained_models/GFPGANv1.3_pruned.pth
+"""
+import argparse
+import cv2
+import glob
+import numpy as np
+import os
+import time
+import torch
+import yaml
+from basicsr.metrics import calculate_psnr, calculate_ssim
+from torch.utils.flop_counter import FlopCounterMode
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.pruning import compute_channel_importance, get_channel_map, prune_gfpgan
+from gfpgan.utils import faces2tensor, tensor2faces
+
+
+def read_faces(folder, size=512):
+    faces = []
+    for path in sorted(glob.glob(os.path.join(folder, '*'))):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is not None:
+            faces.append(cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR))
+    return faces
+
+
+def batches(faces, batch_size):
+    for start in range(0, len(faces), batch_size):
+        yield faces2tensor(faces[start:start + batch_size])
+
+
+@torch.no_grad()
+def restore(gfpgan, faces, batch_size):
+    restored_faces = []
+    for x in batches(faces, batch_size):
+        restored_faces.extend(tensor2faces(gfpgan.inference(x, randomize_noise=False)))
+    return restored_faces
+
+
+@torch.no_grad()
+def measure(gfpgan, x, num_iters):
+    """Params in M, GFLOPs per face and latency per face in seconds."""
+    params = sum(param.numel() for param in gfpgan.parameters()) / 1e6
+    flop_counter = FlopCounterMode(display=False)
+    with flop_counter:
+        gfpgan.inference(x[:1], randomize_noise=False)
+    gfpgan.inference(x, randomize_noise=False)  # warm up
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        gfpgan.inference(x, randomize_noise=False)
+    latency = (time.perf_counter() - start) / num_iters / x.size(0)
+    return params, flop_counter.get_total_flops() / 1e9, latency
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, help='Path to the GFPGANv1Clean model')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('-i', '--input', type=str, default='inputs/cropped_faces', help='Aligned calibration faces')
+    parser.add_argument('--eval_input', type=str, default=None, help='Aligned faces for the report. Default: input')
+    parser.add_argument('-o', '--output', type=str, default='experiments/pretrained_models/GFPGAN_pruned.pth')
+    parser.add_argument('--keep_ratio', type=float, default=0.5, help='Ratio of channels to keep in each group')
+    parser.add_argument(
+        '--sft_keep_ratio',
+        type=float,
+        default=None,
+        help='Ratio of the SFT branch channels to keep. Default: --keep_ratio')
+    parser.add_argument('--min_channels', type=int, default=8)
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_iters', type=int, default=3)
+    args = parser.parse_args()
+
+    gfpgan_opt = dict(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=args.channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    gfpgan = GFPGANv1Clean(**gfpgan_opt)
+    loadnet = torch.load(args.model_path, map_location='cpu')
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    gfpgan.eval()
+
+    faces = read_faces(args.input)
+    if not faces:
+        raise ValueError(f'No faces in {args.input}.')
+    eval_faces = read_faces(args.eval_input) if args.eval_input is not None else faces
+
+    # rank and prune
+    importance = compute_channel_importance(gfpgan, batches(faces, args.batch_size))
+    sft_keep_ratio = args.keep_ratio if args.sft_keep_ratio is None else args.sft_keep_ratio
+    keep_ratio = dict(
+        unet=args.keep_ratio,
+        down=args.keep_ratio,
+        up=args.keep_ratio,
+        condition_scale=sft_keep_ratio,
+        condition_shift=sft_keep_ratio)
+    pruned, channel_map = prune_gfpgan(gfpgan, gfpgan_opt, importance, keep_ratio, args.min_channels)
+
+    # save the checkpoint and the architecture description
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    torch.save({'params_ema': pruned.state_dict()}, args.output)
+    arch_path = f'{os.path.splitext(args.output)[0]}.yml'
+    with open(arch_path, 'w') as f:
+        yaml.safe_dump({'network_g': {'type': 'GFPGANv1Clean', **gfpgan_opt, 'channel_map': channel_map}}, f)
+    print(f'Pruned model: {args.output}, architecture: {arch_path}')
+
+    # report
+    original_map = get_channel_map(gfpgan)
+    print('Channels (original -> pruned):')
+    for name, channels in channel_map.items():
+        if isinstance(channels, dict):
+            changes = [f'{key}: {original_map[name][key]} -> {value}' for key, value in channels.items()]
+        else:
+            changes = [f'{before} -> {after}' for before, after in zip(original_map[name], channels)]
+        print(f'  {name}: ' + ', '.join(changes))
+
+    x = faces2tensor(eval_faces[:args.batch_size])
+    ref_faces = restore(gfpgan, eval_faces, args.batch_size)
+    restored_faces = restore(pruned, eval_faces, args.batch_size)
+    psnr = np.mean([calculate_psnr(face, ref, crop_border=0) for face, ref in zip(restored_faces, ref_faces)])
+    ssim = np.mean([calculate_ssim(face, ref, crop_border=0) for face, ref in zip(restored_faces, ref_faces)])
+    print(f'{"model":<10}{"params M":>10}{"GFLOPs":>10}{"ms/face":>10}{"speedup":>10}')
+    results = {'original': measure(gfpgan, x, args.num_iters), 'pruned': measure(pruned, x, args.num_iters)}
+    for name, (params, gflops, latency) in results.items():
+        print(f'{name:<10}{params:>10.1f}{gflops:>10.1f}{latency * 1000:>10.1f}'
+              f'{results["original"][2] / latency:>10.2f}')
+    print(f'Pruned vs original outputs on {len(eval_faces)} faces: PSNR {psnr:.2f} dB, SSIM {ssim:.4f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""Post-training int8 quantization of GFPGANv1Clean, with calibration faces.
+
+The U-Net encoder/decoder and the SFT condition branches are quantized statically (int8 weights and activations). The
+linear layers are quantized dynamically. The modulated convs of the StyleGAN2 decoder stay in fp32 (``dynamic``), or
+their weights are stored in int8 (``weight_only``), which halves the checkpoint size but not the latency.
+
+It reports the latency and the drift (PSNR and, if the lpips package is installed, LPIPS) against the fp32 model.
+
+Examples:
+    python scripts/quantize_gfpgan.py --model_path experiments/pretrained_models/GFPGANv1.3.pth \
+        --save_path experiments/pretrained_models/GFPGANv1.3_int8.pth
+    python inference_gfpgan.py -i inputs/whole_imgs -v 1.3 \
+        --model_path experiments/pretrained_models/GFPGANv1.3_int8.pth
+"""
+import argparse
+import copy
+import cv2
+import glob
+import numpy as np
+import os
+import time
+import torch
+from basicsr.metrics import calculate_psnr
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.quantization import DECODER_MODES, quantize_gfpgan, save_quantized_gfpgan
+from gfpgan.utils import faces2tensor, tensor2faces
+
+
+def read_faces(folder, size=512):
+    faces = []
+    for path in sorted(glob.glob(os.path.join(folder, '*'))):
+        img = cv2.imread(path, cv2.IMREAD_COLOR)
+        if img is None:
+            continue
+        faces.append(cv2.resize(img, (size, size), interpolation=cv2.INTER_LINEAR))
+    return faces
+
+
+@torch.no_grad()
+def restore(gfpgan, faces, batch_size):
+    restored_faces = []
+    for start in range(0, len(faces), batch_size):
+        output = gfpgan(faces2tensor(faces[start:start + batch_size]), return_rgb=False, randomize_noise=False)[0]
+        restored_faces.extend(tensor2faces(output))
+    return restored_faces
+
+
+@torch.no_grad()
+def measure_latency(gfpgan, faces, batch_size, num_iters):
+    x = faces2tensor(faces[:batch_size])
+    gfpgan(x, return_rgb=False, randomize_noise=False)  # warm up
+    start = time.perf_counter()
+    for _ in range(num_iters):
+        gfpgan(x, return_rgb=False, randomize_noise=False)
+    return (time.perf_counter() - start) / num_iters / x.size(0)
+
+
+def get_lpips_fn():
+    try:
+        import lpips
+    except ImportError:
+        return None
+    lpips_model = lpips.LPIPS(net='alex', verbose=False).eval()
+
+    def lpips_fn(face, ref_face):
+        # lpips takes RGB tensors in [-1, 1]
+        with torch.no_grad():
+            return lpips_model(faces2tensor([face]), faces2tensor([ref_face])).item()
+
+    return lpips_fn
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_path', type=str, help='Path to the fp32 GFPGANv1Clean model')
+    parser.add_argument('--channel_multiplier', type=int, default=2)
+    parser.add_argument('--save_path', type=str, help='Path to the int8 model')
+    parser.add_argument(
+        '--calib_folder', type=str, default='inputs/cropped_faces', help='Aligned faces for calibration')
+    parser.add_argument(
+        '--eval_folder', type=str, default=None, help='Aligned faces for the report. Default: the calibration faces')
+    parser.add_argument(
+        '--decoder_mode',
+        type=str,
+        default='dynamic',
+        choices=DECODER_MODES,
+        help='Quantization of the StyleGAN2 decoder. Default: dynamic')
+    parser.add_argument('--backend', type=str, default='x86', help='Quantized engine: x86 | fbgemm | qnnpack')
+    parser.add_argument('--batch_size', type=int, default=4)
+    parser.add_argument('--num_iters', type=int, default=5, help='Number of iterations to measure the latency')
+    args = parser.parse_args()
+
+    gfpgan = GFPGANv1Clean(
+        out_size=512,
+        num_style_feat=512,
+        channel_multiplier=args.channel_multiplier,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=8,
+        input_is_latent=True,
+        different_w=True,
+        narrow=1,
+        sft_half=True)
+    loadnet = torch.load(args.model_path, map_location='cpu')
+    keyname = 'params_ema' if 'params_ema' in loadnet else 'params'
+    gfpgan.load_state_dict(loadnet[keyname], strict=True)
+    gfpgan.eval()
+
+    calib_faces = read_faces(args.calib_folder)
+    if not calib_faces:
+        raise ValueError(f'No calibration faces in {args.calib_folder}.')
+    eval_faces = calib_faces if args.eval_folder is None else read_faces(args.eval_folder)
+    print(f'Calibrate with {len(calib_faces)} faces.')
+    calib_batches = [
+        faces2tensor(calib_faces[start:start + args.batch_size])
+        for start in range(0, len(calib_faces), args.batch_size)
+    ]
+    gfpgan_int8 = quantize_gfpgan(
+        copy.deepcopy(gfpgan), calib_batches, decoder_mode=args.decoder_mode, backend=args.backend)
+    quant_config = dict(
+        arch='clean',
+        channel_multiplier=args.channel_multiplier,
+        decoder_mode=args.decoder_mode,
+        backend=args.backend,
+        input_size=512)
+    save_quantized_gfpgan(gfpgan_int8, args.save_path, quant_config)
+    print(f'Save to {args.save_path} ({os.path.getsize(args.save_path) / 2**20:.1f} MB).')
+
+    # report
+    ref_faces = restore(gfpgan, eval_faces, args.batch_size)
+    int8_faces = restore(gfpgan_int8, eval_faces, args.batch_size)
+    psnr = np.mean([calculate_psnr(face, ref, crop_border=0) for face, ref in zip(int8_faces, ref_faces)])
+    lpips_fn = get_lpips_fn()
+    batch_size = min(args.batch_size, len(eval_faces))
+    latency_fp32 = measure_latency(gfpgan, eval_faces, batch_size, args.num_iters)
+    latency_int8 = measure_latency(gfpgan_int8, eval_faces, batch_size, args.num_iters)
+
+    print(f'{"model":<8}{"ms/face":>10}{"speedup":>10}{"PSNR":>10}{"LPIPS":>10}')
+    print(f'{"fp32":<8}{latency_fp32 * 1000:>10.1f}{1:>10.2f}{"inf":>10}{0:>10.4f}')
+    if lpips_fn is None:
+        lpips_str = 'n/a'
+    else:
+        lpips_str = f'{np.mean([lpips_fn(face, ref) for face, ref in zip(int8_faces, ref_faces)]):.4f}'
+    print(f'{"int8":<8}{latency_int8 * 1000:>10.1f}{latency_fp32 / latency_int8:>10.2f}{psnr:>10.2f}{lpips_str:>10}')
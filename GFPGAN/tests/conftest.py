@@ -0,0 +1,52 @@
+import pytest
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.noise import get_noise_convs
+
+
+def build_tiny_gfpgan(arch_cls=GFPGANv1Clean,
+                      out_size=32,
+                      narrow=0.25,
+                      random_biases=False,
+                      noise_strengths=None,
+                      **kwargs):
+    """Build a tiny GFPGAN model in eval mode, with the seed 0.
+
+    Args:
+        arch_cls (type): The GFPGAN arch. Default: GFPGANv1Clean.
+        out_size (int): The output size. Default: 32.
+        narrow (float): The channel ratio. Default: 0.25.
+        random_biases (bool): Draw the biases and the noise strengths in [-0.5, 0.5], so that they matter.
+            Default: False.
+        noise_strengths (list[float] | None): The noise strengths of the StyleGAN2 decoder of a GFPGANv1Clean.
+            Default: None.
+        kwargs: Other options of the arch, e.g., resample_kernel.
+    """
+    torch.manual_seed(0)
+    gfpgan = arch_cls(
+        out_size=out_size,
+        num_style_feat=32,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=2,
+        input_is_latent=True,
+        different_w=True,
+        narrow=narrow,
+        sft_half=True,
+        **kwargs).eval()
+    if random_biases:
+        for name, param in gfpgan.named_parameters():
+            if param.ndim <= 1 or name.endswith('bias'):
+                param.data.uniform_(-0.5, 0.5)
+    if noise_strengths is not None:
+        for conv, strength in zip(get_noise_convs(gfpgan.stylegan_decoder), noise_strengths):
+            conv.weight.data.fill_(strength)
+    return gfpgan
+
+
+@pytest.fixture
+def tiny_gfpgan():
+    """The factory of tiny GFPGAN models, see :func:`build_tiny_gfpgan`."""
+    return build_tiny_gfpgan
@@ -0,0 +1,95 @@
+import cv2
+import math
+import numpy as np
+import torch
+import yaml
+from basicsr.data import degradations
+
+from gfpgan.data.batch_degradation import BatchDegradation
+from gfpgan.data.ffhq_degradation_dataset import FFHQDegradationDataset
+
+
+def load_opt():
+    with open('tests/data/test_ffhq_degradation_dataset.yml', mode='r') as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def to_tensor(imgs):
+    """BGR (h, w, 3) images in [0, 1] to RGB (b, 3, h, w)."""
+    return torch.from_numpy(np.stack(imgs)[..., ::-1].transpose(0, 3, 1, 2).copy()).float()
+
+
+def test_batch_degradation_ops():
+    """Compare the ops with the cv2 ops of the per-sample path."""
+    np.random.seed(0)
+    imgs = [np.random.rand(48, 64, 3).astype(np.float32) for _ in range(2)]
+    kernels = [
+        degradations.random_mixed_kernels(['iso', 'aniso'], [0.5, 0.5], 21, [0.1, 10], [0.1, 10], [-math.pi, math.pi])
+        for _ in range(2)
+    ]
+    blurred = BatchDegradation.blur(to_tensor(imgs), torch.from_numpy(np.stack(kernels)).float())
+    expected = to_tensor([cv2.filter2D(img, -1, kernel) for img, kernel in zip(imgs, kernels)])
+    torch.testing.assert_close(blurred, expected, atol=1e-5, rtol=1e-5)
+
+    # the whole degradation without noise and colors: blur, resize, jpeg, resize
+    opt = load_opt()
+    opt.update(blur_kernel_size=21, color_jitter_prob=None, color_jitter_pt_prob=None, gray_prob=None)
+    degradation = BatchDegradation(opt)
+    params = degradation.sample_params(2)
+    params['noise_sigmas'] = None
+    lq, gt = degradation(to_tensor(imgs) * 2 - 1, params)
+    assert torch.equal(gt, to_tensor(imgs) * 2 - 1)
+    expected = []
+    for img, kernel, scale, quality in zip(imgs, params['kernels'], params['scales'], params['jpeg_qualities']):
+        img_lq = cv2.resize(cv2.filter2D(img, -1, kernel), (int(64 // scale), int(48 // scale)), cv2.INTER_LINEAR)
+        img_lq = np.round(np.clip(img_lq, 0, 1) * 255).astype(np.uint8)
+        _, encimg = cv2.imencode('.jpg', img_lq, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        img_lq = np.float32(cv2.imdecode(encimg, 1)) / 255.
+        img_lq = cv2.resize(img_lq, (64, 48), interpolation=cv2.INTER_LINEAR)
+        expected.append(np.clip((img_lq * 255.0).round(), 0, 255) / 255.)
+    assert (lq - (to_tensor(expected) * 2 - 1)).abs().mean() < 1 / 255
+
+
+def degrade(img_gt, opt):
+    """The per-sample degradation of FFHQDegradationDataset, with an int JPEG quality for the recent cv2."""
+    h, w, _ = img_gt.shape
+    kernel = degradations.random_mixed_kernels(
+        opt['kernel_list'],
+        opt['kernel_prob'],
+        opt['blur_kernel_size'],
+        opt['blur_sigma'],
+        opt['blur_sigma'], [-math.pi, math.pi],
+        noise_range=None)
+    img_lq = cv2.filter2D(img_gt, -1, kernel)
+    scale = np.random.uniform(opt['downsample_range'][0], opt['downsample_range'][1])
+    img_lq = cv2.resize(img_lq, (int(w // scale), int(h // scale)), interpolation=cv2.INTER_LINEAR)
+    img_lq = degradations.random_add_gaussian_noise(img_lq, opt['noise_range'])
+    quality = int(np.random.uniform(opt['jpeg_range'][0], opt['jpeg_range'][1]))
+    _, encimg = cv2.imencode('.jpg', img_lq * 255., [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    img_lq = np.float32(cv2.imdecode(encimg, 1)) / 255.
+    img_lq = cv2.resize(img_lq, (w, h), interpolation=cv2.INTER_LINEAR)
+    return np.clip((img_lq * 255.0).round(), 0, 255) / 255.
+
+
+def test_batch_degradation_statistics():
+    """The lq images of the batched path have the statistics of the per-sample path."""
+    opt = load_opt()
+    opt.update(use_hflip=False, color_jitter_prob=None, color_jitter_pt_prob=None, gray_prob=None)
+    dataset = FFHQDegradationDataset(dict(opt, batch_degradation=True))
+    batch = dataset[0]
+    assert set(batch.keys()) == {'gt', 'gt_path'} and batch['gt'].shape == (3, 512, 512)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    img_gt = cv2.imread(batch['gt_path']).astype(np.float32) / 255.
+    lq = to_tensor([degrade(img_gt, opt) for _ in range(32)]) * 2 - 1
+    gt = batch['gt'].unsqueeze(0).repeat(32, 1, 1, 1)
+    batch_lq, _ = BatchDegradation(opt)(gt)
+    assert batch_lq.shape == gt.shape and batch_lq.min() >= -1 and batch_lq.max() <= 1
+
+    # mean color, error to the gt, and high frequencies
+    np.testing.assert_allclose(batch_lq.mean().item(), lq.mean().item(), atol=0.02)
+    np.testing.assert_allclose((batch_lq - gt).abs().mean().item(), (lq - gt).abs().mean().item(), rtol=0.2)
+    grad = (lq[..., 1:] - lq[..., :-1]).abs().mean().item()
+    batch_grad = (batch_lq[..., 1:] - batch_lq[..., :-1]).abs().mean().item()
+    np.testing.assert_allclose(batch_grad, grad, rtol=0.3)
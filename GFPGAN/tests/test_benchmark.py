@@ -0,0 +1,37 @@
+from gfpgan.benchmark import compare_results, get_cases, run_benchmark
+
+
+def test_get_cases():
+    cases = get_cases(['GFPGANv1Clean', 'FacialComponentDiscriminator'], [256, 512], [1], [1, 2], [0.5, 1])
+    assert len([case for case in cases if case['arch'] == 'GFPGANv1Clean']) == 8
+    # the discriminator ignores the channel settings
+    assert [case for case in cases if case['arch'] == 'FacialComponentDiscriminator'] == [
+        dict(arch='FacialComponentDiscriminator', out_size=size, batch_size=1, channel_multiplier=None, narrow=None)
+        for size in (256, 512)
+    ]
+
+
+def test_run_benchmark():
+    cases = [
+        dict(arch='StyleGAN2GeneratorClean', out_size=32, batch_size=2, channel_multiplier=1, narrow=0.25),
+        dict(arch='Unknown', out_size=32, batch_size=1, channel_multiplier=1, narrow=1)
+    ]
+    results = run_benchmark(cases, num_iters=2, isolate=False)
+    assert results['meta']['num_iters'] == 2
+    result, failed = results['results']
+    assert result['params_m'] > 0 and 0 < result['latency_min_ms'] <= result['latency_ms']
+    assert result['throughput'] > 0 and result['peak_alloc_mb'] > 0 and 'peak_rss_mb' not in result
+    assert failed['error'].startswith('ValueError: Wrong arch')
+
+    # a slower or failing case is a regression
+    baseline = {'results': [dict(result, latency_ms=result['latency_ms'] / 2), dict(failed)]}
+    del baseline['results'][1]['error']
+    baseline['results'][1]['latency_ms'] = 1
+    comparisons = compare_results(results, baseline, {'latency_ms': 0.5, 'peak_alloc_mb': 0.1})
+    assert [(c['arch'], c['metric'], c['regression']) for c in comparisons] == [
+        ('StyleGAN2GeneratorClean', 'latency_ms', True),
+        ('StyleGAN2GeneratorClean', 'peak_alloc_mb', False),
+        ('Unknown', 'error', True),
+    ]
+    assert abs(comparisons[0]['ratio'] - 2) < 1e-6
+    assert not any(c['regression'] for c in compare_results(results, results, {'latency_ms': 0, 'peak_alloc_mb': 0}))
@@ -0,0 +1,55 @@
+import cv2
+import numpy as np
+import pytest
+from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+
+from gfpgan.compositor import FaceCompositor
+
+
+def get_paste_inputs():
+    rng = np.random.default_rng(0)
+    img = cv2.GaussianBlur(rng.integers(0, 256, (120, 160, 3), dtype=np.uint8), (5, 5), 0)
+    restored_faces, affine_matrices = [], []
+    # the last face is partly out of the image, and the first two faces overlap
+    for center_x, center_y, angle, scale in [(40, 40, 10, 4), (60, 50, -20, 5), (150, 110, 5, 6)]:
+        affine_matrix = cv2.getRotationMatrix2D((center_x, center_y), angle, scale)
+        affine_matrix[:, 2] += (64 - center_x, 64 - center_y)
+        affine_matrices.append(affine_matrix)
+        restored_faces.append(rng.integers(0, 256, (128, 128, 3), dtype=np.uint8))
+    return img, restored_faces, affine_matrices
+
+
+def facexlib_paste(img, restored_faces, affine_matrices, upscale):
+    # only the attributes used by get_inverse_affine and paste_faces_to_input_image, without loading any model
+    face_helper = object.__new__(FaceRestoreHelper)
+    face_helper.upscale_factor = upscale
+    face_helper.face_size = (128, 128)
+    face_helper.use_parse = False
+    face_helper.input_img = img
+    face_helper.affine_matrices = affine_matrices
+    face_helper.restored_faces = restored_faces
+    face_helper.inverse_affine_matrices = []
+    face_helper.get_inverse_affine(None)
+    return face_helper.paste_faces_to_input_image()
+
+
+@pytest.mark.parametrize('backend', ['numpy', 'torch'])
+@pytest.mark.parametrize('upscale', [1, 2])
+def test_face_compositor(backend, upscale):
+    img, restored_faces, affine_matrices = get_paste_inputs()
+    expected = facexlib_paste(img, restored_faces, affine_matrices, upscale).astype(np.int32)
+
+    compositor = FaceCompositor(upscale, backend=backend)
+    output = compositor.paste(img, restored_faces, affine_matrices)
+    assert output.shape == expected.shape and output.dtype == np.uint8
+    diff = np.abs(output.astype(np.int32) - expected)
+    assert diff.max() <= 2
+    assert diff.mean() < 0.2
+
+    # no face
+    output = compositor.paste(img, [], [])
+    assert np.array_equal(output, cv2.resize(img, output.shape[1::-1], interpolation=cv2.INTER_LANCZOS4))
+
+    # wrong backend
+    with pytest.raises(ValueError):
+        FaceCompositor(upscale, backend='cuda')
@@ -0,0 +1,35 @@
+import os
+import pytest
+import torch
+
+from gfpgan.engine import InferenceEngine
+
+
+def test_inference_engine(tmp_path, tiny_gfpgan):
+    """Test InferenceEngine with the eager and script engines."""
+    x = torch.rand(3, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        expected = tiny_gfpgan()(x, return_rgb=False, randomize_noise=False)[0]
+
+    # eager, with random noise
+    engine = InferenceEngine(tiny_gfpgan(), engine='eager', input_size=32)
+    output = engine(x)
+    assert output.shape == (3, 3, 32, 32) and output.dtype == torch.float32
+
+    # script, with fixed noise and channels_last
+    engine = InferenceEngine(
+        tiny_gfpgan(), engine='script', channels_last=True, cache_dir=str(tmp_path), cache_key='test', input_size=32)
+    engine.warmup((1, 3))
+    assert sorted(engine._traced) == [1, 3]
+    assert len(os.listdir(tmp_path)) == 2
+    assert torch.allclose(engine(x), expected, atol=1e-4)
+    assert torch.allclose(engine(x[0:1]), expected[0:1], atol=1e-4)
+
+    # load the traced modules from the cache
+    engine = InferenceEngine(
+        tiny_gfpgan(), engine='script', channels_last=True, cache_dir=str(tmp_path), cache_key='test', input_size=32)
+    assert torch.allclose(engine(x), expected, atol=1e-4)
+    assert len(os.listdir(tmp_path)) == 2
+
+    with pytest.raises(ValueError):
+        InferenceEngine(tiny_gfpgan(), engine='onnx')
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import torch
+
+from gfpgan.data.facial_components import (component_locations, components_from_dict, components_from_landmarks,
+                                           flip_components, iter_json_items, load_components, load_ffhq_landmarks)
+
+
+def legacy_locations(components_bbox, hflip, out_size=512, eye_enlarge_ratio=1.4):
+    """The locations of the former dict-based get_component_coordinates."""
+    components_bbox = {part: list(value) for part, value in components_bbox.items()}
+    if hflip:
+        components_bbox['left_eye'], components_bbox['right_eye'] = components_bbox['right_eye'], components_bbox[
+            'left_eye']
+        for part in components_bbox:
+            components_bbox[part][0] = out_size - components_bbox[part][0]
+    locations = []
+    for part in ['left_eye', 'right_eye', 'mouth']:
+        mean = np.array(components_bbox[part][0:2])
+        half_len = components_bbox[part][2] * (eye_enlarge_ratio if 'eye' in part else 1)
+        locations.append(np.hstack((mean - half_len + 1, mean + half_len)))
+    return np.stack(locations)
+
+
+def test_facial_components():
+    components_dict = torch.load('tests/data/test_eye_mouth_landmarks.pth', weights_only=False)
+    components = load_components('tests/data/test_eye_mouth_landmarks.npy')
+    assert components.shape == (1, 3, 3) and components.dtype == np.float32
+    np.testing.assert_array_equal(components_from_dict(components_dict), components)
+    # the legacy pth files are converted
+    np.testing.assert_array_equal(load_components('tests/data/test_eye_mouth_landmarks.pth'), components)
+
+    for hflip in (False, True):
+        item = flip_components(components[0], 512) if hflip else components[0]
+        np.testing.assert_allclose(
+            component_locations(item, 1.4), legacy_locations(components_dict['00000000'], hflip), rtol=1e-5)
+    # the flips do not modify the components, and are vectorized
+    flipped = flip_components(components, 512)
+    np.testing.assert_allclose(flip_components(flipped, 512), components)
+    np.testing.assert_array_equal(components, np.load('tests/data/test_eye_mouth_landmarks.npy'))
+    assert component_locations(np.repeat(flipped, 4, axis=0)).shape == (4, 3, 4)
+
+
+def test_components_from_ffhq_landmarks(tmp_path):
+    landmarks = np.random.uniform(0, 1024, (5, 68, 2))
+    metadata = {
+        str(idx): dict(category='training', image=dict(file_path=f'images1024x1024/{idx:05d}.png', face_landmarks=lm))
+        for idx, lm in enumerate(landmarks.tolist())
+    }
+    json_path = str(tmp_path / 'ffhq-dataset-v2.json')
+    with open(json_path, 'w') as f:
+        json.dump(metadata, f, indent=2)
+
+    # the chunks split the items at any position
+    for chunk_size in (7, 100, 2**20):
+        assert [key for key, _ in iter_json_items(json_path, chunk_size)] == list(metadata.keys())
+        np.testing.assert_allclose(load_ffhq_landmarks(json_path, chunk_size), landmarks, rtol=1e-6)
+
+    # the former per-item computation of scripts/parse_landmark.py
+    components = components_from_landmarks(load_ffhq_landmarks(json_path), scale=0.5)
+    for lm, item in zip(landmarks * 0.5, components):
+        for indices, component in zip((range(36, 42), range(42, 48), range(48, 68)), item):
+            mean = np.mean(lm[indices], 0)
+            half_len = np.max((np.max(np.max(lm[indices], 0) - np.min(lm[indices], 0)) / 2, 16))
+            np.testing.assert_allclose(component, [mean[0], mean[1], half_len], rtol=1e-5)
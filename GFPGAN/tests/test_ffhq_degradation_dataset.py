@@ -68,7 +68,7 @@ def test_ffhq_degradation_dataset():
 
     # ------------------ test with crop_components -------------------- #
     opt['crop_components'] = True
-    opt['component_path'] = 'tests/data/test_eye_mouth_landmarks.pth'
+    opt['component_path'] = 'tests/data/test_eye_mouth_landmarks.npy'
     opt['eye_enlarge_ratio'] = 1.4
     opt['gt_gray'] = True
     opt['io_backend'] = dict(type='lmdb')
@@ -79,15 +79,13 @@ def test_ffhq_degradation_dataset():
     # test __getitem__
     result = dataset.__getitem__(0)
     # check returned keys
-    expected_keys = ['gt', 'lq', 'gt_path', 'loc_left_eye', 'loc_right_eye', 'loc_mouth']
+    expected_keys = ['gt', 'lq', 'gt_path', 'locations']
     assert set(expected_keys).issubset(set(result.keys()))
     # check shape and contents
     assert result['gt'].shape == (3, 512, 512)
     assert result['lq'].shape == (3, 512, 512)
     assert result['gt_path'] == '00000000'
-    assert result['loc_left_eye'].shape == (4, )
-    assert result['loc_right_eye'].shape == (4, )
-    assert result['loc_mouth'].shape == (4, )
+    assert result['locations'].shape == (3, 4)
 
     # ------------------ lmdb backend should have paths ends with lmdb -------------------- #
     with pytest.raises(ValueError):
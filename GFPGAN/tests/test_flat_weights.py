@@ -0,0 +1,89 @@
+import pytest
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.flat_weights import is_flat_weights, load_flat_weights, save_flat_weights
+from gfpgan.utils import build_gfpgan, load_gfpgan
+
+
+def test_save_load_flat_weights(tmp_path):
+    """Test save_flat_weights and load_flat_weights with different dtypes and shapes."""
+    state_dict = {
+        'conv.weight': torch.randn(4, 3, 3, 3),
+        'conv.bias': torch.randn(4).half(),
+        'bf16': torch.randn(5).bfloat16(),
+        'scalar': torch.tensor(3.5),
+        'index': torch.arange(7),
+        'mask': torch.tensor([True, False]),
+        'empty': torch.zeros(0, 3)
+    }
+    path = str(tmp_path / 'weights.gfw')
+    save_flat_weights(state_dict, path, metadata={'arch': 'test'})
+    assert is_flat_weights(path)
+    torch.save(state_dict, str(tmp_path / 'weights.pth'))
+    assert not is_flat_weights(str(tmp_path / 'weights.pth'))
+
+    loaded, metadata = load_flat_weights(path)
+    assert metadata == {'arch': 'test'}
+    assert list(loaded) == list(state_dict)
+    for name, tensor in state_dict.items():
+        assert loaded[name].dtype == tensor.dtype and loaded[name].shape == tensor.shape
+        assert torch.equal(loaded[name], tensor)
+    # the mapping is private: writing to the tensors does not change the file
+    loaded['conv.weight'].zero_()
+    assert torch.equal(load_flat_weights(path)[0]['conv.weight'], state_dict['conv.weight'])
+
+    with pytest.raises(ValueError):
+        load_flat_weights(str(tmp_path / 'weights.pth'))
+
+
+def test_load_flat_weights_on_meta_model(tmp_path):
+    """Test building GFPGANv1Clean on the meta device and assigning the flat weights."""
+    kwargs = dict(
+        out_size=32,
+        num_style_feat=32,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=False,
+        num_mlp=2,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True)
+    gfpgan = GFPGANv1Clean(**kwargs).eval()
+    path = str(tmp_path / 'gfpgan.gfw')
+    save_flat_weights(gfpgan.state_dict(), path)
+
+    with torch.device('meta'):
+        gfpgan_flat = GFPGANv1Clean(**kwargs)
+    gfpgan_flat.load_state_dict(load_flat_weights(path)[0], strict=True, assign=True)
+    gfpgan_flat.eval()
+    x = torch.rand(1, 3, 32, 32)
+    with torch.no_grad():
+        expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+        output = gfpgan_flat(x, return_rgb=False, randomize_noise=False)[0]
+    assert torch.equal(output, expected)
+
+
+def test_load_gfpgan_flat_weights_original(tmp_path):
+    """Test the flat weights of the original arch, whose upfirdn kernels are not in the state dict."""
+    gfpgan = build_gfpgan('original', channel_multiplier=1, narrow=0.125).eval()
+    path = str(tmp_path / 'gfpgan.gfw')
+    save_flat_weights(gfpgan.state_dict(), path)
+
+    gfpgan_flat, quantized = load_gfpgan(path, 'original', channel_multiplier=1, narrow=0.125)
+    assert not quantized and not gfpgan_flat.training
+    state_dict = gfpgan.state_dict()
+    for name, tensor in gfpgan_flat.state_dict().items():
+        assert torch.equal(tensor, state_dict[name])
+    # no tensor attribute is left on the meta device
+    tensors = [value for module in gfpgan_flat.modules() for value in vars(module).values() if torch.is_tensor(value)]
+    tensors += list(gfpgan_flat.parameters()) + list(gfpgan_flat.buffers())
+    assert tensors and not any(tensor.is_meta for tensor in tensors)
+
+    if torch.cuda.is_available():  # the fused ops of basicsr
+        x = torch.rand(1, 3, 512, 512).cuda()
+        with torch.no_grad():
+            expected = gfpgan.cuda()(x, return_rgb=False, randomize_noise=False)[0]
+            output = gfpgan_flat.cuda()(x, return_rgb=False, randomize_noise=False)[0]
+        assert torch.allclose(output, expected)
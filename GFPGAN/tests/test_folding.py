@@ -0,0 +1,61 @@
+import copy
+import torch
+
+from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
+from gfpgan.archs.gfpganv1_arch import GFPGANv1
+from gfpgan.folding import (EQUAL_CONVS, EQUAL_LINEARS, MODULATED_CONVS, SCALED_ACTIVATIONS, bilinear_to_clean,
+                            fold_weights)
+
+
+def test_fold_weights(tiny_gfpgan):
+    gfpgan = tiny_gfpgan(GFPGANBilinear, random_biases=True)
+    folded = fold_weights(copy.deepcopy(gfpgan))
+    assert not any(isinstance(m, EQUAL_CONVS + EQUAL_LINEARS) for m in folded.modules())
+    # only the activations of the StyleConvs are kept
+    activations = [name for name, m in folded.named_modules() if isinstance(m, SCALED_ACTIVATIONS)]
+    assert all(name.endswith('.activate') for name in activations) and len(activations) == 7
+    assert all(m.scale == 1 for m in folded.modules() if isinstance(m, MODULATED_CONVS))
+
+    # the U-Net parts without the compiled ops: SFT branches, final linear and to RGB
+    feat = torch.randn(2, 64, 8, 8)
+    with torch.no_grad():
+        for name in ('condition_scale', 'condition_shift', 'toRGB'):
+            expected = getattr(gfpgan, name)[0](feat)
+            assert torch.allclose(getattr(folded, name)[0](feat), expected, atol=1e-5)
+        feat = torch.randn(2, 64 * 16)
+        assert torch.allclose(folded.final_linear(feat), gfpgan.final_linear(feat), atol=1e-5)
+
+    # the whole models, which need the compiled fused_act op of basicsr (gpu)
+    if torch.cuda.is_available():
+        x = torch.rand(2, 3, 32, 32).cuda() * 2 - 1
+        models = [
+            tiny_gfpgan(GFPGANBilinear, random_biases=True),
+            tiny_gfpgan(GFPGANv1, random_biases=True, resample_kernel=(1, 3, 3, 1))
+        ]
+        with torch.no_grad():
+            for gfpgan in models:
+                gfpgan = gfpgan.cuda()
+                expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+                output = fold_weights(gfpgan)(x, return_rgb=False, randomize_noise=False)[0]
+                assert torch.allclose(output, expected, atol=1e-4)
+
+
+def test_bilinear_to_clean(tiny_gfpgan):
+    gfpgan = tiny_gfpgan(GFPGANBilinear, random_biases=True)
+    state_dict = copy.deepcopy(gfpgan.state_dict())
+    clean = bilinear_to_clean(gfpgan, channel_multiplier=1, narrow=0.25)
+    assert clean.__class__.__name__ == 'GFPGANv1Clean'
+    # the source model is not modified
+    for name, tensor in gfpgan.state_dict().items():
+        assert torch.equal(tensor, state_dict[name]), name
+    feat = torch.randn(2, 64, 8, 8)
+    with torch.no_grad():
+        assert torch.allclose(clean.condition_scale[0](feat), gfpgan.condition_scale[0](feat), atol=1e-5)
+        assert torch.allclose(clean.toRGB[0](feat), gfpgan.toRGB[0](feat), atol=1e-5)
+
+    if torch.cuda.is_available():
+        x = torch.rand(2, 3, 32, 32).cuda() * 2 - 1
+        with torch.no_grad():
+            expected = gfpgan.cuda()(x, return_rgb=False, randomize_noise=False)[0]
+            output = clean.cuda()(x, return_rgb=False, randomize_noise=False)[0]
+        assert torch.allclose(output, expected, atol=1e-4)
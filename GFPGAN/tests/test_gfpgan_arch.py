@@ -2,6 +2,7 @@ import torch
 
 from gfpgan.archs.gfpganv1_arch import FacialComponentDiscriminator, GFPGANv1, StyleGAN2GeneratorSFT
 from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean, StyleGAN2GeneratorCSFT
+from gfpgan.memory import measure_peak_memory
 
 
 def test_stylegan2generatorsft():
@@ -201,3 +202,54 @@ def test_gfpganv1clean():
         assert output[1][0].shape == (1, 3, 8, 8)
         assert output[1][1].shape == (1, 3, 16, 16)
         assert output[1][2].shape == (1, 3, 32, 32)
+
+
+def test_gfpganv1clean_fuse_modulations():
+    """Test the fused style modulation of the CSFT decoder of GFPGANv1Clean."""
+    net = GFPGANv1Clean(
+        out_size=32,
+        num_style_feat=64,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=True,
+        num_mlp=2,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    img = torch.rand((2, 3, 32, 32), dtype=torch.float32)
+    with torch.no_grad():
+        output = net(img, randomize_noise=False)[0]
+        net.stylegan_decoder.fuse_modulations()
+        output_fused = net(img, randomize_noise=False)[0]
+    assert torch.allclose(output, output_fused, atol=1e-5)
+
+
+def test_gfpganv1clean_inference():
+    """The lean inference forward of GFPGANv1Clean gives the same outputs as forward, with a lower peak memory."""
+    torch.manual_seed(0)
+    net = GFPGANv1Clean(
+        out_size=64,
+        num_style_feat=64,
+        channel_multiplier=1,
+        decoder_load_path=None,
+        fix_decoder=True,
+        num_mlp=2,
+        input_is_latent=True,
+        different_w=True,
+        narrow=0.5,
+        sft_half=True).eval()
+    img = torch.rand((2, 3, 64, 64), dtype=torch.float32)
+    with torch.no_grad():
+        expected, peak_forward = measure_peak_memory(lambda: net(img, randomize_noise=False)[0])
+        output_lazy, peak_lazy = measure_peak_memory(lambda: net.inference(img, randomize_noise=False))
+        output = net.inference(img, randomize_noise=False, lazy_conditions=False)
+        # the same random noise
+        torch.manual_seed(1)
+        expected_random = net(img, return_rgb=False)[0]
+        torch.manual_seed(1)
+        output_random = net.inference(img)
+    assert torch.allclose(output, expected, atol=1e-5)
+    assert torch.allclose(output_lazy, expected, atol=1e-5)
+    assert torch.allclose(output_random, expected_random, atol=1e-5)
+    assert 0 < peak_lazy < peak_forward
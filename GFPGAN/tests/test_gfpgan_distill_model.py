@@ -0,0 +1,52 @@
+import tempfile
+import torch
+import yaml
+from torch import nn
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.models.gfpgan_distill_model import GFPGANDistillModel
+
+
+def test_gfpgan_distill_model():
+    with open('tests/data/test_gfpgan_distill_model.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+
+    # build model
+    model = GFPGANDistillModel(opt)
+    assert isinstance(model.net_g, GFPGANv1Clean)  # student
+    assert isinstance(model.net_teacher, GFPGANv1Clean)
+    assert all(not param.requires_grad for param in model.net_teacher.parameters())
+    # the conditions of the student are mapped to the channels of the teacher
+    assert len(model.net_adapter) == 8
+    assert isinstance(model.net_adapter[0], nn.Conv2d)
+    assert (model.net_adapter[0].in_channels, model.net_adapter[0].out_channels) == (64, 128)
+    assert len(model.optimizers) == 1
+
+    # ----------------- test optimize_parameters -------------------- #
+    gt = torch.rand((2, 3, 64, 64), dtype=torch.float32)
+    lq = torch.rand((2, 3, 64, 64), dtype=torch.float32)
+    model.feed_data(dict(gt=gt, lq=lq))
+    adapter_weight = model.net_adapter[0].weight.clone()
+    teacher_state = {k: v.clone() for k, v in model.net_teacher.state_dict().items()}
+    model.optimize_parameters(1)
+    assert model.output.shape == (2, 3, 64, 64)
+    expected_keys = ['l_out', 'l_g_pix']
+    expected_keys += [f'l_p_{2**i}' for i in range(3, 7)] + [f'l_cond_{2**i}' for i in range(3, 7)]
+    assert set(expected_keys) == set(model.log_dict.keys())
+    # the adapters are trained, the teacher is frozen
+    assert not torch.equal(model.net_adapter[0].weight, adapter_weight)
+    assert all(torch.equal(v, teacher_state[k]) for k, v in model.net_teacher.state_dict().items())
+    assert model.student_conditions == [] and model.teacher_conditions == []
+
+    # ----------------- test save -------------------- #
+    with tempfile.TemporaryDirectory() as tmpdir:
+        model.opt['path']['models'] = tmpdir
+        model.opt['path']['training_states'] = tmpdir
+        model.save(0, 1)
+        # the student checkpoint is loaded as a narrow GFPGANv1Clean
+        student = GFPGANv1Clean(**{k: v for k, v in opt['network_g'].items() if k != 'type'})
+        student.load_state_dict(torch.load(f'{tmpdir}/net_g_1.pth')['params_ema'], strict=True)
+
+    # ----------------- test the test function -------------------- #
+    model.test()
+    assert model.output.shape == (2, 3, 64, 64)
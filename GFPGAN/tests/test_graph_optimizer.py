@@ -0,0 +1,60 @@
+import copy
+import torch
+from torch import nn
+
+from gfpgan.archs.gfpgan_bilinear_arch import GFPGANBilinear
+from gfpgan.archs.gfpganv1_arch import ResUpBlock
+from gfpgan.folding import fold_weights
+from gfpgan.graph_optimizer import optimize_graph
+
+
+def test_optimize_graph_clean(tiny_gfpgan):
+    gfpgan = tiny_gfpgan(out_size=64, random_biases=True)
+    optimized = optimize_graph(copy.deepcopy(gfpgan))
+    assert all(block.skip_conv_first for block in optimized.conv_body_up)
+    assert not any(block.skip_conv_first for block in optimized.conv_body_down)
+    decoder = optimized.stylegan_decoder
+    assert all(to_rgb.bias is None for to_rgb in [decoder.to_rgb1, *decoder.to_rgbs[:-1]])
+
+    x = torch.rand(2, 3, 64, 64) * 2 - 1
+    with torch.no_grad():
+        expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+        assert torch.allclose(optimized(x, return_rgb=False, randomize_noise=False)[0], expected, atol=1e-5)
+        assert torch.allclose(optimized.inference(x, randomize_noise=False), expected, atol=1e-5)
+        # both execution strategies of the modulated convs apply the folded gain
+        for strategy in ('grouped', 'activation'):
+            for module in optimized.modules():
+                if type(module).__name__ == 'ModulatedConv2d':
+                    module.strategy = strategy
+            assert torch.allclose(optimized.inference(x, randomize_noise=False), expected, atol=1e-5)
+        # the random noise is the same under the same seed
+        torch.manual_seed(1)
+        expected = gfpgan.inference(x)
+        torch.manual_seed(1)
+        assert torch.allclose(optimized.inference(x), expected, atol=1e-5)
+
+    # applying it twice does not change the model
+    output = optimized.inference(x, randomize_noise=False)
+    optimize_graph(optimized)
+    assert torch.equal(optimized.inference(x, randomize_noise=False), output)
+
+
+def test_optimize_graph_bilinear(tiny_gfpgan):
+    gfpgan = optimize_graph(tiny_gfpgan(GFPGANBilinear, out_size=64, random_biases=True))
+    assert all(block.skip.conv_first and not block.conv2.conv_first for block in gfpgan.conv_body_up)
+
+    # the skip of the up blocks, without the compiled ops
+    block = ResUpBlock(16, 8)
+    x = torch.randn(2, 16, 8, 8)
+    with torch.no_grad():
+        expected = block.skip(x)
+        optimize_graph(block)
+        assert torch.allclose(block.skip(x), expected, atol=1e-5)
+
+        # the folded blocks
+        block = fold_weights(ResUpBlock(16, 8).eval())
+        expected = block(x)
+        optimize_graph(block)
+        assert isinstance(block.skip[0], nn.Conv2d) and isinstance(block.skip[1], nn.Upsample)
+        assert isinstance(block.conv2[0], nn.Upsample)  # the 3x3 conv does not commute
+        assert torch.allclose(block(x), expected, atol=1e-5)
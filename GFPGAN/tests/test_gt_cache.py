@@ -0,0 +1,57 @@
+import multiprocessing
+import numpy as np
+import os
+import pickle
+import torch
+import yaml
+
+from gfpgan.data.ffhq_degradation_dataset import FFHQDegradationDataset
+from gfpgan.data.gt_cache import SharedImageCache
+
+
+def put_image(cache, index, value):
+    cache.put(index, np.full(cache.img_shape, value, dtype=np.uint8))
+
+
+def test_shared_image_cache(tmp_path):
+    # the budget fits 2 of the 3 images
+    cache = SharedImageCache(3, (4, 5, 3), 2 * 61, path=str(tmp_path / 'cache.bin'))
+    assert len(cache) == 2 and os.path.getsize(cache.path) == 2 * 61
+    assert cache.get(0) is None
+    img = np.random.randint(0, 256, (4, 5, 3), dtype=np.uint8)
+    assert cache.put(0, img)
+    assert not cache.put(2, img)  # not in the hot subset
+    assert not cache.put(1, img[:2])  # another shape
+    cached = cache.get(0)
+    np.testing.assert_array_equal(cached, img)
+    cached[:] = 0  # a copy
+    np.testing.assert_array_equal(cache.get(0), img)
+    assert cache.get(2) is None and (cache.num_hits, cache.num_misses) == (2, 2)
+
+    # the workers write in the same file
+    assert pickle.loads(pickle.dumps(cache))._slots is None
+    process = multiprocessing.get_context('spawn').Process(target=put_image, args=(cache, 1, 7))
+    process.start()
+    process.join()
+    np.testing.assert_array_equal(cache.get(1), 7)
+
+    # the temporary file is removed by close
+    cache = SharedImageCache(3, (4, 5, 3), 10**6)
+    assert os.path.isfile(cache.path) and len(cache) == 3
+    cache.close()
+    assert not os.path.isfile(cache.path)
+
+
+def test_ffhq_degradation_dataset_gt_cache():
+    with open('tests/data/test_ffhq_degradation_dataset.yml', mode='r') as f:
+        opt = yaml.load(f, Loader=yaml.FullLoader)
+    opt.update(use_hflip=False, batch_degradation=True)
+    dataset = FFHQDegradationDataset(dict(opt, io_backend=dict(type='disk')))
+    cached_dataset = FFHQDegradationDataset(dict(opt, io_backend=dict(type='disk'), gt_cache_bytes=2**30))
+    assert len(cached_dataset.gt_cache) == len(dataset)
+
+    gt = dataset[0]['gt']
+    for _ in range(2):
+        assert torch.equal(cached_dataset[0]['gt'], gt)
+    assert (cached_dataset.gt_cache.num_hits, cached_dataset.gt_cache.num_misses) == (1, 1)
+    cached_dataset.gt_cache.close()
@@ -0,0 +1,80 @@
+import numpy as np
+import torch
+
+from gfpgan.archs.arcface_arch import ResNetArcFace
+from gfpgan.identity import EmbeddingCache, IdentityEmbedder, IdentityReport, gray_resize_for_identity
+
+
+def build_embedder(tmp_path, **kwargs):
+    torch.manual_seed(0)
+    model_path = str(tmp_path / 'arcface.pth')
+    torch.save(ResNetArcFace('IRBlock', (1, 1, 1, 1), use_se=False).state_dict(), model_path)
+    return IdentityEmbedder(model_path, device=torch.device('cpu'), layers=(1, 1, 1, 1), **kwargs)
+
+
+def test_identity_embedder(tmp_path):
+    """Test the batched embeddings and the similarities of ArcFace."""
+    embedder = build_embedder(tmp_path, batch_size=3)
+    faces = [np.random.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(5)]
+    faces.append(np.random.randint(0, 256, (32, 32, 3), dtype=np.uint8))  # any size
+
+    # the gray inputs of the training
+    face_t = torch.from_numpy(faces[0][:, :, ::-1].transpose(2, 0, 1) / 127.5 - 1).float().unsqueeze(0)
+    torch.testing.assert_close(embedder.preprocess(faces[:1]), gray_resize_for_identity(face_t))
+
+    embeddings = embedder.embed(faces)
+    assert embeddings.shape == (6, 512) and embeddings.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1, rtol=1e-5)
+    # the embeddings do not depend on the batches
+    np.testing.assert_allclose(embedder.embed(faces[3:4])[0], embeddings[3], atol=1e-5)
+
+    similarities = embedder.similarity(faces[:3], [faces[0], faces[2], faces[2]])
+    assert similarities.shape == (3, )
+    np.testing.assert_allclose(similarities[[0, 2]], 1, rtol=1e-5)
+    assert similarities[1] < 1 - 1e-4
+
+
+def test_embedding_cache(tmp_path):
+    """Test the persistent cache of the embeddings."""
+    cache = EmbeddingCache(str(tmp_path / 'cache'))
+    embedder = build_embedder(tmp_path, cache=cache)
+    faces = [np.random.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(3)]
+
+    # keys depend on the image content and the model
+    key = embedder.get_key(faces[0])
+    assert key == embedder.get_key(faces[0].copy())
+    assert key != embedder.get_key(255 - faces[0])
+    torch.save(ResNetArcFace('IRBlock', (1, 1, 1, 1), use_se=False).state_dict(), str(tmp_path / 'other.pth'))
+    other_embedder = IdentityEmbedder(str(tmp_path / 'other.pth'), device=torch.device('cpu'), layers=(1, 1, 1, 1))
+    assert key != other_embedder.get_key(faces[0])
+
+    expected = embedder.embed(faces[:2])
+    assert (cache.num_hits, cache.num_misses) == (0, 2)
+    embeddings = embedder.embed(faces)
+    assert (cache.num_hits, cache.num_misses) == (2, 3)
+    np.testing.assert_array_equal(embeddings[:2], expected)
+
+    # a new embedder with the same model reads the entries, corrupted entries are recomputed
+    with open(cache._path(embedder.get_key(faces[2])), 'wb') as f:
+        f.write(b'corrupted')
+    cache = EmbeddingCache(str(tmp_path / 'cache'))
+    embedder = build_embedder(tmp_path, cache=cache)
+    np.testing.assert_allclose(embedder.embed(faces), embeddings, atol=1e-6)
+    assert (cache.num_hits, cache.num_misses) == (2, 1)
+
+
+def test_identity_report(tmp_path):
+    embedder = build_embedder(tmp_path, batch_size=4)
+    report = IdentityReport(embedder, threshold=0.999)
+    faces = [np.random.randint(0, 256, (64, 64, 3), dtype=np.uint8) for _ in range(5)]
+    for idx, face in enumerate(faces):
+        restored_face = face if idx % 2 == 0 else faces[0]
+        report.add(f'face_{idx}', face, restored_face)
+    assert len(report.scores) == 4  # scored in batches of 2 pairs
+
+    report.save(str(tmp_path / 'report.csv'))
+    with open(tmp_path / 'report.csv') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'name,similarity' and len(lines) == 6
+    assert lines[1].startswith('face_0,1.0000')
+    assert report.summary().endswith('2 below 0.999: face_1, face_3')
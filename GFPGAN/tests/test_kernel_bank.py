@@ -0,0 +1,42 @@
+import cv2
+import json
+import numpy as np
+import os
+import pickle
+import torch
+
+from gfpgan.data.batch_degradation import BatchDegradation
+from gfpgan.data.kernel_bank import KernelBank, fft_blur
+
+
+def test_kernel_bank(tmp_path):
+    path = str(tmp_path / 'bank.npy')
+    bank = KernelBank(path, ['iso', 'aniso'], [0.7, 0.3], 21, [0.1, 10], num_kernels=1024)
+    assert len(bank) == 1024 and bank.bank.shape == (1024, 23, 21)
+    with open(str(tmp_path / 'bank.json')) as f:
+        assert json.load(f)['kernel_prob'] == [0.7, 0.3]
+    kernels = bank.get(np.arange(1024))
+    np.testing.assert_allclose(kernels.sum(axis=(1, 2)), 1, rtol=1e-4)
+    # the isotropic kernels are separable, the rotated anisotropic ones are not: the mixture follows kernel_prob
+    separable = bank.bank[:, 22].any(axis=1)
+    assert abs(separable.mean() - 0.7) < 0.05
+
+    img = np.random.rand(40, 48, 3).astype(np.float32)
+    for index in (np.flatnonzero(separable)[0], np.flatnonzero(~separable)[0]):
+        np.testing.assert_allclose(bank.filter2d(img, index), cv2.filter2D(img, -1, kernels[index]), atol=1e-5)
+    assert 0 <= bank.sample_indices() < 1024 and bank.sample_indices(8).shape == (8, )
+
+    # the workers map the file instead of receiving the kernels
+    assert pickle.loads(pickle.dumps(bank))._bank is None
+    # the same options reuse the bank, other ones build it again
+    mtime = os.path.getmtime(path)
+    assert KernelBank(path, ['iso', 'aniso'], [0.7, 0.3], 21, [0.1, 10], num_kernels=1024).bank.shape[0] == 1024
+    assert os.path.getmtime(path) == mtime
+    bank = KernelBank(path, ['iso'], [1], 21, [0.1, 10], num_kernels=16)
+    assert bank.bank.shape[0] == 16 and bank.bank[:, 22].any(axis=1).all()
+
+
+def test_fft_blur():
+    imgs = torch.rand(2, 3, 40, 48)
+    kernels = torch.rand(2, 41, 41)
+    torch.testing.assert_close(fft_blur(imgs, kernels), BatchDegradation.blur(imgs, kernels), atol=1e-4, rtol=1e-4)
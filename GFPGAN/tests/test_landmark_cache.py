@@ -0,0 +1,50 @@
+import numpy as np
+
+from gfpgan.landmark_cache import LandmarkCache
+
+
+def test_landmark_cache(tmp_path):
+    """Test the on-disk cache of landmarks and affine matrices."""
+    cache = LandmarkCache(str(tmp_path / 'cache'), save_faces=True)
+    img = np.random.randint(0, 256, (32, 32, 3), dtype=np.uint8)
+
+    # keys depend on the image content and the parameters
+    key = cache.get_key(img, only_center_face=False, eye_dist_threshold=5)
+    assert key == cache.get_key(img.copy(), eye_dist_threshold=5, only_center_face=False)
+    assert key != cache.get_key(img, only_center_face=True, eye_dist_threshold=5)
+    assert key != cache.get_key(img, only_center_face=False, eye_dist_threshold=10)
+    assert key != cache.get_key(255 - img, only_center_face=False, eye_dist_threshold=5)
+
+    # miss, put and hit
+    assert cache.get(key) is None
+    landmarks = [np.random.rand(5, 2) * 32 for _ in range(2)]
+    affine_matrices = [np.random.rand(2, 3) for _ in range(2)]
+    cropped_faces = [np.random.randint(0, 256, (16, 16, 3), dtype=np.uint8) for _ in range(2)]
+    cache.put(key, landmarks, affine_matrices, cropped_faces)
+    entry = cache.get(key)
+    assert len(entry['landmarks']) == 2
+    np.testing.assert_allclose(entry['landmarks'][1], landmarks[1], rtol=1e-6)
+    np.testing.assert_allclose(entry['affine_matrices'][0], affine_matrices[0])
+    np.testing.assert_array_equal(entry['cropped_faces'][1], cropped_faces[1])
+    assert (cache.num_hits, cache.num_misses) == (1, 1)
+
+    # images without faces
+    empty_key = cache.get_key(np.zeros((8, 8, 3), dtype=np.uint8))
+    cache.put(empty_key, [], [], [])
+    entry = cache.get(empty_key)
+    assert entry['landmarks'] == [] and entry['affine_matrices'] == []
+
+    # corrupted entries are removed
+    with open(cache._path(key), 'wb') as f:
+        f.write(b'broken')
+    assert cache.get(key) is None
+    assert cache.get(key) is None
+
+    # invalidation
+    cache.put(key, landmarks, affine_matrices)
+    cache.remove(key)
+    assert cache.get(key) is None
+    cache.put(key, landmarks, affine_matrices)
+    cache.clear()
+    assert cache.get(key) is None
+    assert cache.get(empty_key) is None
@@ -0,0 +1,53 @@
+import torch
+
+from gfpgan.engine import InferenceEngine
+from gfpgan.noise import NoiseBuffers, fold_noise, get_noise_convs
+
+
+def test_noise_buffers(tiny_gfpgan):
+    decoder = tiny_gfpgan().stylegan_decoder
+    noise_buffers = NoiseBuffers(decoder, seed=1)
+    noise = noise_buffers(2)
+    assert [tuple(n.shape) for n in noise] == [(2, 1, 4, 4), (2, 1, 8, 8), (2, 1, 8, 8), (2, 1, 16, 16), (2, 1, 16, 16),
+                                               (2, 1, 32, 32), (2, 1, 32, 32)]
+    # reused, and the same as without growing
+    assert noise_buffers(1)[3].data_ptr() == noise[3].data_ptr()
+    grown = noise_buffers(3)
+    assert noise_buffers.capacity == 3
+    expected = NoiseBuffers(decoder, seed=1)(3)
+    assert all(torch.equal(n, e) for n, e in zip(grown, expected))
+    assert torch.equal(grown[0][:2], noise[0])
+
+
+def test_fold_noise(tiny_gfpgan):
+    noise_strengths = [0, 1e-3, 0.5, 1e-4, 0.2, 0, 0.3]
+    gfpgan = tiny_gfpgan(noise_strengths=noise_strengths)
+    decoder = gfpgan.stylegan_decoder
+    x = torch.rand(2, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        # the folded layers give the same outputs as zero noise
+        noise = [torch.zeros(2, 1, 4, 4)] + [torch.randn(2, 1, 2**(i // 2 + 3), 2**(i // 2 + 3)) for i in range(6)]
+        for i, strength in enumerate(noise_strengths):
+            if strength <= 1e-2:
+                noise[i].zero_()
+        expected = gfpgan(x, return_rgb=False, noise=noise)[0]
+        assert fold_noise(decoder, threshold=1e-2) == 4
+        assert [conv.fold_noise for conv in get_noise_convs(decoder)] == [True, True, False, True, False, True, False]
+        output = gfpgan(x, return_rgb=False, noise=noise)[0]
+    assert torch.allclose(output, expected, atol=1e-5)
+
+    noise = NoiseBuffers(decoder)(2)
+    assert [n is None for n in noise] == [True, True, False, True, False, True, False]
+
+
+def test_engine_noise_modes(tiny_gfpgan):
+    x = torch.rand(3, 3, 32, 32) * 2 - 1
+    # buffer: deterministic
+    engine = InferenceEngine(tiny_gfpgan(noise_strengths=[0.1] * 7), noise_mode='buffer', input_size=32)
+    assert torch.equal(engine(x), engine(x))
+    # fold: all the layers are folded, the same as zero noise
+    gfpgan = tiny_gfpgan(noise_strengths=[1e-3] * 7)
+    with torch.no_grad():
+        expected = gfpgan(x, return_rgb=False, noise=[torch.zeros(1, 1, 1, 1)] * 7)[0]
+    engine = InferenceEngine(gfpgan, engine='script', noise_mode='fold', input_size=32)
+    assert torch.allclose(engine(x), expected, atol=1e-5)
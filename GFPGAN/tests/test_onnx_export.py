@@ -0,0 +1,34 @@
+import pytest
+import torch
+
+from gfpgan.engine import OnnxEngine
+from gfpgan.onnx_export import check_onnx, export_onnx, get_stored_noise
+
+onnxruntime = pytest.importorskip('onnxruntime')
+
+
+@pytest.mark.parametrize('noise_mode', ['baked', 'input'])
+def test_export_onnx(tmp_path, noise_mode, tiny_gfpgan):
+    """Round trip of a tiny model: export, then OnnxEngine, with a dynamic batch."""
+    gfpgan = tiny_gfpgan(random_biases=True)
+    onnx_path = str(tmp_path / 'gfpgan.onnx')
+    with pytest.raises(ValueError):
+        export_onnx(gfpgan, onnx_path, noise_mode=f'{noise_mode}s', size=32)
+    export_onnx(gfpgan, onnx_path, noise_mode=noise_mode, size=32)
+    engine = OnnxEngine(onnx_path)
+    assert engine.input_size == 32
+    num_noise = len(get_stored_noise(gfpgan))
+    assert len(engine.noise_inputs) == (num_noise if noise_mode == 'input' else 0)
+
+    # the batch sizes differ from the one of the export
+    assert check_onnx(gfpgan, engine, batch_sizes=(1, 3), atol=1e-4)
+    x = torch.rand(3, 3, 32, 32) * 2 - 1
+    output = engine(x)
+    assert output.shape == (3, 3, 32, 32) and output.dtype == torch.float32
+    with torch.no_grad():
+        expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+    error = (output - expected).abs().max().item()
+    if noise_mode == 'baked':
+        assert error < 1e-4
+    else:  # OnnxEngine gives new random noise, as the eager model
+        assert error > 1e-4
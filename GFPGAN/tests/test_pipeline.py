@@ -0,0 +1,125 @@
+import cv2
+import numpy as np
+import pytest
+import threading
+
+from gfpgan.pipeline import RestorePipeline
+
+
+class DummyRestorer():
+    """A restorer that finds one face per image and inverts it."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def align_faces(self, img, has_aligned=False, only_center_face=False):
+        return [img[:8, :8].copy()], [np.eye(2, 3)]
+
+    def restore_faces(self, cropped_faces):
+        self.batch_sizes.append(len(cropped_faces))
+        return [255 - face for face in cropped_faces]
+
+    def paste_faces(self, img, restored_faces, affine_matrices):
+        img = img.copy()
+        img[:8, :8] = restored_faces[0]
+        return img
+
+
+class FailingRestorer(DummyRestorer):
+    """A restorer whose restoration fails, e.g. out of memory."""
+
+    def restore_faces(self, cropped_faces):
+        raise RuntimeError('CUDA out of memory')
+
+
+def run_with_timeout(pipeline, img_list, save_fn, timeout=60):
+    """Run the pipeline in a thread, so that a dead lock fails the test instead of hanging it."""
+    outcome = {}
+
+    def target():
+        try:
+            outcome['stats'] = pipeline.run(img_list, save_fn)
+        except Exception as error:
+            outcome['error'] = error
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'the pipeline is blocked'
+    return outcome
+
+
+def test_restore_pipeline(tmp_path):
+    """Test the pipelined restoration of a folder of images."""
+    img_list = []
+    for idx in range(10):
+        img_path = str(tmp_path / f'{idx:02d}.png')
+        cv2.imwrite(img_path, np.full((16, 16, 3), idx * 10, dtype=np.uint8))
+        img_list.append(img_path)
+    img_list.append(str(tmp_path / 'missing.png'))  # unreadable image is skipped
+
+    results = {}
+    lock = threading.Lock()
+
+    def save_fn(img_path, cropped_faces, restored_faces, restored_img):
+        with lock:
+            results[img_path] = (cropped_faces, restored_faces, restored_img)
+
+    restorer = DummyRestorer()
+    pipeline = RestorePipeline(restorer, num_readers=3, num_writers=2, queue_size=2, batch_images=4)
+    stats = pipeline.run(img_list, save_fn)
+
+    assert sorted(results.keys()) == img_list[:10]
+    for idx, img_path in enumerate(img_list[:10]):
+        cropped_faces, restored_faces, restored_img = results[img_path]
+        assert len(cropped_faces) == 1 and len(restored_faces) == 1
+        assert np.all(restored_faces[0] == 255 - idx * 10)
+        assert np.all(restored_img[:8, :8] == 255 - idx * 10)
+        assert np.all(restored_img[8:, 8:] == idx * 10)
+    # faces of several images are restored together
+    assert sum(restorer.batch_sizes) == 10
+    assert max(restorer.batch_sizes) <= 4
+
+    assert [stage.name for stage in stats] == ['read', 'detect', 'restore', 'write']
+    assert stats[0].num_items == 11
+    assert stats[1].num_items == 10
+    assert stats[2].num_items == 10
+    assert stats[3].num_items == 10
+
+    # without paste back
+    results.clear()
+    pipeline.run(img_list[:3], save_fn, has_aligned=True)
+    assert sorted(results.keys()) == img_list[:3]
+    assert all(result[2] is None for result in results.values())
+
+
+def test_restore_pipeline_errors(tmp_path, monkeypatch):
+    """The errors of a stage stop all the stages and are raised by run."""
+    img_list = []
+    for idx in range(20):
+        img_path = str(tmp_path / f'{idx:02d}.png')
+        cv2.imwrite(img_path, np.full((16, 16, 3), idx, dtype=np.uint8))
+        img_list.append(img_path)
+    results = []
+
+    pipeline = RestorePipeline(FailingRestorer(), num_readers=2, num_writers=2, queue_size=2, batch_images=2)
+    outcome = run_with_timeout(pipeline, img_list, lambda img_path, *args: results.append(img_path))
+    assert isinstance(outcome['error'], RuntimeError) and 'out of memory' in str(outcome['error'])
+    assert not results
+
+    # an error of the readers
+    imread = cv2.imread
+
+    def failing_imread(img_path, flags):
+        if img_path.endswith('05.png'):
+            raise cv2.error('imread failed')
+        return imread(img_path, flags)
+
+    monkeypatch.setattr(cv2, 'imread', failing_imread)
+    pipeline = RestorePipeline(DummyRestorer(), num_readers=2, num_writers=2, queue_size=2, batch_images=2)
+    outcome = run_with_timeout(pipeline, img_list, lambda img_path, *args: results.append(img_path))
+    assert isinstance(outcome['error'], cv2.error)
+    monkeypatch.undo()
+
+    with pytest.raises(RuntimeError):
+        RestorePipeline(FailingRestorer()).run(img_list[:2], lambda *args: None)
@@ -0,0 +1,70 @@
+import torch
+
+from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
+from gfpgan.pruning import compute_channel_importance, get_channel_map, prune_gfpgan
+
+GFPGAN_OPT = dict(
+    out_size=32,
+    num_style_feat=32,
+    channel_multiplier=1,
+    decoder_load_path=None,
+    fix_decoder=False,
+    num_mlp=2,
+    input_is_latent=True,
+    different_w=True,
+    narrow=0.5,
+    sft_half=True)
+
+
+def test_channel_map():
+    gfpgan = GFPGANv1Clean(**GFPGAN_OPT)
+    channel_map = get_channel_map(gfpgan)
+    assert channel_map == {
+        'unet': {
+            '32': 128,
+            '16': 128,
+            '8': 128,
+            '4': 128
+        },
+        'down': [128, 128, 128],
+        'up': [128, 128, 128],
+        'condition_scale': [128, 128, 128],
+        'condition_shift': [128, 128, 128]
+    }
+    channel_map['unet']['8'] = 16
+    channel_map['down'][1] = 24
+    channel_map['condition_shift'][2] = 8
+    gfpgan = GFPGANv1Clean(**GFPGAN_OPT, channel_map=channel_map)
+    assert get_channel_map(gfpgan) == channel_map
+    # the conditions keep the channels of the decoder
+    assert gfpgan.condition_scale[0][2].out_channels == 128
+    out, _ = gfpgan(torch.rand(1, 3, 32, 32))
+    assert out.shape == (1, 3, 32, 32)
+
+
+def test_prune_gfpgan():
+    torch.manual_seed(0)
+    gfpgan = GFPGANv1Clean(**GFPGAN_OPT).eval()
+    # channels that are not read by the next layers: pruning them does not change the outputs
+    dead = torch.arange(0, 128, 2)
+    gfpgan.conv_body_down[1].conv2.weight.data[:, dead] = 0
+    gfpgan.condition_scale[2][2].weight.data[:, dead] = 0
+    importance = compute_channel_importance(gfpgan, [torch.rand(2, 3, 32, 32) * 2 - 1])
+    assert torch.all(importance[('down', 1)][dead] == 0)
+
+    pruned, channel_map = prune_gfpgan(gfpgan, GFPGAN_OPT, importance, keep_ratio=0.5)
+    assert channel_map['down'] == [64, 64, 64] and channel_map['unet']['16'] == 64
+    assert get_channel_map(pruned) == channel_map
+    # only prune the ResBlock mid channels and the SFT scale branches, whose odd channels are not read
+    for block, branch in zip(gfpgan.conv_body_down, gfpgan.condition_scale):
+        block.conv2.weight.data[:, dead] = 0
+        branch[2].weight.data[:, dead] = 0
+    importance = compute_channel_importance(gfpgan, [torch.rand(2, 3, 32, 32) * 2 - 1])
+    pruned, channel_map = prune_gfpgan(gfpgan, GFPGAN_OPT, importance, keep_ratio=dict(down=0.5, condition_scale=0.5))
+    assert channel_map['down'] == [64, 64, 64] and channel_map['condition_scale'] == [64, 64, 64]
+    assert channel_map['up'] == [128, 128, 128] and channel_map['unet']['16'] == 128
+    x = torch.rand(2, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        expected = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+        output = pruned(x, return_rgb=False, randomize_noise=False)[0]
+    assert torch.allclose(output, expected, atol=1e-5)
@@ -0,0 +1,30 @@
+import torch
+
+from gfpgan.quantization import load_quantized_gfpgan, quantize_gfpgan, save_quantized_gfpgan
+
+
+def test_quantize_gfpgan(tmp_path, tiny_gfpgan):
+    """Test quantize_gfpgan, save_quantized_gfpgan and load_quantized_gfpgan."""
+    torch.manual_seed(0)
+    calib_batches = [torch.rand(2, 3, 32, 32) * 2 - 1 for _ in range(2)]
+    x = torch.rand(2, 3, 32, 32) * 2 - 1
+    with torch.no_grad():
+        expected = tiny_gfpgan(narrow=0.5)(x, return_rgb=False, randomize_noise=False)[0]
+
+    for decoder_mode in ['dynamic', 'weight_only']:
+        gfpgan = quantize_gfpgan(tiny_gfpgan(narrow=0.5), calib_batches, decoder_mode=decoder_mode)
+        with torch.no_grad():
+            output = gfpgan(x, return_rgb=False, randomize_noise=False)[0]
+        assert output.shape == (2, 3, 32, 32)
+        assert (output - expected).abs().mean() < 0.05
+
+        save_path = str(tmp_path / f'{decoder_mode}.pth')
+        quant_config = dict(arch='clean', decoder_mode=decoder_mode, backend='x86', input_size=32)
+        save_quantized_gfpgan(gfpgan, save_path, quant_config)
+        checkpoint = torch.load(save_path)
+        assert (len(checkpoint['weights_int8']) > 0) == (decoder_mode == 'weight_only')
+        gfpgan_loaded = load_quantized_gfpgan(tiny_gfpgan(narrow=0.5), checkpoint)
+        with torch.no_grad():
+            output_loaded = gfpgan_loaded(x, return_rgb=False, randomize_noise=False)[0]
+        # weight-only int8 decoder weights only add a small error
+        assert (output_loaded - output).abs().max() < (1e-5 if decoder_mode == 'dynamic' else 0.05)
@@ -0,0 +1,129 @@
+import cv2
+import http.client
+import numpy as np
+import pytest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gfpgan.service import LatencyHistogram, RestoreService, ServiceBusy, make_server
+
+
+class DummyRestorer():
+    """A restorer that finds one face per image and inverts it."""
+
+    def __init__(self, max_batch=4):
+        self.max_batch = max_batch
+        self.batch_sizes = []
+        self.detecting = threading.Event()
+        self.release = threading.Event()
+        self.release.set()
+
+    def align_faces(self, img, has_aligned=False, only_center_face=False):
+        self.detecting.set()
+        self.release.wait()
+        if has_aligned:
+            return [img], []
+        return [img[:8, :8].copy()], [np.eye(2, 3)]
+
+    def restore_faces(self, cropped_faces):
+        self.batch_sizes.append(len(cropped_faces))
+        return [255 - face for face in cropped_faces]
+
+    def paste_faces(self, img, restored_faces, affine_matrices):
+        img = img.copy()
+        img[:8, :8] = restored_faces[0]
+        return img
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram(buckets=(0.01, 0.1, 1))
+    for value in (0.005, 0.05, 0.05, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 1]
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(1) == float('inf')
+    lines = histogram.render('latency', 'stage="a"')
+    assert lines[1] == 'latency_bucket{stage="a",le="0.1"} 3'
+    assert lines[-1] == 'latency_count{stage="a"} 5'
+
+
+def test_restore_service_batching():
+    """Concurrent requests are restored in dynamic batches."""
+    restorer = DummyRestorer(max_batch=4)
+    service = RestoreService(restorer, max_latency=0.5, queue_size=16)
+    imgs = [np.full((16, 16, 3), idx * 10, dtype=np.uint8) for idx in range(8)]
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(service.restore, imgs))
+    service.close()
+
+    for idx, (cropped_faces, restored_faces, restored_img) in enumerate(results):
+        assert np.all(cropped_faces[0] == idx * 10)
+        assert np.all(restored_faces[0] == 255 - idx * 10)
+        assert np.all(restored_img[:8, :8] == 255 - idx * 10)
+        assert np.all(restored_img[8:, 8:] == idx * 10)
+    assert sum(restorer.batch_sizes) == 8
+    assert max(restorer.batch_sizes) <= 4
+    assert len(restorer.batch_sizes) < 8
+    assert service.num_requests == {'ok': 8, 'rejected': 0, 'failed': 0}
+    assert service.histograms['total'].count == 8
+
+
+def test_restore_service_busy():
+    """Requests are rejected when the queue is full."""
+    restorer = DummyRestorer()
+    restorer.release.clear()
+    service = RestoreService(restorer, max_latency=0, queue_size=1)
+    img = np.zeros((16, 16, 3), dtype=np.uint8)
+    futures = [service.submit(img)]
+    restorer.detecting.wait()  # the first request is being detected
+    futures.append(service.submit(img))
+    with pytest.raises(ServiceBusy):
+        service.submit(img)
+    restorer.release.set()
+    for future in futures:
+        assert np.all(future.result().restored_faces[0] == 255)
+    service.close()
+    assert service.num_requests == {'ok': 2, 'rejected': 1, 'failed': 0}
+
+
+def test_restore_server():
+    service = RestoreService(DummyRestorer(), max_latency=0)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=10)
+
+    img = np.full((16, 16, 3), 100, dtype=np.uint8)
+    conn.request('POST', '/restore?ext=png', body=cv2.imencode('.png', img)[1].tobytes())
+    response = conn.getresponse()
+    assert response.status == 200
+    restored_img = cv2.imdecode(np.frombuffer(response.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert np.all(restored_img[:8, :8] == 155) and np.all(restored_img[8:, 8:] == 100)
+
+    conn.request('POST', '/restore?aligned=1', body=cv2.imencode('.png', img[:8, :8])[1].tobytes())
+    response = conn.getresponse()
+    assert response.status == 200
+    restored_face = cv2.imdecode(np.frombuffer(response.read(), dtype=np.uint8), cv2.IMREAD_COLOR)
+    assert restored_face.shape == (8, 8, 3) and np.all(restored_face == 155)
+
+    conn.request('POST', '/restore', body=b'not an image')
+    response = conn.getresponse()
+    assert response.status == 400
+    response.read()
+
+    conn.request('POST', '/restore?ext=foo', body=cv2.imencode('.png', img)[1].tobytes())
+    response = conn.getresponse()
+    assert response.status == 400 and b'unsupported ext' in response.read()
+
+    conn.request('GET', '/metrics')
+    response = conn.getresponse()
+    metrics = response.read().decode()
+    assert response.status == 200
+    assert 'gfpgan_stage_latency_seconds_count{stage="total"} 2' in metrics
+    assert 'gfpgan_queue_depth{queue="request"} 0' in metrics
+    assert 'gfpgan_requests_total{status="ok"} 2' in metrics
+
+    conn.close()
+    server.shutdown()
+    server.server_close()
+    service.close()
@@ -1,6 +1,9 @@
+import pytest
 import torch
 
-from gfpgan.archs.stylegan2_clean_arch import StyleGAN2GeneratorClean
+from gfpgan.archs import stylegan2_bilinear_arch
+from gfpgan.archs.stylegan2_clean_arch import (ModulatedConv2d, StyleGAN2GeneratorClean, select_modulated_conv_strategy,
+                                               set_modulated_conv_strategy)
 
 
 def test_stylegan2generatorclean():
@@ -50,3 +53,55 @@ def test_stylegan2generatorclean():
         # ------------------ test mean_latent ----------------------- #
         out = net.mean_latent(2)
         assert out.shape == (1, 512)
+
+
+@pytest.mark.parametrize('conv_cls', [ModulatedConv2d, stylegan2_bilinear_arch.ModulatedConv2d])
+@pytest.mark.parametrize('sample_mode', [None, 'upsample'])
+def test_modulated_conv_strategies(conv_cls, sample_mode):
+    """The grouped and activation scaling strategies of ModulatedConv2d give the same outputs."""
+    conv = conv_cls(16, 8, 3, num_style_feat=32, sample_mode=sample_mode).eval()
+    x = torch.randn(3, 16, 8, 8)
+    style = torch.randn(3, 32)
+    with torch.no_grad():
+        conv.strategy = 'grouped'
+        out_grouped = conv(x, style)
+        conv.strategy = 'activation'
+        out_activation = conv(x, style)
+    assert out_grouped.shape == ((3, 8, 16, 16) if sample_mode else (3, 8, 8, 8))
+    assert torch.allclose(out_grouped, out_activation, atol=1e-5)
+
+
+def test_select_modulated_conv_strategy():
+    # low resolution and many channels: the modulated weights are much larger than the activations
+    assert select_modulated_conv_strategy(4, 512, 512, 3, 8 * 8, 8 * 8) == 'activation'
+    # high resolution and few channels
+    assert select_modulated_conv_strategy(4, 64, 64, 3, 512 * 512, 512 * 512) == 'grouped'
+
+    net = StyleGAN2GeneratorClean(out_size=32, num_style_feat=64, num_mlp=2, channel_multiplier=1, narrow=0.5).eval()
+    style = torch.rand((2, 64))
+    with torch.no_grad():
+        out_auto = net([style], randomize_noise=False)[0]
+        out_grouped = set_modulated_conv_strategy(net, 'grouped')([style], randomize_noise=False)[0]
+    assert all(conv.strategy == 'grouped' for conv in net.modules() if isinstance(conv, ModulatedConv2d))
+    assert torch.allclose(out_auto, out_grouped, atol=1e-4)
+    with pytest.raises(ValueError):
+        set_modulated_conv_strategy(net, 'winograd')
+
+
+def test_fuse_modulations():
+    """The fused style modulation gives the same outputs, with one latent per layer or style mixing."""
+    net = StyleGAN2GeneratorClean(out_size=64, num_style_feat=64, num_mlp=2, channel_multiplier=1, narrow=0.5).eval()
+    latent = torch.randn((2, net.num_latent, 64))
+    styles = [torch.rand((2, 64)), torch.rand((2, 64))]
+    with torch.no_grad():
+        out = net([latent], input_is_latent=True, randomize_noise=False)[0]
+        out_mixing = net(styles, inject_index=3, randomize_noise=False)[0]
+        net.fuse_modulations()
+        # the input channels are 256 up to the first conv of 64x64, then 128
+        assert [indices for indices, _ in net.fused_groups] == [list(range(12)), [12, 13]]
+        assert net.fused_modulations.weight1.shape == (2, 128, 64)
+        assert not any(key.startswith('fused_modulations.') for key in net.state_dict())
+        out_fused = net([latent], input_is_latent=True, randomize_noise=False)[0]
+        out_mixing_fused = net(styles, inject_index=3, randomize_noise=False)[0]
+    assert torch.allclose(out, out_fused, atol=1e-5)
+    assert torch.allclose(out_mixing, out_mixing_fused, atol=1e-5)
@@ -1,9 +1,14 @@
 import cv2
+import numpy as np
+import pytest
+import torch
+from basicsr.utils import img2tensor, tensor2img
 from facexlib.utils.face_restoration_helper import FaceRestoreHelper
+from torchvision.transforms.functional import normalize
 
 from gfpgan.archs.gfpganv1_arch import GFPGANv1
 from gfpgan.archs.gfpganv1_clean_arch import GFPGANv1Clean
-from gfpgan.utils import GFPGANer
+from gfpgan.utils import GFPGANer, faces2tensor, tensor2faces
 
 
 def test_gfpganer():
@@ -17,6 +22,17 @@ def test_gfpganer():
     # test attribute
     assert isinstance(restorer.gfpgan, GFPGANv1Clean)
     assert isinstance(restorer.face_helper, FaceRestoreHelper)
+    assert restorer.gfpgan.stylegan_decoder.modulations_fused
+
+    # without the rewrites of the model
+    restorer = GFPGANer(
+        model_path='experiments/pretrained_models/GFPGANCleanv1-NoCE-C2.pth',
+        upscale=2,
+        arch='clean',
+        channel_multiplier=2,
+        bg_upsampler=None,
+        optimize=False)
+    assert not restorer.gfpgan.stylegan_decoder.modulations_fused
 
     # initialize with the original model
     restorer = GFPGANer(
@@ -41,3 +57,57 @@ def test_gfpganer():
     assert result[0][0].shape == (512, 512, 3)
     assert result[1][0].shape == (512, 512, 3)
     assert result[2] is None
+
+
+def test_faces2tensor_tensor2faces():
+    """Test the batched conversions against the per-face conversions."""
+    faces = [np.random.randint(0, 256, (32, 32, 3), dtype=np.uint8) for _ in range(3)]
+
+    # faces -> tensor
+    faces_t = faces2tensor(faces)
+    assert faces_t.shape == (3, 3, 32, 32)
+    assert faces_t.is_contiguous()
+    for face, face_t in zip(faces, faces_t):
+        expected = img2tensor(face / 255., bgr2rgb=True, float32=True)
+        normalize(expected, (0.5, 0.5, 0.5), (0.5, 0.5, 0.5), inplace=True)
+        assert torch.allclose(face_t, expected, atol=1e-6)
+
+    # tensor -> faces
+    output = torch.rand((3, 3, 32, 32)) * 2.2 - 1.1  # include values out of range
+    restored_faces = tensor2faces(output)
+    assert len(restored_faces) == 3
+    for restored_face, out in zip(restored_faces, output):
+        expected = tensor2img(out, rgb2bgr=True, min_max=(-1, 1)).astype('uint8')
+        assert restored_face.dtype == np.uint8
+        assert np.abs(restored_face.astype(int) - expected.astype(int)).max() <= 1
+
+
+class FailingEngine():
+    """An engine that fails on the batches with a black face, and inverts the faces otherwise."""
+
+    device = torch.device('cpu')
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def __call__(self, faces_t):
+        self.batch_sizes.append(faces_t.size(0))
+        if (faces_t == -1).flatten(1).all(1).any():
+            raise RuntimeError('CUDA out of memory')
+        return -faces_t
+
+
+def test_restore_faces_fallback():
+    """A failed batch is retried face by face, and only the failed faces are not restored."""
+    with pytest.raises(ValueError):
+        GFPGANer('unused.pth', max_batch=0)
+
+    restorer = GFPGANer.__new__(GFPGANer)
+    restorer.max_batch = 3
+    restorer.engine = FailingEngine()
+    faces = [np.full((8, 8, 3), value, dtype=np.uint8) for value in (10, 0, 20, 30)]
+    restored_faces = restorer.restore_faces(faces)
+
+    assert [int(face[0, 0, 0]) for face in restored_faces] == [245, 0, 235, 225]
+    # the first batch fails, then its faces are restored one by one
+    assert restorer.engine.batch_sizes == [3, 1, 1, 1, 1]
@@ -0,0 +1,84 @@
+import cv2
+import numpy as np
+import types
+
+from gfpgan.video import LandmarkTracker, VideoFaceRestorer, read_raw_frames
+
+
+def make_frame(shift_x=0, shift_y=0, seed=0):
+    """A smooth random texture, shifted by (shift_x, shift_y) pixels."""
+    rng = np.random.RandomState(seed)
+    texture = cv2.GaussianBlur(rng.randint(0, 256, (160, 160)).astype(np.uint8), (7, 7), 0)
+    matrix = np.float32([[1, 0, shift_x], [0, 1, shift_y]])
+    return cv2.warpAffine(texture, matrix, (160, 160), borderMode=cv2.BORDER_REFLECT)
+
+
+def test_landmark_tracker():
+    """Test tracking landmarks and detecting scene changes."""
+    tracker = LandmarkTracker(scene_threshold=30)
+    landmarks = np.array([[60, 60], [100, 60], [80, 80], [65, 100], [95, 100]], dtype=np.float32)
+
+    gray = make_frame()
+    assert tracker.is_scene_change(gray)  # no previous frame
+    assert tracker.track(gray) is None
+    tracker.set_frame(gray, [landmarks])
+
+    next_gray = make_frame(shift_x=3, shift_y=2)
+    assert not tracker.is_scene_change(next_gray)
+    tracked = tracker.track(next_gray)
+    assert len(tracked) == 1
+    np.testing.assert_allclose(tracked[0], landmarks + [3, 2], atol=0.5)
+
+    # a totally different frame is a scene change
+    assert tracker.is_scene_change(gray // 4)
+
+    # no faces
+    tracker.set_frame(gray, [])
+    assert tracker.track(next_gray) == []
+
+
+class DummyRestorer():
+    """A restorer with a fixed face, that records which frames are detected."""
+
+    def __init__(self):
+        self.face_helper = types.SimpleNamespace(all_landmarks_5=[])
+        self.detected = []
+        self.num_frames = 0
+
+    def align_faces(self, img, has_aligned=False, only_center_face=False, landmarks=None):
+        if landmarks is None:
+            self.detected.append(self.num_frames)
+            landmarks = [np.array([[60, 60], [100, 60], [80, 80], [65, 100], [95, 100]], dtype=np.float32)]
+            self.face_helper.all_landmarks_5 = landmarks
+        self.num_frames += 1
+        return [img[:8, :8]], [np.eye(2, 3)]
+
+    def restore_faces(self, cropped_faces):
+        return cropped_faces
+
+    def paste_faces(self, img, restored_faces, affine_matrices):
+        return img
+
+
+def test_video_face_restorer():
+    """Test that the face detection only runs every K frames and at scene changes."""
+    frames = [cv2.cvtColor(make_frame(shift_x=i), cv2.COLOR_GRAY2BGR) for i in range(12)]
+    frames += [cv2.cvtColor(make_frame(shift_x=i, seed=1) // 4, cv2.COLOR_GRAY2BGR) for i in range(3)]
+    restorer = DummyRestorer()
+    video_restorer = VideoFaceRestorer(restorer, detect_interval=5)
+    restored_frames = list(video_restorer.restore(frames))
+
+    assert len(restored_frames) == 15
+    assert restorer.detected == [0, 5, 10, 12]  # every 5 frames, and the scene change at frame 12
+    assert video_restorer.num_frames == 15
+    assert video_restorer.num_detections == 4
+
+
+def test_read_raw_frames(tmp_path):
+    frames = np.random.randint(0, 256, (3, 4, 6, 3), dtype=np.uint8)
+    raw_path = tmp_path / 'frames.raw'
+    raw_path.write_bytes(frames.tobytes() + b'\x00' * 10)  # with an incomplete frame at the end
+    with open(raw_path, 'rb') as stream:
+        read_frames = list(read_raw_frames(stream, width=6, height=4))
+    assert len(read_frames) == 3
+    np.testing.assert_array_equal(np.stack(read_frames), frames)